@@ -1,8 +1,54 @@
-from flask import Flask, request, jsonify, abort
+import io
+import json
+import os
+from itertools import islice
+from flask import Flask, Response, request, jsonify, abort, url_for
+from product_cache import EncodedProductCache
+from search_index import ProductIndex, SEARCH_FIELDS
+from sqlite_store import SQLiteProductStore
+from storage import ProductStore
+
+# Каталог со снимком и журналом продуктов
+DATA_DIR = os.environ.get("PRODUCTS_DATA_DIR",
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+# Режим fsync журнала: always, batch, interval или off (см. storage.py)
+FSYNC_MODE = os.environ.get("PRODUCTS_FSYNC", "batch")
+# Хранилище: wal — в памяти с журналом, только для одного процесса;
+# sqlite — общая база для нескольких рабочих процессов (gunicorn -w N app:app)
+STORE_KIND = os.environ.get("PRODUCTS_STORE", "wal")
+STORES = ("wal", "sqlite")
+SQLITE_FILE = "products.sqlite3"
+MAX_PAGE_SIZE = 1000  # наибольший limit в GET /products
+STREAM_CHUNK = 100  # продуктов в одном куске потокового ответа
+NDJSON_MIMETYPE = "application/x-ndjson"
+SEARCH_LIMIT = 100  # limit в /products/search по умолчанию
+SEARCH_MODES = ("prefix", "substring")
+BULK_OPS = ("create", "update", "delete")
+BULK_READ_BUFFER = 64 * 1024  # буфер чтения тела NDJSON
+PRODUCT_CACHE_SIZE = 100000  # сколько закодированных продуктов держать для GET /product
+# Кодировщик тела продукта: продукт выглядит одинаково во всех ответах
+# и в кэше, независимо от порядка полей в хранилище
+PRODUCT_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
 
 app = Flask("lab02")
-products_dict = {}
-current_id = 0  
+
+
+def open_store(kind=STORE_KIND):
+    """Хранилище продуктов выбранного вида.
+
+    Хранилища взаимозаменяемы: get, iter_products, create, update,
+    delete, apply и changes_since у них ведут себя одинаково.
+    """
+    if kind == "wal":
+        return ProductStore(DATA_DIR, fsync=FSYNC_MODE)
+    if kind == "sqlite":
+        return SQLiteProductStore(os.path.join(DATA_DIR, SQLITE_FILE), fsync=FSYNC_MODE)
+    raise ValueError(f"unknown store {kind!r}, expected one of: {', '.join(STORES)}")
+
+
+store = open_store()
+search_index = ProductIndex(store)
+product_cache = EncodedProductCache(PRODUCT_CACHE_SIZE)
 
 
 @app.errorhandler(404)
@@ -10,10 +56,21 @@ def not_found(e):
     return jsonify({"error": "Product not found"}), 404
 
 
+def encode_product(product):
+    return PRODUCT_ENCODER.encode(product)
+
+
+def product_body(product):
+    """Тело ответа с одним продуктом"""
+    return (encode_product(product) + "\n").encode()
+
+
+def product_response(product, status=200):
+    return Response(product_body(product), status, mimetype="application/json")
+
+
 @app.route("/product", methods=["POST"])
 def add_product():
-    global current_id
-
     if not request.is_json:
         return jsonify({"error": "Request body must be JSON"}), 400
 
@@ -24,27 +81,34 @@ def add_product():
     if not name:
         return jsonify({"error": "Field 'name' is required"}), 400
 
-    
-    current_id += 1
-    new_product_id = current_id
-
-    new_product = {
-        "id": new_product_id,
-        "name": name,
-        "description": description if description else ""
-    }
+    new_product = store.create(name, description if description else "")
+    search_index.refresh(new_product["id"])
 
-    products_dict[new_product_id] = new_product
-
-    return jsonify(new_product), 201
+    return product_response(new_product, 201)
 
 @app.route("/product/<int:product_id>", methods=["GET"])
 def get_product(product_id):
+    """Продукт с ETag по номеру его версии.
 
-    product = products_dict.get(product_id)
+    Если клиент прислал If-None-Match с текущим ETag, отвечаем 304 без
+    тела. Закодированный JSON продукта берется из кэша, пока версия
+    продукта не изменилась.
+    """
+    product, version = store.versioned(product_id)
     if not product:
         abort(404)
-    return jsonify(product), 200
+
+    etag = f"{product_id}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        body = product_cache.get(product_id, version)
+        if body is None:
+            body = product_body(product)
+            product_cache.put(product_id, version, body)
+        response = Response(body, 200, mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 
 @app.route("/product/<int:product_id>", methods=["PUT"])
@@ -52,33 +116,208 @@ def update_product(product_id):
     if not request.is_json:
         return jsonify({"error": "Request body must be JSON"}), 400
 
-    product = products_dict.get(product_id)
-    if not product:
+    if not store.get(product_id):
         abort(404)
 
     data = request.get_json()
 
-    
-    if "name" in data:
-        product["name"] = data["name"]
-    if "description" in data:
-        product["description"] = data["description"]
-
-    products_dict[product_id] = product
-    return jsonify(product), 200
+    fields = {key: data[key] for key in ("name", "description") if key in data}
+    product = store.update(product_id, fields)
+    if not product:
+        abort(404)
+    product_cache.invalidate(product_id)
+    search_index.refresh(product_id)
+    return product_response(product)
 
 @app.route("/product/<int:product_id>", methods=["DELETE"])
 def delete_product(product_id):
-    product = products_dict.pop(product_id, None)
+    product = store.delete(product_id)
     if not product:
         abort(404)
-    return jsonify(product), 200
+    product_cache.invalidate(product_id)
+    search_index.refresh(product_id)
+    return product_response(product)
+
+def int_arg(name, minimum, maximum=None):
+    """Целый параметр запроса; None, если его нет. ValueError, если он неверный"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    value = int(value)
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(name)
+    return value
+
+
+def json_array_chunks(products):
+    """Кодирует продукты в JSON-массив по кускам, не собирая его целиком"""
+    yield "["
+    first = True
+    while True:
+        chunk = [encode_product(product) for product in islice(products, STREAM_CHUNK)]
+        if not chunk:
+            break
+        yield ("" if first else ",") + ",".join(chunk)
+        first = False
+    yield "]\n"
+
+
+def ndjson_chunks(products):
+    """Кодирует продукты в NDJSON: по одному объекту в строке"""
+    while True:
+        chunk = [encode_product(product) + "\n" for product in islice(products, STREAM_CHUNK)]
+        if not chunk:
+            break
+        yield "".join(chunk)
+
 
 @app.route("/products", methods=["GET"])
 def get_all_products():
-    return jsonify(list(products_dict.values())), 200
+    """Список продуктов по возрастанию id.
+
+    Ответ отдается потоком из генератора, так что память не растет вместе
+    с каталогом. limit и after_id включают постраничную выдачу: страница
+    содержит до limit продуктов с id больше after_id, а ссылка на следующую
+    страницу передается в заголовке Link. format=ndjson (или Accept:
+    application/x-ndjson) отдает продукты по одному в строке.
+    """
+    try:
+        limit = int_arg("limit", 1, MAX_PAGE_SIZE)
+        after_id = int_arg("after_id", 0) or 0
+    except ValueError:
+        return jsonify({"error": f"'limit' must be an integer from 1 to {MAX_PAGE_SIZE}, "
+                                 "'after_id' a non-negative integer"}), 400
+
+    ndjson = (request.args.get("format") == "ndjson"
+              or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+    products = store.iter_products(after_id)
+    headers = {}
+    if limit is not None:
+        page = list(islice(products, limit + 1))
+        if len(page) > limit:
+            page = page[:limit]
+            args = {"limit": limit, "after_id": page[-1]["id"]}
+            if "format" in request.args:
+                args["format"] = request.args["format"]
+            headers["Link"] = f'<{url_for("get_all_products", **args)}>; rel="next"'
+        products = iter(page)
+
+    if ndjson:
+        return Response(ndjson_chunks(products), 200, headers, mimetype=NDJSON_MIMETYPE)
+    return Response(json_array_chunks(products), 200, headers, mimetype="application/json")
+
+
+@app.route("/products/search", methods=["GET"])
+def search_products():
+    """Поиск продуктов по q в name и description, по возрастанию id.
+
+    mode=prefix (по умолчанию) ищет слова, начинающиеся со слов запроса,
+    mode=substring — запрос как подстроку. field=name или description
+    ограничивает поиск одним полем.
+    """
+    query = request.args.get("q", "")
+    mode = request.args.get("mode", "prefix")
+    field = request.args.get("field")
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"'mode' must be one of: {', '.join(SEARCH_MODES)}"}), 400
+    if field is not None and field not in SEARCH_FIELDS:
+        return jsonify({"error": f"'field' must be one of: {', '.join(SEARCH_FIELDS)}"}), 400
+    try:
+        limit = int_arg("limit", 1, MAX_PAGE_SIZE) or SEARCH_LIMIT
+    except ValueError:
+        return jsonify({"error": f"'limit' must be an integer from 1 to {MAX_PAGE_SIZE}"}), 400
+
+    try:
+        ids = search_index.search(query, mode, (field,) if field else SEARCH_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    products = filter(None, (store.get(product_id) for product_id in ids))
+    return Response(json_array_chunks(islice(products, limit)), 200, mimetype="application/json")
+
+
+def parse_operation(item):
+    """Операция пакета в виде (op, id, fields) для store.apply; ValueError, если она неверна"""
+    if not isinstance(item, dict):
+        raise ValueError("Operation must be a JSON object")
+    op = item.get("op", "create")
+    if op not in BULK_OPS:
+        raise ValueError(f"Field 'op' must be one of: {', '.join(BULK_OPS)}")
+    if op == "create":
+        if not item.get("name"):
+            raise ValueError("Field 'name' is required")
+        description = item.get("description")
+        return op, None, {"name": item["name"], "description": description if description else ""}
+
+    product_id = item.get("id")
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        raise ValueError("Field 'id' must be an integer")
+    if op == "update":
+        return op, product_id, {key: item[key] for key in ("name", "description") if key in item}
+    return op, product_id, None
+
+
+def ndjson_items(stream):
+    """Объекты из потока NDJSON по одному, без чтения потока целиком"""
+    # Без буфера readline читает сырой поток запроса почти по байту
+    for line in io.BufferedReader(stream, BULK_READ_BUFFER):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError("Invalid JSON")
+
+
+@app.route("/products/bulk", methods=["POST"])
+def bulk_products():
+    """Пакет операций create, update и delete: JSON-массив или поток NDJSON.
+
+    Операция — объект с полем op (по умолчанию create) и полями как у
+    одиночных запросов, для update и delete — с id. Все операции
+    выполняются за один проход с одним fsync журнала; NDJSON читается
+    из тела запроса по мере выполнения, так что импорт любого размера
+    не держит тело в памяти. Для каждой операции возвращается статус,
+    как у одиночного запроса, и id продукта или текст ошибки.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        items = ndjson_items(request.stream)
+    elif request.is_json:
+        items = request.get_json()
+        if not isinstance(items, list):
+            return jsonify({"error": "Request body must be a JSON array of operations"}), 400
+    else:
+        return jsonify({"error": f"Request body must be JSON or {NDJSON_MIMETYPE}"}), 400
+
+    results = []
+    accepted = []  # результаты операций, переданных в хранилище, по порядку
+
+    def operations():
+        for index, item in enumerate(items):
+            result = {"index": index}
+            results.append(result)
+            try:
+                if isinstance(item, ValueError):
+                    raise item
+                operation = parse_operation(item)
+            except ValueError as e:
+                result.update(status=400, error=str(e))
+                continue
+            result["op"] = operation[0]
+            accepted.append(result)
+            yield operation
 
+    products = store.apply(operations())
+    for result, product in zip(accepted, products):
+        if product is None:
+            result.update(status=404, error="Product not found")
+            continue
+        result.update(status=201 if result["op"] == "create" else 200, id=product["id"])
+        product_cache.invalidate(product["id"])
+        search_index.refresh(product["id"])
 
-app.run(debug=True)
+    failed = sum(1 for result in results if result["status"] >= 400)
+    return jsonify({"results": results, "succeeded": len(results) - failed, "failed": failed}), 200
 
 
+if __name__ == "__main__":
+    app.run(debug=True)
@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+
+
+class EncodedProductCache:
+    """Готовые тела JSON-ответов для продуктов, по номеру версии продукта.
+
+    Запись годится, только пока версия продукта в хранилище совпадает
+    с версией, для которой тело было закодировано, — поэтому кэш не
+    отдает устаревший продукт, даже если его изменил другой рабочий
+    процесс. invalidate после PUT и DELETE лишь сразу освобождает
+    память. Когда записей больше max_entries, вытесняются давно
+    не читавшиеся.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # id -> (версия, тело ответа)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product_id, version):
+        with self.lock:
+            entry = self.entries.get(product_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(product_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, product_id, version, body):
+        with self.lock:
+            entry = self.entries.get(product_id)
+            if entry is not None and entry[0] > version:
+                # Другой поток уже закодировал более новую версию
+                return
+            self.entries[product_id] = (version, body)
+            self.entries.move_to_end(product_id)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, product_id):
+        with self.lock:
+            self.entries.pop(product_id, None)
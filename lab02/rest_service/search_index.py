@@ -0,0 +1,159 @@
+import bisect
+import re
+import threading
+
+SEARCH_FIELDS = ("name", "description")  # по каким полям продукта ищем
+MIN_SUBSTRING = 3  # поиск подстроки идет по триграммам, короче искать нечем
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(value):
+    return "" if value is None else str(value).lower()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class FieldIndex:
+    """Индекс одного поля: слова для поиска по префиксу и триграммы для подстрок"""
+
+    def __init__(self):
+        self.texts = {}  # id -> текст поля в нижнем регистре
+        self.words = {}  # слово -> id продуктов
+        self.sorted_words = []  # те же слова по алфавиту, для поиска префикса
+        self.trigrams = {}  # триграмма -> id продуктов
+
+    def add(self, product_id, text):
+        self.texts[product_id] = text
+        for word in set(WORD_RE.findall(text)):
+            ids = self.words.get(word)
+            if ids is None:
+                ids = self.words[word] = set()
+                bisect.insort(self.sorted_words, word)
+            ids.add(product_id)
+        for trigram in trigrams(text):
+            self.trigrams.setdefault(trigram, set()).add(product_id)
+
+    def remove(self, product_id):
+        text = self.texts.pop(product_id, None)
+        if text is None:
+            return
+        for word in set(WORD_RE.findall(text)):
+            ids = self.words[word]
+            ids.discard(product_id)
+            if not ids:
+                del self.words[word]
+                del self.sorted_words[bisect.bisect_left(self.sorted_words, word)]
+        for trigram in trigrams(text):
+            ids = self.trigrams[trigram]
+            ids.discard(product_id)
+            if not ids:
+                del self.trigrams[trigram]
+
+    def prefix(self, term):
+        """id продуктов, в поле которых есть слово, начинающееся с term"""
+        result = set()
+        start = bisect.bisect_left(self.sorted_words, term)
+        for word in self.sorted_words[start:]:
+            if not word.startswith(term):
+                break
+            result |= self.words[word]
+        return result
+
+    def substring(self, query):
+        """id продуктов, в поле которых есть подстрока query (не короче MIN_SUBSTRING)"""
+        postings = sorted((self.trigrams.get(trigram, set()) for trigram in trigrams(query)),
+                          key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            if not candidates:
+                break
+            candidates &= ids
+        # Все триграммы на месте еще не значит, что они идут подряд: проверяем текст
+        return {product_id for product_id in candidates if query in self.texts[product_id]}
+
+
+class ProductIndex:
+    """Поисковый индекс по name и description продуктов из хранилища.
+
+    Стоимость поиска пропорциональна числу найденных продуктов и
+    подходящих слов, а не размеру каталога. После каждого изменения
+    продукта обработчик вызывает refresh: индекс сам перечитывает
+    продукт из хранилища, поэтому одновременные изменения одного
+    продукта не оставят в индексе устаревший текст.
+
+    Изменения, сделанные другими рабочими процессами с общим
+    хранилищем, индекс забирает перед каждым поиском через
+    store.changes_since.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.rebuild()
+
+    def rebuild(self):
+        """Строит индекс заново по всем продуктам хранилища"""
+        fields = {field: FieldIndex() for field in SEARCH_FIELDS}
+        # Курсор берется до обхода: изменения во время обхода применятся повторно
+        cursor = self.store.change_cursor()
+        with self.lock:
+            self.fields = fields
+            self.cursor = cursor
+            for product in self.store.iter_products():
+                self._add(product)
+
+    def _add(self, product):
+        for field, index in self.fields.items():
+            index.add(product["id"], normalize(product.get(field)))
+
+    def refresh(self, product_id):
+        """Приводит индекс продукта к его текущему состоянию в хранилище"""
+        with self.lock:
+            self._refresh(product_id)
+
+    def _refresh(self, product_id):
+        for index in self.fields.values():
+            index.remove(product_id)
+        product = self.store.get(product_id)
+        if product is not None:
+            self._add(product)
+
+    def catch_up(self):
+        """Применяет изменения, сделанные в хранилище другими процессами"""
+        with self.lock:
+            changes = self.store.changes_since(self.cursor)
+            if changes is not None:
+                self.cursor, product_ids = changes
+                for product_id in product_ids:
+                    self._refresh(product_id)
+                return
+        self.rebuild()
+
+    def search(self, query, mode="prefix", fields=SEARCH_FIELDS):
+        """Отсортированные id продуктов, подходящих под запрос хотя бы в одном из полей.
+
+        mode="prefix": каждое слово запроса — начало какого-то слова поля.
+        mode="substring": весь запрос встречается в поле как подстрока.
+        """
+        query = normalize(query)
+        if mode == "substring" and len(query) < MIN_SUBSTRING:
+            raise ValueError(f"substring query must be at least {MIN_SUBSTRING} characters")
+        terms = WORD_RE.findall(query)
+        self.catch_up()
+        result = set()
+        with self.lock:
+            for field in fields:
+                index = self.fields[field]
+                if mode == "substring":
+                    result |= index.substring(query)
+                elif terms:
+                    matched = index.prefix(terms[0])
+                    for term in terms[1:]:
+                        if not matched:
+                            break
+                        matched &= index.prefix(term)
+                    result |= matched
+        return sorted(result)
@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from storage import BULK_CHUNK, FSYNC_MODES, ITER_BATCH
+
+# Режим fsync из storage.py -> PRAGMA synchronous
+SYNCHRONOUS = {'always': 'FULL', 'batch': 'FULL', 'interval': 'NORMAL', 'off': 'OFF'}
+BUSY_TIMEOUT = 10  # сколько ждать базу, занятую записью другого процесса, секунды
+CHANGES_KEEP = 100000  # сколько последних изменений хранить для changes_since
+CHANGES_PRUNE_EVERY = 1000  # как часто удалять старые изменения, в изменениях
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL
+);
+"""
+
+
+def row_product(product_id, data):
+    return {"id": product_id, **json.loads(data)}
+
+
+class SQLiteProductStore:
+    """Продукты в базе SQLite — то же, что ProductStore, но для нескольких процессов.
+
+    Все рабочие процессы сервера открывают один файл базы. id выдает
+    сама база (AUTOINCREMENT) внутри транзакции BEGIN IMMEDIATE, поэтому
+    они уникальны между процессами, а изменение одного продукта
+    не теряется при одновременных PUT. Каждое изменение записывается
+    в таблицу changes, по которой процессы догоняют свои индексы
+    поиска (см. changes_since).
+
+    У каждого потока и процесса свое соединение: соединения SQLite
+    нельзя делить между потоками и переносить через fork.
+    """
+
+    def __init__(self, path, fsync='batch'):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f'unknown fsync mode: {fsync!r}')
+        self.path = path
+        self.synchronous = SYNCHRONOUS[fsync]
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._db()
+        # WAL SQLite: чтение не ждет записи, запись не ждет чтения
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        columns = [row[1] for row in db.execute('PRAGMA table_info(products)')]
+        if 'version' not in columns:
+            # База из версии без номеров версий продуктов
+            db.execute('ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            db.execute(f'PRAGMA synchronous={self.synchronous}')
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE сразу берет блокировку записи: чтение и запись продукта
+        # в update не перемешаются с изменением из другого процесса
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def get(self, product_id):
+        row = self._db().execute('SELECT data FROM products WHERE id = ?',
+                                 (product_id,)).fetchone()
+        return None if row is None else row_product(product_id, row[0])
+
+    def versioned(self, product_id):
+        """Продукт и номер его версии; (None, None), если продукта нет"""
+        row = self._db().execute('SELECT data, version FROM products WHERE id = ?',
+                                 (product_id,)).fetchone()
+        if row is None:
+            return None, None
+        return row_product(product_id, row[0]), row[1]
+
+    def all(self):
+        return list(self.iter_products())
+
+    def iter_products(self, after_id=0):
+        """Продукты с id больше after_id по возрастанию id, запросами по ITER_BATCH"""
+        while True:
+            rows = self._db().execute(
+                'SELECT id, data FROM products WHERE id > ? ORDER BY id LIMIT ?',
+                (after_id, ITER_BATCH)).fetchall()
+            if not rows:
+                return
+            for product_id, data in rows:
+                yield row_product(product_id, data)
+            after_id = rows[-1][0]
+
+    # _create, _update и _delete вызываются внутри транзакции и возвращают
+    # продукт или None, если его нет
+
+    def _changed(self, db, product_id):
+        seq = db.execute('INSERT INTO changes (product_id) VALUES (?)', (product_id,)).lastrowid
+        if seq % CHANGES_PRUNE_EVERY == 0:
+            db.execute('DELETE FROM changes WHERE seq <= ?', (seq - CHANGES_KEEP,))
+
+    def _create(self, db, name, description):
+        fields = {"name": name, "description": description}
+        product_id = db.execute('INSERT INTO products (data) VALUES (?)',
+                                (json.dumps(fields),)).lastrowid
+        self._changed(db, product_id)
+        return {"id": product_id, **fields}
+
+    def _update(self, db, product_id, fields):
+        row = db.execute('SELECT data FROM products WHERE id = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        product = dict(row_product(product_id, row[0]), **fields)
+        stored = {key: value for key, value in product.items() if key != "id"}
+        db.execute('UPDATE products SET data = ?, version = version + 1 WHERE id = ?',
+                   (json.dumps(stored), product_id))
+        self._changed(db, product_id)
+        return product
+
+    def _delete(self, db, product_id):
+        row = db.execute('SELECT data FROM products WHERE id = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        db.execute('DELETE FROM products WHERE id = ?', (product_id,))
+        self._changed(db, product_id)
+        return row_product(product_id, row[0])
+
+    def create(self, name, description):
+        with self._transaction() as db:
+            return self._create(db, name, description)
+
+    def update(self, product_id, fields):
+        """Обновляет переданные поля; возвращает продукт или None, если его нет"""
+        with self._transaction() as db:
+            return self._update(db, product_id, fields)
+
+    def delete(self, product_id):
+        """Удаляет продукт; возвращает его или None, если его нет"""
+        with self._transaction() as db:
+            return self._delete(db, product_id)
+
+    def apply(self, operations):
+        """Выполняет операции пакета, как ProductStore.apply.
+
+        Каждые BULK_CHUNK операций — одна транзакция: долгий импорт
+        не держит блокировку записи базы, пока читается тело запроса,
+        и другие процессы успевают писать между порциями.
+        """
+        operations = iter(operations)
+        results = []
+        while True:
+            chunk = list(islice(operations, BULK_CHUNK))
+            if not chunk:
+                return results
+            with self._transaction() as db:
+                for op, product_id, fields in chunk:
+                    if op == 'create':
+                        results.append(self._create(db, fields['name'], fields['description']))
+                    elif op == 'update':
+                        results.append(self._update(db, product_id, fields))
+                    else:
+                        results.append(self._delete(db, product_id))
+
+    def change_cursor(self):
+        """Номер последнего изменения — начальный курсор для changes_since"""
+        return self._db().execute('SELECT coalesce(max(seq), 0) FROM changes').fetchone()[0]
+
+    def changes_since(self, cursor):
+        """Новый курсор и id продуктов, измененных после cursor.
+
+        None, если часть этих изменений уже удалена из таблицы changes —
+        тогда индекс нужно построить заново.
+        """
+        db = self._db()
+        db.execute('BEGIN')
+        try:
+            oldest = db.execute('SELECT min(seq) FROM changes').fetchone()[0]
+            rows = db.execute('SELECT seq, product_id FROM changes WHERE seq > ? ORDER BY seq',
+                              (cursor,)).fetchall()
+        finally:
+            db.execute('COMMIT')
+        if oldest is not None and oldest > cursor + 1:
+            return None
+        if not rows:
+            return cursor, []
+        return rows[-1][0], list(dict.fromkeys(product_id for _, product_id in rows))
+
+    def close(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None and self.local.pid == os.getpid():
+            db.close()
+            self.local.db = None
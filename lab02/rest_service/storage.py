@@ -0,0 +1,405 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+from contextlib import ExitStack
+from itertools import islice
+
+# Когда данные журнала попадают на диск (fsync)
+FSYNC_ALWAYS = 'always'  # fsync после каждой записи
+FSYNC_BATCH = 'batch'  # групповой fsync: запрос ждет fsync, общий для всех одновременных записей
+FSYNC_INTERVAL = 'interval'  # фоновый fsync раз в fsync_interval: при сбое теряются последние записи
+FSYNC_OFF = 'off'  # fsync делает только операционная система
+FSYNC_MODES = (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_INTERVAL, FSYNC_OFF)
+
+SNAPSHOT_FILE = 'snapshot.json'
+WAL_PREFIX = 'wal-'
+WAL_SUFFIX = '.log'
+ITER_BATCH = 256  # сколько продуктов iter_products берет за одну блокировку
+BULK_CHUNK = 1000  # сколько операций apply выполняет за одну блокировку и один write
+LOCK_STRIPES = 64  # блокировок продуктов: продукт id защищает stripes[id % LOCK_STRIPES]
+
+
+def wal_name(generation):
+    return f'{WAL_PREFIX}{generation:08d}{WAL_SUFFIX}'
+
+
+def fsync_directory(path):
+    """Делает переименования и создание файлов в каталоге устойчивыми к сбою"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ProductStore:
+    """Продукты в памяти с журналом упреждающей записи (WAL) на диске.
+
+    Каждое изменение дописывается в журнал одной строкой JSON до того,
+    как запрос получит ответ. Когда в журнале набирается snapshot_every
+    записей, фоновый поток сохраняет снимок всех продуктов и удаляет
+    журналы, которые снимок покрывает. При запуске загружается снимок
+    и проигрываются только журналы после него.
+
+    Журналы нумеруются поколениями: при снимке запись переключается
+    в журнал следующего поколения, а снимок помнит, с какого поколения
+    проигрывать. Поэтому снимок пишется без остановки записи.
+
+    Блокировки разбиты на полосы: изменения разных продуктов идут
+    параллельно, а одного продукта — по очереди и в том же порядке
+    попадают в журнал. id выдает отдельный счетчик под своей короткой
+    блокировкой. Снимок и пакеты apply берут все полосы сразу.
+    Журнал рассчитан на один процесс; для нескольких рабочих процессов
+    есть SQLiteProductStore.
+    """
+
+    def __init__(self, directory, fsync=FSYNC_BATCH, fsync_interval=0.01,
+                 snapshot_every=10000):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f'unknown fsync mode: {fsync!r}')
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.products = {}
+        self.ids = []  # id продуктов по возрастанию, для выборки после курсора
+        self.versions = {}  # id -> номер версии продукта, растет с каждым изменением
+        self.last_id = 0
+        self.stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.id_lock = threading.Lock()  # last_id
+        self.ids_lock = threading.Lock()  # self.ids
+        self.append_lock = threading.Lock()  # запись в журнал и смена журнала
+        self.sync_cond = threading.Condition()  # групповой fsync
+        self.written = 0  # номер последней записи в журнале
+        self.synced = 0  # номер последней записи, прошедшей fsync
+        self.syncing = False
+        self.wal_records = 0  # записей в журналах после последнего снимка
+        self.snapshot_thread = None
+        self.closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.generation = self._load()
+        self.ids = sorted(self.products)
+        self.wal_fd = os.open(os.path.join(directory, wal_name(self.generation)),
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if self.fsync == FSYNC_INTERVAL:
+            threading.Thread(target=self._sync_periodically, name='wal-sync', daemon=True).start()
+        atexit.register(self.close)
+
+    def _load(self):
+        """Восстанавливает продукты из снимка и журналов; возвращает текущее поколение"""
+        generation = 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            generation = snapshot['generation']
+            self.last_id = snapshot['last_id']
+            self.products = {product['id']: product for product in snapshot['products']}
+            versions = snapshot.get('versions', [1] * len(self.products))
+            self.versions = dict(zip(self.products, versions))
+
+        generations = sorted(
+            int(name[len(WAL_PREFIX):-len(WAL_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.startswith(WAL_PREFIX) and name.endswith(WAL_SUFFIX))
+        for wal_generation in generations:
+            path = os.path.join(self.directory, wal_name(wal_generation))
+            if wal_generation < generation:
+                # Журнал уже покрыт снимком, но не был удален из-за сбоя
+                os.remove(path)
+                continue
+            self._replay(path)
+            generation = wal_generation
+        return generation
+
+    def _replay(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            end = data.find(b'\n', offset)
+            if end == -1:
+                break
+            try:
+                record = json.loads(data[offset:end])
+            except ValueError:
+                break
+            self._apply(record)
+            self.wal_records += 1
+            offset = end + 1
+        if offset < len(data):
+            # Недописанная при сбое запись: отбрасываем ее и все, что после
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _apply(self, record):
+        if record['op'] == 'put':
+            product = record['product']
+            self.products[product['id']] = product
+            self.versions[product['id']] = record.get('version',
+                                                      self.versions.get(product['id'], 0) + 1)
+            self.last_id = max(self.last_id, product['id'])
+        else:
+            self.products.pop(record['id'], None)
+            self.versions.pop(record['id'], None)
+
+    def _append(self, records):
+        """Дописывает записи в журнал; возвращает номер последней.
+
+        Вызывается под блокировкой продуктов, которых касаются записи,
+        чтобы записи одного продукта шли в журнале в порядке изменений.
+        """
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        data = data.encode('utf-8')
+        with self.append_lock:
+            while data:
+                data = data[os.write(self.wal_fd, data):]
+            self.written += len(records)
+            self.wal_records += len(records)
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(self.wal_fd)
+                self.synced = self.written
+            return self.written
+
+    def _commit(self, seq):
+        """Дожидается, пока запись seq окажется на диске, если этого требует режим fsync"""
+        if self.fsync == FSYNC_BATCH:
+            self._wait_synced(seq)
+        if self.wal_records >= self.snapshot_every:
+            self.start_snapshot()
+
+    def _wait_synced(self, seq):
+        # Групповой fsync: первый из ждущих делает fsync за всех, кто успел
+        # записать к этому моменту; остальные ждут результата
+        with self.sync_cond:
+            while self.synced < seq:
+                if self.syncing:
+                    self.sync_cond.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                fd = self.wal_fd
+                self.sync_cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self.sync_cond.acquire()
+                    self.syncing = False
+                    self.sync_cond.notify_all()
+                self.synced = max(self.synced, target)
+
+    def _sync_periodically(self):
+        while not self.closed:
+            with self.sync_cond:
+                self.sync_cond.wait(self.fsync_interval)
+            with self.append_lock:
+                if self.closed or self.synced == self.written:
+                    continue
+                os.fsync(self.wal_fd)
+                self.synced = self.written
+
+    def get(self, product_id):
+        return self.products.get(product_id)
+
+    def versioned(self, product_id):
+        """Продукт и номер его версии; (None, None), если продукта нет"""
+        with self._stripe(product_id):
+            return self.products.get(product_id), self.versions.get(product_id)
+
+    def all(self):
+        return list(self.products.values())
+
+    def iter_products(self, after_id=0):
+        """Продукты с id больше after_id по возрастанию id.
+
+        Блокировка берется на одну порцию из ITER_BATCH продуктов, а не на
+        весь обход, поэтому длинная выдача не мешает записи. Продукты,
+        добавленные во время обхода, тоже попадут в выдачу.
+        """
+        while True:
+            with self.ids_lock:
+                start = bisect.bisect_right(self.ids, after_id)
+                batch = self.ids[start:start + ITER_BATCH]
+            if not batch:
+                return
+            for product_id in batch:
+                product = self.products.get(product_id)
+                if product is not None:
+                    yield product
+            after_id = batch[-1]
+
+    def _next_id(self):
+        with self.id_lock:
+            self.last_id += 1
+            return self.last_id
+
+    def _stripe(self, product_id):
+        return self.stripes[product_id % LOCK_STRIPES]
+
+    def _locked_all(self):
+        """Берет все полосы блокировок по порядку: ни один продукт не меняется"""
+        stack = ExitStack()
+        for lock in self.stripes:
+            stack.enter_context(lock)
+        return stack
+
+    # _create, _update и _delete вызываются под блокировкой продукта и
+    # возвращают продукт и запись для журнала (None, None — если продукта нет).
+    # Сам словарь products общий для всех полос: отдельные операции
+    # со словарем в CPython атомарны
+
+    def _create(self, product_id, name, description):
+        product = {"id": product_id, "name": name, "description": description}
+        self.products[product_id] = product
+        self.versions[product_id] = 1
+        with self.ids_lock:
+            # Продукты с соседними id могут создаваться одновременно
+            bisect.insort(self.ids, product_id)
+        return product, {'op': 'put', 'product': product, 'version': 1}
+
+    def _update(self, product_id, fields):
+        product = self.products.get(product_id)
+        if product is None:
+            return None, None
+        # Новый словарь вместо изменения старого: снимок в фоне видит
+        # продукты такими, какими они были в момент начала снимка
+        product = dict(product, **fields)
+        self.products[product_id] = product
+        version = self.versions[product_id] = self.versions[product_id] + 1
+        return product, {'op': 'put', 'product': product, 'version': version}
+
+    def _delete(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return None, None
+        del self.versions[product_id]
+        with self.ids_lock:
+            del self.ids[bisect.bisect_left(self.ids, product_id)]
+        return product, {'op': 'delete', 'id': product_id}
+
+    def _change(self, change, product_id, *args):
+        with self._stripe(product_id):
+            product, record = change(product_id, *args)
+            if record is None:
+                return None
+            seq = self._append([record])
+        self._commit(seq)
+        return product
+
+    def create(self, name, description):
+        return self._change(self._create, self._next_id(), name, description)
+
+    def update(self, product_id, fields):
+        """Обновляет переданные поля; возвращает продукт или None, если его нет"""
+        return self._change(self._update, product_id, fields)
+
+    def delete(self, product_id):
+        """Удаляет продукт; возвращает его или None, если его нет"""
+        return self._change(self._delete, product_id)
+
+    def apply(self, operations):
+        """Выполняет операции ('create', None, fields), ('update', id, fields), ('delete', id, None).
+
+        Возвращает список результатов: продукт или None, если продукта
+        с таким id нет. Операции берутся из итератора порциями по
+        BULK_CHUNK, поэтому его можно читать прямо из тела запроса.
+        Записи порции уходят в журнал одним write, а fsync выполняется
+        один раз в конце, за все операции сразу.
+        """
+        operations = iter(operations)
+        results = []
+        seq = 0
+        while True:
+            chunk = list(islice(operations, BULK_CHUNK))
+            if not chunk:
+                break
+            records = []
+            with self._locked_all():
+                for op, product_id, fields in chunk:
+                    if op == 'create':
+                        product, record = self._create(self._next_id(), fields['name'],
+                                                       fields['description'])
+                    elif op == 'update':
+                        product, record = self._update(product_id, fields)
+                    else:
+                        product, record = self._delete(product_id)
+                    results.append(product)
+                    if record is not None:
+                        records.append(record)
+                if records:
+                    seq = self._append(records)
+        if seq:
+            self._commit(seq)
+        return results
+
+    def change_cursor(self):
+        return 0
+
+    def changes_since(self, cursor):
+        """Изменения, сделанные другими процессами, — у журнала их не бывает"""
+        return cursor, []
+
+    def start_snapshot(self):
+        """Запускает снимок в фоновом потоке, если он еще не идет"""
+        with self.append_lock:
+            if self.closed or (self.snapshot_thread is not None
+                               and self.snapshot_thread.is_alive()):
+                return
+            self.snapshot_thread = threading.Thread(target=self.snapshot, name='snapshot',
+                                                    daemon=True)
+            self.snapshot_thread.start()
+
+    def snapshot(self):
+        """Сохраняет снимок продуктов и удаляет покрытые им журналы"""
+        with self._locked_all(), self.append_lock, self.sync_cond:
+            if self.closed:
+                return
+            # Дескриптор старого журнала закрывается ниже: ждем, пока
+            # закончится начатый групповой fsync
+            while self.syncing:
+                self.sync_cond.wait()
+            # Старый журнал должен быть на диске до того, как его заменит снимок
+            os.fsync(self.wal_fd)
+            os.close(self.wal_fd)
+            self.generation += 1
+            self.wal_fd = os.open(os.path.join(self.directory, wal_name(self.generation)),
+                                  os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.synced = self.written
+            self.sync_cond.notify_all()
+            generation = self.generation
+            last_id = self.last_id
+            products = list(self.products.values())
+            versions = [self.versions[product['id']] for product in products]
+            self.wal_records = 0
+
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        temp_path = snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'generation': generation, 'last_id': last_id, 'products': products,
+                       'versions': versions}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+        fsync_directory(self.directory)
+
+        for name in os.listdir(self.directory):
+            if name.startswith(WAL_PREFIX) and name.endswith(WAL_SUFFIX) \
+                    and int(name[len(WAL_PREFIX):-len(WAL_SUFFIX)]) < generation:
+                os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        """Сбрасывает журнал на диск и закрывает его"""
+        snapshot_thread = self.snapshot_thread
+        if snapshot_thread is not None:
+            snapshot_thread.join()
+        with self.append_lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.fsync != FSYNC_OFF:
+                os.fsync(self.wal_fd)
+            os.close(self.wal_fd)
+        with self.sync_cond:
+            self.sync_cond.notify_all()
@@ -0,0 +1,129 @@
+import atexit
+import datetime
+import json
+import os
+import sys
+import threading
+from bench_stats import latency_summary
+
+# Поля записи о запросе; времена в секундах
+RECORD_FIELDS = ('time', 'method', 'path', 'status', 'bytes',
+                 'first_byte', 'open', 'send', 'total')
+TIMING_FIELDS = ('first_byte', 'open', 'send', 'total')
+
+
+class AccessLog:
+    """Журнал запросов в кольцевом буфере фиксированного размера.
+
+    Обработчик запроса только кладет кортеж в следующую ячейку буфера;
+    фоновый поток раз в flush_interval забирает накопившиеся записи и
+    дописывает их в файл одним вызовом write. Если поток не успевает,
+    старые незаписанные записи перезаписываются новыми и учитываются
+    в dropped — обработка запросов журналом не тормозится никогда.
+
+    Последние capacity записей остаются в буфере и после записи на диск,
+    по ним считаются текущие процентили задержек.
+    """
+
+    def __init__(self, path, capacity, flush_interval):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.records = [None] * capacity
+        self.written = 0  # сколько записей добавлено с начала работы
+        self.flushed = 0  # сколько из них уже обработал фоновый поток
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # запись на диск, не мешает добавлять записи
+        self.wakeup = threading.Event()
+        self.fd = None
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Запускает фоновый поток записи в текущем процессе"""
+        with self.lock:
+            # После fork потока записи в дочернем процессе нет — запускаем свой
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, method, path, status, sent, first_byte, open_time, send_time, total):
+        """Добавляет запись о запросе; времена — в секундах"""
+        if self.pid != os.getpid():
+            self.start()
+        entry = (datetime.datetime.now(), method, path, status, sent,
+                 first_byte, open_time, send_time, total)
+        with self.lock:
+            self.records[self.written % self.capacity] = entry
+            self.written += 1
+            pending = self.written - self.flushed
+        if pending >= self.capacity // 2:
+            # Буфер заполнен наполовину: не ждем конца интервала
+            self.wakeup.set()
+
+    def recent(self):
+        """Последние записи буфера, от старых к новым"""
+        with self.lock:
+            start = max(0, self.written - self.capacity)
+            return [self.records[index % self.capacity] for index in range(start, self.written)]
+
+    def latency_stats(self):
+        records = self.recent()
+        stats = {'window': len(records), 'written': self.written, 'dropped': self.dropped}
+        for offset, name in enumerate(TIMING_FIELDS, start=RECORD_FIELDS.index('first_byte')):
+            stats[name] = latency_summary([record[offset] for record in records])
+        return stats
+
+    def flush(self):
+        """Записывает на диск все накопившиеся записи"""
+        with self.write_lock:
+            if self.fd is None:
+                return
+            with self.lock:
+                start = max(self.flushed, self.written - self.capacity)
+                self.dropped += start - self.flushed
+                batch = [self.records[index % self.capacity]
+                         for index in range(start, self.written)]
+                self.flushed = self.written
+            if batch:
+                self._write_batch(batch)
+
+    def close(self):
+        """Дописывает буфер на диск; вызывается при выходе процесса"""
+        if self.pid != os.getpid():
+            return
+        self.flush()
+        with self.write_lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.fd is None:
+                return
+            self.flush()
+
+    def _write_batch(self, batch):
+        lines = []
+        for record in batch:
+            entry = dict(zip(RECORD_FIELDS, record))
+            entry['time'] = record[0].isoformat(timespec='milliseconds')
+            for name in TIMING_FIELDS:
+                entry[name + '_ms'] = round(entry.pop(name) * 1000, 3)
+            lines.append(json.dumps(entry))
+        data = ('\n'.join(lines) + '\n').encode()
+        try:
+            # Один write в файл с O_APPEND: пачки нескольких процессов не перемешиваются
+            while data:
+                data = data[os.write(self.fd, data):]
+        except OSError as e:
+            sys.stderr.write(f"access log write failed: {e}\n")
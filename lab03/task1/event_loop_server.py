@@ -0,0 +1,324 @@
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http_handler import (
+    KEEP_ALIVE_TIMEOUT, MAX_REQUESTS_PER_CONNECTION, RECV_SIZE, RequestError, WouldBlock,
+    build_response, disable_nagle, error_response, find_request_head, log_request, parse_request,
+    request_body_length, wants_keep_alive,
+)
+
+BACKLOG = 1024  # очередь ядра для еще не принятых соединений
+SWEEP_INTERVAL = 1  # как часто закрывать простаивающие соединения, секунды
+SENDFILE_CHUNK = 1024 * 1024  # сколько байт файла отдавать за один вызов sendfile
+BUILD_WORKERS = 2  # потоков, читающих и сжимающих файлы в кеш вне цикла событий
+
+
+def block_stop_signals():
+    # Сигналы остановки должны прерывать select главного потока
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT, signal.SIGTERM})
+
+
+class Connection:
+    """Состояние одного клиента: что прочитано и что осталось отправить.
+
+    Соединение либо читает запрос, либо пишет ответ. Пока ответ не
+    отправлен целиком, новые данные от клиента не читаются — запросы,
+    присланные заранее (pipelining), ждут в inbuf своей очереди.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.scanned = 0  # сколько байт inbuf уже просмотрено в поисках конца заголовков
+        self.skip = 0  # сколько байт тела текущего запроса еще пропустить
+        self.response = None
+        self.building_in_thread = False  # ответ готовится в потоке builder
+        self.out = None  # неотправленная часть заголовков и тела ответа
+        self.served = 0
+        self.eof = False
+        self.last_activity = time.monotonic()
+        # Текущий запрос и моменты его этапов для журнала (см. log_request)
+        self.method = self.path = '-'
+        self.started = self.last_activity
+        self.building = self.sending = None
+        self.sent = 0
+
+
+class EventLoopServer:
+    """Веб-сервер на одном потоке с циклом событий selectors (epoll на Linux).
+
+    Все сокеты неблокирующие: соединение, которому нечего читать или
+    некуда писать, ждет готовности в селекторе и не задерживает других
+    клиентов, поэтому один процесс держит тысячи соединений без потоков.
+
+    Единственная долгая работа — прочитать и сжать файл при промахе
+    кеша — выполняется в небольшом пуле потоков builder; соединение
+    ждет ее, не занимая цикл, и продолжается, когда ответ готов.
+    """
+
+    def __init__(self, server_port, backlog=BACKLOG, routes=None, reuse_port=False):
+        self.routes = routes
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.stop_deadline = None  # когда прекратить дожидаться начатых ответов
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Несколько процессов слушают один порт, ядро делит между ними соединения
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server_socket.bind(('localhost', server_port))
+        self.server_socket.listen(backlog)
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.builder = ThreadPoolExecutor(BUILD_WORKERS, 'builder',
+                                          initializer=block_stop_signals)
+        self.built = []  # (соединение, future) готовых ответов из builder
+        self.built_lock = threading.Lock()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+
+    def serve_forever(self):
+        """Обслуживает клиентов; после stop() возвращается, доотправив начатые ответы"""
+        last_sweep = time.monotonic()
+        accepting = True
+        while True:
+            if self.stop_deadline is not None:
+                if accepting:
+                    self.stop_accepting()
+                    accepting = False
+                if not self.connections or time.monotonic() >= self.stop_deadline:
+                    break
+            for key, mask in self.selector.select(SWEEP_INTERVAL):
+                if key.fileobj is self.server_socket:
+                    self.accept()
+                    continue
+                if key.fileobj is self.wakeup_reader:
+                    self.finish_built()
+                    continue
+                conn = key.data
+                if mask & selectors.EVENT_READ:
+                    self.on_readable(conn)
+                elif mask & selectors.EVENT_WRITE:
+                    self.on_writable(conn)
+            now = time.monotonic()
+            if now - last_sweep >= SWEEP_INTERVAL:
+                self.close_idle(now)
+                last_sweep = now
+        for conn in list(self.connections.values()):
+            self.close(conn)
+        self.builder.shutdown(wait=False)
+
+    def stop(self, timeout):
+        """Просит serve_forever завершиться; можно вызывать из обработчика сигнала"""
+        self.stop_deadline = time.monotonic() + timeout
+
+    def stop_accepting(self):
+        self.selector.unregister(self.server_socket)
+        self.server_socket.close()
+        # Соединения, которые ждут следующего запроса, больше не нужны
+        for conn in list(self.connections.values()):
+            if conn.response is None and not conn.building_in_thread and not conn.inbuf:
+                self.close(conn)
+
+    def accept(self):
+        # Принимаем все ожидающие соединения за один проход
+        while True:
+            try:
+                sock, _ = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # Например, кончились дескрипторы: попробуем на следующей итерации
+                print(f'Error accepting connection: {e}')
+                return
+            sock.setblocking(False)
+            disable_nagle(sock)
+            conn = Connection(sock)
+            self.connections[sock] = conn
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def close(self, conn):
+        if conn.response is not None:
+            conn.response.close()
+        if not conn.building_in_thread:
+            self.selector.unregister(conn.sock)
+        del self.connections[conn.sock]
+        conn.sock.close()
+
+    def close_idle(self, now):
+        for conn in list(self.connections.values()):
+            if now - conn.last_activity > KEEP_ALIVE_TIMEOUT and not conn.building_in_thread:
+                self.close(conn)
+
+    def on_readable(self, conn):
+        try:
+            data = conn.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.close(conn)
+            return
+        conn.last_activity = time.monotonic()
+        if data:
+            conn.inbuf += data
+        else:
+            conn.eof = True
+        self.advance(conn)
+
+    def advance(self, conn):
+        """Берет из inbuf следующий полный запрос и начинает отправку ответа"""
+        if conn.building_in_thread:
+            # Новые запросы ждут, пока builder не подготовит текущий ответ
+            return
+        while conn.response is None:
+            if conn.skip:
+                skipped = min(conn.skip, len(conn.inbuf))
+                del conn.inbuf[:skipped]
+                conn.skip -= skipped
+                if conn.skip:
+                    break
+            conn.method = conn.path = '-'
+            try:
+                head = find_request_head(conn.inbuf, conn.scanned)
+                if head is None:
+                    conn.scanned = len(conn.inbuf)
+                    if conn.eof and conn.inbuf.strip():
+                        raise RequestError('HTTP/1.1 400 Bad Request')
+                    break
+                conn.scanned = 0
+                if conn.served:
+                    # Первый запрос отсчитывается от принятия соединения
+                    conn.started = time.monotonic()
+                method, path, version, headers = parse_request(head)
+                conn.method, conn.path = method, path
+                conn.skip = request_body_length(headers)
+            except RequestError as e:
+                self.start_response(conn, error_response(e.status_line))
+                return
+
+            conn.served += 1
+            keep_alive = wants_keep_alive(version, headers) \
+                and conn.served < MAX_REQUESTS_PER_CONNECTION and self.stop_deadline is None
+            conn.building = time.monotonic()
+            try:
+                response = build_response(method, path, headers, self.routes, keep_alive,
+                                          blocking=False)
+            except WouldBlock:
+                # Пока ответ готовится, соединение не читаем: иначе закрытый
+                # клиентом сокет все время был бы готов к чтению
+                self.selector.unregister(conn.sock)
+                conn.building_in_thread = True
+                future = self.builder.submit(build_response, method, path, headers,
+                                             self.routes, keep_alive)
+                future.add_done_callback(lambda future: self.on_built(conn, future))
+                return
+            self.start_response(conn, response, conn.building)
+            return
+
+        if conn.eof:
+            # Клиент закрыл свою сторону, а полных запросов больше нет
+            self.close(conn)
+
+    def on_built(self, conn, future):
+        """Вызывается в потоке builder: передает готовый ответ циклу событий"""
+        with self.built_lock:
+            self.built.append((conn, future))
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # Буфер полон — цикл и так проснется
+            pass
+
+    def finish_built(self):
+        try:
+            self.wakeup_reader.recv(4096)
+        except BlockingIOError:
+            pass
+        with self.built_lock:
+            built, self.built = self.built, []
+        for conn, future in built:
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f'Error building response: {e}')
+                response = None
+            if self.connections.get(conn.sock) is not conn:
+                # Соединение закрыли, пока готовился ответ
+                if response is not None:
+                    response.close()
+                continue
+            conn.building_in_thread = False
+            self.selector.register(conn.sock, selectors.EVENT_READ, conn)
+            if response is None:
+                self.close(conn)
+                continue
+            self.start_response(conn, response, conn.building)
+
+    def start_response(self, conn, response, building=None):
+        conn.response = response
+        conn.out = memoryview(response.head + response.body)
+        conn.sending = time.monotonic()
+        conn.building = building if building is not None else conn.sending
+        conn.sent = 0
+        self.on_writable(conn)
+
+    def on_writable(self, conn):
+        """Отправляет сколько получится; остаток ждет готовности сокета к записи"""
+        response = conn.response
+        try:
+            while conn.out:
+                sent = conn.sock.send(conn.out)
+                conn.out = conn.out[sent:]
+                conn.sent += sent
+            while response.file is not None and response.length > 0:
+                sent = os.sendfile(conn.sock.fileno(), response.file.fileno(),
+                                   response.offset, min(response.length, SENDFILE_CHUNK))
+                if sent == 0:
+                    # Файл укоротился во время отправки — дослать ответ нельзя
+                    self.close(conn)
+                    return
+                response.offset += sent
+                response.length -= sent
+                conn.sent += sent
+        except (BlockingIOError, InterruptedError):
+            conn.last_activity = time.monotonic()
+            self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+            return
+        except OSError:
+            self.close(conn)
+            return
+
+        conn.last_activity = time.monotonic()
+        log_request(conn.method, conn.path, response, conn.sent, conn.started, conn.building,
+                    conn.sending, conn.last_activity)
+        response.close()
+        conn.response = None
+        conn.out = None
+        if not response.keep_alive or self.stop_deadline is not None:
+            self.close(conn)
+            return
+        self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        self.advance(conn)
+
+
+def start_server(server_port, backlog=BACKLOG):
+    server = EventLoopServer(server_port, backlog)
+    print(f'Server started on port {server_port} (event loop)...')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    import sys
+
+    if not 2 <= len(sys.argv) <= 3:
+        print("Usage: python event_loop_server.py <server_port> [backlog]")
+        sys.exit(1)
+
+    port = int(sys.argv[1])
+    backlog = int(sys.argv[2]) if len(sys.argv) > 2 else BACKLOG
+    start_server(port, backlog)
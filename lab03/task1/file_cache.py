@@ -0,0 +1,89 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+GZIP_LEVEL = 6
+GZIP_MIN_SAVING = 0.1  # сжатый вариант храним, только если он меньше хотя бы на 10%
+
+
+class CachedFile:
+    def __init__(self, size, mtime_ns, body):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.body = body
+        compressed = gzip.compress(body, GZIP_LEVEL, mtime=0)
+        if len(compressed) <= len(body) * (1 - GZIP_MIN_SAVING):
+            self.gzip_body = compressed
+        else:
+            self.gzip_body = None
+
+    @property
+    def memory_size(self):
+        return len(self.body) + len(self.gzip_body or b'')
+
+
+class FileCache:
+    """Кеш небольших файлов в памяти с вытеснением LRU.
+
+    Запись действительна, пока у файла не изменились mtime и размер,
+    поэтому на попадание в кеш уходит один вызов stat вместо открытия
+    и чтения файла. Вместе с файлом хранится его gzip-вариант. Файлы
+    больше max_file_size не кешируются и отдаются с диска потоком.
+    """
+
+    def __init__(self, max_bytes, max_file_size):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, file_stat):
+        return file_stat.st_size <= self.max_file_size
+
+    def lookup(self, path, file_stat):
+        """Возвращает CachedFile для path, если он уже в кеше; диск не читает"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.mtime_ns == file_stat.st_mtime_ns \
+                    and entry.size == file_stat.st_size:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry
+        return None
+
+    def get(self, path, file_stat):
+        """Возвращает CachedFile для path или None, если файл слишком большой.
+
+        При промахе читает и сжимает файл — это может занять заметное время.
+        """
+        if not self.cacheable(file_stat):
+            return None
+        entry = self.lookup(path, file_stat)
+        if entry is not None:
+            return entry
+        with self.lock:
+            self.misses += 1
+
+        try:
+            with open(path, 'rb') as f:
+                body = f.read(self.max_file_size + 1)
+        except OSError:
+            return None
+        if len(body) != file_stat.st_size:
+            # Файл меняется прямо сейчас: отдадим его с диска, не кешируя
+            return None
+        entry = CachedFile(file_stat.st_size, file_stat.st_mtime_ns, body)
+
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.total_bytes -= old.memory_size
+            self.entries[path] = entry
+            self.total_bytes += entry.memory_size
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.memory_size
+        return entry
@@ -0,0 +1,608 @@
+import json
+import os
+import select
+import socket
+import stat
+import time
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from access_log import AccessLog
+from file_cache import FileCache
+
+KEEP_ALIVE_TIMEOUT = 5  # сколько ждать следующего запроса на соединении, секунды
+MAX_REQUESTS_PER_CONNECTION = 100  # после стольких запросов соединение закрывается
+MAX_HEADER_SIZE = 64 * 1024
+RECV_SIZE = 64 * 1024
+HEAD_TERMINATOR = b'\r\n\r\n'
+FILE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # общий размер кеша файлов
+FILE_CACHE_MAX_FILE_SIZE = 1024 * 1024  # файлы больше этого не кешируются
+ACCESS_LOG_FILE = 'access.log'
+ACCESS_LOG_CAPACITY = 8192  # записей в кольцевом буфере журнала
+ACCESS_LOG_FLUSH_INTERVAL = 1  # как часто журнал пишется на диск, секунды
+LATENCY_STATS_PATH = '/__debug/latency'
+
+NOT_FOUND_BODY = b'<html><body><h1>404 Not Found</h1></body></html>'
+RANGE_NOT_SATISFIABLE_BODY = b'<html><body><h1>416 Range Not Satisfiable</h1></body></html>'
+
+# Content-Type по расширению файла
+MIME_TYPES = {
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.mjs': 'text/javascript',
+    '.json': 'application/json',
+    '.xml': 'application/xml',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.csv': 'text/csv',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.pdf': 'application/pdf',
+    '.zip': 'application/zip',
+    '.gz': 'application/gzip',
+    '.wasm': 'application/wasm',
+    '.mp3': 'audio/mpeg',
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+}
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+file_cache = FileCache(FILE_CACHE_MAX_BYTES, FILE_CACHE_MAX_FILE_SIZE)
+access_log = AccessLog(ACCESS_LOG_FILE, ACCESS_LOG_CAPACITY, ACCESS_LOG_FLUSH_INTERVAL)
+
+
+class WouldBlock(Exception):
+    """Для ответа нужно прочитать и сжать файл в кеш (см. build_response)"""
+
+
+class RequestError(Exception):
+    """Запрос нельзя обслужить; status_line — строка ответа клиенту"""
+
+    def __init__(self, status_line):
+        super().__init__(status_line)
+        self.status_line = status_line
+
+
+def parse_headers(request_lines):
+    """Собирает заголовки запроса в словарь с именами в нижнем регистре"""
+    headers = {}
+    for line in request_lines:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_range(range_header, file_size):
+    """Разбирает заголовок Range для одного диапазона байт.
+
+    Возвращает (начало, конец) включительно, None, если заголовок нужно
+    проигнорировать и отдать файл целиком, или False, если диапазон
+    не пересекается с файлом (ответ 416).
+    """
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        # Несколько диапазонов не поддерживаем — отдаем весь файл
+        return None
+    first, sep, last = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # bytes=-N — последние N байт
+            suffix = int(last)
+            if suffix < 0:
+                return None
+            if suffix == 0 or file_size == 0:
+                # У пустого файла нет ни одного байта для диапазона
+                return False
+            return max(0, file_size - suffix), file_size - 1
+        start = int(first)
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if end is not None and start > end:
+        return None
+    if start >= file_size:
+        return False
+    if end is None or end >= file_size:
+        end = file_size - 1
+    return start, end
+
+
+def guess_content_type(file_name):
+    return MIME_TYPES.get(os.path.splitext(file_name)[1].lower(), DEFAULT_MIME_TYPE)
+
+
+class FileValidators:
+    """ETag и Last-Modified файла, вычисленные по его mtime и размеру.
+
+    Файл при этом не читается. suffix отличает ETag другого
+    представления того же файла, например сжатого.
+    """
+
+    def __init__(self, mtime_ns, size, suffix=''):
+        self.mtime = mtime_ns // 1_000_000_000
+        self.etag = f'"{mtime_ns:x}-{size:x}{suffix}"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+
+    def headers(self):
+        return [('ETag', self.etag), ('Last-Modified', self.last_modified)]
+
+    def not_modified(self, request_headers):
+        """Проверяет If-None-Match или, если его нет, If-Modified-Since"""
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            # Для GET сравнение слабое: префикс W/ не учитывается
+            return any(tag.strip().removeprefix('W/') == self.etag
+                       for tag in if_none_match.split(','))
+        if_modified_since = request_headers.get('if-modified-since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return self.mtime <= since.timestamp()
+
+
+def build_response_head(status_line, headers):
+    lines = [status_line] + [f'{name}: {value}' for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+
+class Response:
+    """Готовый к отправке ответ.
+
+    head и body — байты, которые отправляются как есть; если задан file,
+    после них отправляются length байт файла начиная с offset. Ответ не
+    зависит от способа отправки, поэтому его одинаково отдают блокирующие
+    серверы (write_response) и цикл событий.
+    """
+
+    def __init__(self, status_line, head, body=b'', file=None, offset=0, length=0,
+                 keep_alive=True):
+        self.status_line = status_line
+        self.head = head
+        self.body = body
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.keep_alive = keep_alive
+
+    @property
+    def status(self):
+        return int(self.status_line.split()[1])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def make_response(status_line, content_type, body, extra_headers=()):
+    headers = [('Content-Length', len(body)), ('Content-Type', content_type)]
+    headers.extend(extra_headers)
+    return Response(status_line, build_response_head(status_line, headers), body)
+
+
+def error_response(status_line):
+    """Ответ с ошибкой, после которого соединение закрывается"""
+    body = f'<html><body><h1>{status_line[9:]}</h1></body></html>'.encode()
+    response = make_response(status_line, 'text/html', body, [('Connection', 'close')])
+    response.keep_alive = False
+    return response
+
+
+def write_response(client_connection, response):
+    """Отправляет ответ в блокирующий сокет; возвращает число отправленных байт.
+
+    Тело файла уходит через socket.sendfile: на Linux это os.sendfile,
+    и данные копируются из файла в сокет внутри ядра, не попадая
+    в память процесса.
+    """
+    try:
+        data = response.head + response.body
+        client_connection.sendall(data)
+        sent = len(data)
+        if response.file is not None and response.length > 0:
+            sent += client_connection.sendfile(response.file, response.offset, response.length)
+        return sent
+    finally:
+        response.close()
+
+
+def send_response(client_connection, status_line, content_type, body, extra_headers=()):
+    write_response(client_connection, make_response(status_line, content_type, body, extra_headers))
+
+
+def accepts_gzip(headers):
+    """Проверяет, разрешает ли Accept-Encoding клиента ответ в gzip"""
+    for item in headers.get('accept-encoding', '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.strip().lower()
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def plan_body(headers, file_size, content_type):
+    """Выбирает, какую часть файла отдать, с учетом заголовка Range.
+
+    Возвращает (строка статуса, начало, длина, заголовки ответа) или None,
+    если диапазон не пересекается с файлом (ответ 416).
+    """
+    byte_range = parse_range(headers['range'], file_size) if 'range' in headers else None
+    if byte_range is False:
+        return None
+    if byte_range is None:
+        return ('HTTP/1.1 200 OK', 0, file_size,
+                [('Content-Length', file_size), ('Content-Type', content_type),
+                 ('Accept-Ranges', 'bytes')])
+    start, end = byte_range
+    return ('HTTP/1.1 206 Partial Content', start, end - start + 1,
+            [('Content-Length', end - start + 1), ('Content-Type', content_type),
+             ('Accept-Ranges', 'bytes'), ('Content-Range', f'bytes {start}-{end}/{file_size}')])
+
+
+def range_not_satisfiable(file_size, extra_headers):
+    return make_response('HTTP/1.1 416 Range Not Satisfiable', 'text/html',
+                         RANGE_NOT_SATISFIABLE_BODY,
+                         [('Content-Range', f'bytes */{file_size}')] + list(extra_headers))
+
+
+def not_modified_response(validators, extra_headers=()):
+    status_line = 'HTTP/1.1 304 Not Modified'
+    return Response(status_line, build_response_head(status_line,
+                                                     validators.headers() + list(extra_headers)))
+
+
+def file_response(file_name, headers, content_type, extra_headers=()):
+    """Ответ с файлом целиком или запрошенным диапазоном, который читается при отправке"""
+    f = open(file_name, 'rb')
+    file_size = os.fstat(f.fileno()).st_size
+    plan = plan_body(headers, file_size, content_type)
+    if plan is None:
+        f.close()
+        return range_not_satisfiable(file_size, extra_headers)
+    status_line, start, length, response_headers = plan
+    response_headers.extend(extra_headers)
+    return Response(status_line, build_response_head(status_line, response_headers),
+                    file=f, offset=start, length=length)
+
+
+def file_head_response(file_size, headers, content_type, extra_headers=()):
+    """Заголовки ответа file_response без открытия файла — для HEAD"""
+    plan = plan_body(headers, file_size, content_type)
+    if plan is None:
+        return range_not_satisfiable(file_size, extra_headers)
+    status_line, _, _, response_headers = plan
+    response_headers.extend(extra_headers)
+    return Response(status_line, build_response_head(status_line, response_headers))
+
+
+def cached_file_response(entry, headers, content_type, extra_headers=()):
+    """Ответ с файлом из кеша, сжатый, если клиент принимает gzip.
+
+    У сжатого варианта свой ETag: это другое представление файла.
+    """
+    vary = [('Vary', 'Accept-Encoding')] if entry.gzip_body is not None else []
+    if vary and 'range' not in headers and accepts_gzip(headers):
+        validators = FileValidators(entry.mtime_ns, entry.size, '-gzip')
+        if validators.not_modified(headers):
+            return not_modified_response(validators, vary + list(extra_headers))
+        return make_response('HTTP/1.1 200 OK', content_type, entry.gzip_body,
+                             [('Content-Encoding', 'gzip')] + vary + validators.headers()
+                             + list(extra_headers))
+
+    validators = FileValidators(entry.mtime_ns, entry.size)
+    if validators.not_modified(headers):
+        return not_modified_response(validators, vary + list(extra_headers))
+    plan = plan_body(headers, entry.size, content_type)
+    if plan is None:
+        return range_not_satisfiable(entry.size, extra_headers)
+    status_line, start, length, response_headers = plan
+    response_headers.extend(vary)
+    response_headers.extend(validators.headers())
+    response_headers.extend(extra_headers)
+    return Response(status_line, build_response_head(status_line, response_headers),
+                    entry.body[start:start + length])
+
+
+def find_request_head(buffer, scanned=0):
+    """Ищет в buffer конец заголовков запроса.
+
+    Возвращает заголовки без завершающей пустой строки, удаляя их из
+    buffer, или None, если они пришли не целиком. scanned — сколько
+    байт buffer уже просмотрено раньше: конец ищется только в новых данных.
+    """
+    end = buffer.find(HEAD_TERMINATOR, max(0, scanned - 3))
+    if end != -1:
+        head = bytes(buffer[:end])
+        del buffer[:end + len(HEAD_TERMINATOR)]
+        return head
+    if len(buffer) > MAX_HEADER_SIZE:
+        raise RequestError('HTTP/1.1 431 Request Header Fields Too Large')
+    return None
+
+
+def read_request_head(client_connection, buffer):
+    """Читает из сокета, пока в buffer не окажутся заголовки запроса целиком.
+
+    Возвращает заголовки без завершающей пустой строки и удаляет их из
+    buffer; то, что пришло следом (тело или следующие запросы), остается
+    в buffer. Возвращает None, если клиент закрыл соединение или молчит
+    дольше KEEP_ALIVE_TIMEOUT. Слишком большие заголовки — RequestError.
+    """
+    scanned = 0
+    while True:
+        head = find_request_head(buffer, scanned)
+        if head is not None:
+            return head
+        scanned = len(buffer)
+        try:
+            data = client_connection.recv(RECV_SIZE)
+        except socket.timeout:
+            data = b''
+        if not data:
+            if buffer.strip():
+                raise RequestError('HTTP/1.1 400 Bad Request')
+            return None
+        buffer += data
+
+
+def discard_body(client_connection, buffer, length):
+    """Пропускает тело запроса, чтобы следующий запрос читался с его начала"""
+    while len(buffer) < length:
+        data = client_connection.recv(RECV_SIZE)
+        if not data:
+            raise RequestError('HTTP/1.1 400 Bad Request')
+        buffer += data
+    del buffer[:length]
+
+
+def parse_request(head):
+    """Разбирает строку запроса и заголовки; возвращает (метод, путь, версия, заголовки)"""
+    request_lines = head.decode('iso-8859-1').split('\r\n')
+    parts = request_lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise RequestError('HTTP/1.1 400 Bad Request')
+    method, path, version = parts
+    return method, path, version, parse_headers(request_lines[1:])
+
+
+def request_body_length(headers):
+    """Длина тела запроса по Content-Length.
+
+    Тело с Transfer-Encoding (chunked) сервер не разбирает: такой запрос
+    получает 411 и соединение закрывается — иначе тело прочиталось бы
+    как следующий запрос.
+    """
+    if 'transfer-encoding' in headers:
+        raise RequestError('HTTP/1.1 411 Length Required')
+    content_length = headers.get('content-length', '0')
+    if not content_length.isdigit():
+        raise RequestError('HTTP/1.1 400 Bad Request')
+    return int(content_length)
+
+
+def wants_keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return 'close' not in connection
+    return 'keep-alive' in connection
+
+
+def latency_stats():
+    return 'application/json', json.dumps(access_log.latency_stats()).encode()
+
+
+# Служебные адреса, которые есть у всех серверов
+BUILTIN_ROUTES = {LATENCY_STATS_PATH: latency_stats}
+
+
+def build_response(method, path, headers, routes, keep_alive, blocking=True):
+    """Формирует ответ на запрос файла или служебного адреса.
+
+    blocking=False — для цикла событий: если файл нужно сначала прочитать
+    и сжать в кеш, вместо этого выбрасывается WouldBlock, и ответ
+    готовится вызовом с blocking=True в другом потоке.
+
+    На HEAD отправляются только заголовки — с тем же Content-Length,
+    что у GET: иначе тело приняли бы за начало следующего ответа.
+    """
+    head_only = method == 'HEAD'
+    extra_headers = [('Connection', 'keep-alive' if keep_alive else 'close')]
+    route = routes.get(path) if routes else None
+    if route is None:
+        route = BUILTIN_ROUTES.get(path)
+    if route is not None:
+        content_type, response_body = route()
+        response = make_response('HTTP/1.1 200 OK', content_type, response_body, extra_headers)
+    else:
+        response = static_response(path, headers, extra_headers, blocking, head_only)
+    if head_only:
+        response.body = b''
+    response.keep_alive = keep_alive
+    return response
+
+
+def static_response(path, headers, extra_headers, blocking=True, head_only=False):
+    file_name = path
+    if file_name.startswith('/'):
+        file_name = file_name[1:]
+
+    try:
+        file_stat = os.stat(file_name)
+    except OSError:
+        file_stat = None
+    if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+        return make_response('HTTP/1.1 404 Not Found', 'text/html', NOT_FOUND_BODY, extra_headers)
+
+    content_type = guess_content_type(file_name)
+    # Небольшие файлы отдаются из памяти, большие — потоком с диска.
+    # Для HEAD файл не читается: кеш используется, только если файл уже в нем
+    if head_only:
+        entry = file_cache.lookup(file_name, file_stat)
+    elif blocking:
+        entry = file_cache.get(file_name, file_stat)
+    else:
+        entry = file_cache.lookup(file_name, file_stat)
+        if entry is None and file_cache.cacheable(file_stat):
+            raise WouldBlock()
+    if entry is not None:
+        return cached_file_response(entry, headers, content_type, extra_headers)
+
+    validators = FileValidators(file_stat.st_mtime_ns, file_stat.st_size)
+    if validators.not_modified(headers):
+        return not_modified_response(validators, extra_headers)
+    if head_only:
+        return file_head_response(file_stat.st_size, headers, content_type,
+                                  validators.headers() + list(extra_headers))
+    try:
+        return file_response(file_name, headers, content_type,
+                             validators.headers() + list(extra_headers))
+    except OSError:
+        return make_response('HTTP/1.1 404 Not Found', 'text/html', NOT_FOUND_BODY, extra_headers)
+
+
+def log_request(method, path, response, sent, started, building, sending, finished):
+    """Записывает в журнал запрос и время его этапов.
+
+    Моменты берутся из time.monotonic: started — начало запроса,
+    building — начало подготовки ответа (stat, кеш, открытие файла),
+    sending — начало отправки, то есть первого байта ответа.
+    """
+    access_log.record(method, path, response.status, sent, sending - started,
+                      sending - building, finished - sending, finished - started)
+
+
+def disable_nagle(client_connection):
+    # Заголовки и тело файла уходят разными вызовами: без TCP_NODELAY
+    # Nagle задержит тело до ACK заголовков, а клиент откладывает ACK
+    client_connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class ClientSession:
+    """Соединение клиента между запросами: сокет, прочитанные, но еще
+    не разобранные байты и число обслуженных запросов"""
+
+    def __init__(self, connection):
+        disable_nagle(connection)
+        self.connection = connection
+        self.buffer = bytearray()
+        self.served = 0
+
+
+def has_pending_request(session):
+    """Проверяет, не дожидаясь, прислал ли клиент еще что-нибудь после текущего запроса"""
+    if session.buffer:
+        return True
+    readable, _, _ = select.select([session.connection], [], [], 0)
+    if not readable:
+        return False
+    try:
+        data = session.connection.recv(RECV_SIZE)
+    except OSError:
+        return False
+    # Пустой ответ recv — клиент закрыл соединение, запросов больше не будет
+    session.buffer += data
+    return bool(data)
+
+
+def handle_client(client_connection, routes=None, accepted_at=None, keep_alive=True):
+    """Обслуживает соединение клиента, пока оно остается keep-alive.
+
+    Запросы, присланные подряд без ожидания ответов (pipelining),
+    читаются из общего буфера и обслуживаются по порядку. Соединение
+    закрывается после MAX_REQUESTS_PER_CONNECTION запросов или если
+    клиент молчит дольше KEEP_ALIVE_TIMEOUT.
+
+    routes — служебные адреса сервера: путь -> функция, возвращающая
+    (Content-Type, тело ответа). accepted_at — когда соединение было
+    принято (time.monotonic): от него отсчитывается время первого
+    запроса, включая ожидание в очереди сервера; следующие запросы
+    отсчитываются от получения их заголовков. keep_alive=False — для
+    однопоточного сервера: соединение остается открытым, только пока
+    клиент уже прислал следующий запрос (pipelining), и закрывается
+    после ответа на последний из них. Ждать нового запроса молчащего
+    клиента, пока другие стоят в очереди, сервер не будет.
+    """
+    serve_session(ClientSession(client_connection), routes, accepted_at, keep_alive)
+
+
+def serve_session(session, routes=None, started=None, keep_alive=True, park=None):
+    """Обслуживает запросы сессии; см. handle_client.
+
+    Если передан park, поток не ждет в recv следующего запроса: когда
+    ответ отправлен и в буфере нет начатого запроса, сессия передается
+    в park(session) и функция возвращается, не закрывая соединение.
+    started — когда сессия снова стала готова к чтению.
+    """
+    client_connection = session.connection
+    client_connection.settimeout(KEEP_ALIVE_TIMEOUT)
+    if started is None:
+        started = time.monotonic()
+    first = True
+    parked = False
+    try:
+        while session.served < MAX_REQUESTS_PER_CONNECTION:
+            if park is not None and not first and not session.buffer:
+                # Соединение молчит: ждать его будет park, а не рабочий поток
+                parked = True
+                park(session)
+                return
+            session.served += 1
+            method = path = '-'
+            try:
+                head = read_request_head(client_connection, session.buffer)
+                if head is None:
+                    break
+                if not first:
+                    started = time.monotonic()
+                method, path, version, headers = parse_request(head)
+                discard_body(client_connection, session.buffer, request_body_length(headers))
+            except RequestError as e:
+                response = error_response(e.status_line)
+                sending = time.monotonic()
+                sent = write_response(client_connection, response)
+                log_request(method, path, response, sent, started, sending, sending,
+                            time.monotonic())
+                break
+            first = False
+
+            request_keep_alive = wants_keep_alive(version, headers) \
+                and session.served < MAX_REQUESTS_PER_CONNECTION \
+                and (keep_alive or has_pending_request(session))
+            building = time.monotonic()
+            response = build_response(method, path, headers, routes, request_keep_alive)
+            sending = time.monotonic()
+            sent = write_response(client_connection, response)
+            log_request(method, path, response, sent, started, building, sending,
+                        time.monotonic())
+            if not request_keep_alive:
+                break
+    except OSError:
+        pass
+    finally:
+        if not parked:
+            client_connection.close()
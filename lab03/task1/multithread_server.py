@@ -1,55 +1,282 @@
+import json
+import queue
+import selectors
+import signal
 import socket
 import threading
-import os
-
-def handle_client(client_connection):
-    request = client_connection.recv(1024).decode()
-    
-    request_lines = request.splitlines()
-    if len(request_lines) > 0:
-        request_line = request_lines[0]
-        print(f'Request: {request_line}')
-        file_name = request_line.split()[1]
-
-        if file_name.startswith('/'):
-            file_name = file_name[1:]
-
-        if os.path.exists(file_name) and os.path.isfile(file_name):
-            with open(file_name, 'rb') as f:
-                response_body = f.read()
-            response_line = 'HTTP/1.1 200 OK\n'
-        else:
-            response_body = b'<html><body><h1>404 Not Found</h1></body></html>'
-            response_line = 'HTTP/1.1 404 Not Found\n'
-
-        response_headers = 'Content-Length: {}\nContent-Type: text/html\n\n'.format(len(response_body))
-        response = response_line + response_headers
-        client_connection.sendall(response.encode() + response_body)
-    
-    client_connection.close()
-
-def start_server(server_port):
-   
+import time
+from collections import deque
+from http_handler import KEEP_ALIVE_TIMEOUT, ClientSession, send_response, serve_session
+
+WORKERS = 16  # рабочих потоков (concurrency_level)
+QUEUE_SIZE = 64  # принятых соединений, ожидающих свободного потока
+BACKLOG = 128  # очередь ядра для еще не принятых соединений
+REJECT_TIMEOUT = 1  # сколько ждать отправки ответа 503, секунды
+ACCEPT_POLL_INTERVAL = 0.5  # как часто accept прерывается, чтобы сработали обработчики сигналов
+POOL_STATS_PATH = '/__debug/pool'
+SERVICE_UNAVAILABLE_BODY = b'<html><body><h1>503 Service Unavailable</h1></body></html>'
+
+pool = None
+idle = None
+STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
+def start_thread(target, name):
+    # Сигналы должен получать главный поток: только тогда они прерывают
+    # accept, поэтому остальные потоки создаются с заблокированными сигналами
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+    try:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+class WorkerPool:
+    """Фиксированный набор потоков, берущих соединения из ограниченной очереди.
+
+    Если все потоки заняты и очередь полна, новое соединение не ставится
+    в очередь, а сразу получает 503 — так всплеск клиентов не порождает
+    новых потоков. В очереди лежат ClientSession: соединение keep-alive
+    возвращается в нее из IdleConnections, когда клиент прислал запрос.
+    """
+
+    def __init__(self, workers, queue_size, handler):
+        self.workers = workers
+        self.handler = handler
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.served = 0
+        self.finished = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        for index in range(workers):
+            start_thread(self._run, f'worker-{index}')
+
+    def submit(self, session):
+        """Ставит сессию в очередь; False, если очередь заполнена"""
+        try:
+            self.queue.put_nowait((session, time.monotonic()))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def _run(self):
+        while True:
+            session, queued_at = self.queue.get()
+            wait = time.monotonic() - queued_at
+            with self.lock:
+                self.busy += 1
+                self.served += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                self.handler(session, queued_at)
+            except Exception as e:
+                print(f'Error handling connection: {e}')
+                session.connection.close()
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.finished += 1
+
+    def drain(self, timeout):
+        """Ждет, пока потоки обработают все принятые соединения; False, если не дождались"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if self.finished == self.accepted:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'served': self.served,
+                'avg_wait_ms': round(self.total_wait / self.served * 1000, 3) if self.served else 0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'idle': idle.count() if idle is not None else 0,
+            }
+
+
+class IdleConnections:
+    """Соединения keep-alive, ждущие следующего запроса без рабочего потока.
+
+    Рабочий поток, отправив ответ, не ждет в recv следующего запроса, а
+    отдает сессию сюда. Один поток следит за всеми такими соединениями
+    через selectors и, как только клиент что-то прислал, снова ставит
+    сессию в очередь пула через resume. Соединения, молчащие дольше
+    KEEP_ALIVE_TIMEOUT, закрываются.
+    """
+
+    def __init__(self, resume):
+        self.resume = resume
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = []  # отданные сессии, которые поток еще не зарегистрировал
+        self.deadlines = deque()  # (срок, сессия) в порядке передачи
+        self.sessions = {}  # зарегистрированная в selector сессия -> ее срок
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        start_thread(self._run, 'idle-connections')
+
+    def park(self, session):
+        with self.lock:
+            self.pending.append(session)
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # Буфер полон — поток и так проснется
+            pass
+
+    def count(self):
+        with self.lock:
+            return len(self.pending) + len(self.sessions)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            deadline = time.monotonic() + KEEP_ALIVE_TIMEOUT
+            for session in pending:
+                try:
+                    self.selector.register(session.connection, selectors.EVENT_READ, session)
+                except (ValueError, OSError):
+                    session.connection.close()
+                    continue
+                with self.lock:
+                    self.sessions[session] = deadline
+                self.deadlines.append((deadline, session))
+
+            now = time.monotonic()
+            while self.deadlines:
+                deadline, session = self.deadlines[0]
+                if self.sessions.get(session) != deadline:
+                    # Сессию уже вернули в пул
+                    self.deadlines.popleft()
+                elif deadline <= now:
+                    self.deadlines.popleft()
+                    self._forget(session)
+                    session.connection.close()
+                else:
+                    break
+            timeout = self.deadlines[0][0] - now if self.deadlines else None
+
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.wakeup_reader:
+                    try:
+                        self.wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                session = key.data
+                self._forget(session)
+                if self._closed_by_client(session):
+                    session.connection.close()
+                else:
+                    self.resume(session)
+
+    def _closed_by_client(self, session):
+        # Клиент закрыл соединение: место в очереди пула ради этого не нужно
+        try:
+            return session.connection.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def _forget(self, session):
+        self.selector.unregister(session.connection)
+        with self.lock:
+            del self.sessions[session]
+
+
+def reject_client(client_connection, timeout=REJECT_TIMEOUT):
+    """Отвечает 503, когда свободных потоков и мест в очереди нет.
+
+    timeout=0 — отправить без ожидания: если ответ не помещается
+    в буфер сокета, соединение просто закрывается.
+    """
+    try:
+        client_connection.settimeout(timeout)
+        send_response(client_connection, 'HTTP/1.1 503 Service Unavailable', 'text/html',
+                      SERVICE_UNAVAILABLE_BODY, [('Retry-After', 1), ('Connection', 'close')])
+    except OSError:
+        pass
+    finally:
+        client_connection.close()
+
+
+def pool_stats():
+    return 'application/json', json.dumps(pool.stats()).encode()
+
+def serve_client(session, accepted_at):
+    serve_session(session, {POOL_STATS_PATH: pool_stats}, accepted_at, park=idle.park)
+
+def resume_client(session):
+    """Клиент прислал запрос на молчавшем соединении: обратно в очередь пула"""
+    if not pool.submit(session):
+        # Вызывается в потоке IdleConnections: ожидание отправки задержало
+        # бы все остальные соединения, которые он отслеживает
+        reject_client(session.connection, timeout=0)
+
+def start_server(server_port, workers=WORKERS, queue_size=QUEUE_SIZE, backlog=BACKLOG,
+                 reuse_port=False):
+    global pool, idle
+
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        # Несколько процессов слушают один порт, ядро делит между ними соединения
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind(('localhost', server_port))
-    server_socket.listen(5)
-    print(f'Server started on port {server_port}...')
+    server_socket.listen(backlog)
+    # Сигнал, пришедший перед самым вызовом accept, не прерывает его,
+    # и обработчик ждал бы следующего клиента — поэтому accept с таймаутом
+    server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+    idle = IdleConnections(resume_client)
+    pool = WorkerPool(workers, queue_size, serve_client)
+    print(f'Server started on port {server_port} with {workers} workers...')
+
+    try:
+        while True:
 
-    while True:
-        
-        client_connection, client_address = server_socket.accept()
-        print(f'Connection from {client_address}')
+            try:
+                client_connection, client_address = server_socket.accept()
+            except socket.timeout:
+                continue
+            print(f'Connection from {client_address}')
 
-        
-        client_thread = threading.Thread(target=handle_client, args=(client_connection,))
-        client_thread.start()
+            if not pool.submit(ClientSession(client_connection)):
+                reject_client(client_connection)
+    finally:
+        server_socket.close()
 
 if __name__ == '__main__':
     import sys
-    
-    if len(sys.argv) != 2:
-        print("Usage: python server.py <server_port>")
+
+    if not 2 <= len(sys.argv) <= 5:
+        print("Usage: python multithread_server.py <server_port> "
+              "[concurrency_level] [queue_size] [backlog]")
         sys.exit(1)
-    
+
     port = int(sys.argv[1])
-    start_server(port)
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else WORKERS
+    queue_size = int(sys.argv[3]) if len(sys.argv) > 3 else QUEUE_SIZE
+    backlog = int(sys.argv[4]) if len(sys.argv) > 4 else BACKLOG
+    start_server(port, workers, queue_size, backlog)
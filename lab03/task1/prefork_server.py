@@ -0,0 +1,172 @@
+import os
+import signal
+import socket
+import time
+import traceback
+from contextlib import contextmanager
+import multithread_server
+from event_loop_server import EventLoopServer
+from http_handler import access_log
+
+PROCESSES = os.cpu_count() or 1  # рабочих процессов, по одному на ядро
+MODES = ('threads', 'event')  # чем каждый процесс обслуживает соединения
+BACKLOG = 1024  # очередь ядра у каждого процесса
+MIN_UPTIME = 1  # процесс, проживший меньше, считаем упавшим при запуске, секунды
+RESTART_DELAY = 1  # пауза перед перезапуском такого процесса, секунды
+SHUTDOWN_TIMEOUT = 10  # сколько ждать, пока процессы доотправят начатые ответы, секунды
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class Shutdown(Exception):
+    """Пришел сигнал остановки"""
+
+
+def raise_shutdown(signum, frame):
+    raise Shutdown()
+
+
+@contextmanager
+def signals_blocked():
+    """Откладывает сигналы остановки, пока выполняется блок"""
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+def run_worker(server_port, mode, backlog):
+    """Тело рабочего процесса: свой сокет на общем порту и обычный цикл сервера.
+
+    SIGINT игнорируется — Ctrl+C из терминала получает вся группа
+    процессов, а останавливать рабочие процессы должен мастер. По
+    SIGTERM процесс перестает принимать соединения и завершает начатые.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if mode == 'event':
+        server = EventLoopServer(server_port, backlog, reuse_port=True)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(SHUTDOWN_TIMEOUT))
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        print(f'Worker {os.getpid()} started on port {server_port} (event loop)...')
+        server.serve_forever()
+        return
+
+    signal.signal(signal.SIGTERM, raise_shutdown)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+    try:
+        multithread_server.start_server(server_port, backlog=backlog, reuse_port=True)
+    except Shutdown:
+        if multithread_server.pool is not None:
+            multithread_server.pool.drain(SHUTDOWN_TIMEOUT)
+
+
+def describe_exit(status):
+    code = os.waitstatus_to_exitcode(status)
+    if code < 0:
+        return f'killed by {signal.Signals(-code).name}'
+    return f'exited with code {code}'
+
+
+class Master:
+    """Запускает рабочие процессы и следит за ними.
+
+    Каждый процесс сам открывает сокет на общем порту с SO_REUSEPORT,
+    и ядро распределяет входящие соединения между процессами — у них
+    нет общей очереди accept и общей блокировки. Упавший процесс
+    перезапускается; по SIGTERM или Ctrl+C мастер останавливает всех.
+    """
+
+    def __init__(self, server_port, processes, mode, backlog):
+        self.server_port = server_port
+        self.processes = processes
+        self.mode = mode
+        self.backlog = backlog
+        self.children = {}  # pid -> когда запущен
+
+    def spawn(self):
+        # Вызывается с заблокированными сигналами: обработчики мастера
+        # не должны сработать в только что созданном процессе
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.server_port, self.mode, self.backlog)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                # os._exit не вызывает atexit: дописываем журнал сами
+                access_log.close()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def run(self):
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, raise_shutdown)
+        print(f'Master {os.getpid()} starting {self.processes} workers '
+              f'on port {self.server_port} ({self.mode})...')
+        try:
+            with signals_blocked():
+                for _ in range(self.processes):
+                    self.spawn()
+            while True:
+                pid, status = os.wait()
+                with signals_blocked():
+                    started = self.children.pop(pid, None)
+                if started is None:
+                    continue
+                print(f'Worker {pid} {describe_exit(status)}, restarting')
+                if time.monotonic() - started < MIN_UPTIME:
+                    # Процесс падает сразу после старта: не перезапускаем его в цикле без паузы
+                    time.sleep(RESTART_DELAY)
+                with signals_blocked():
+                    self.spawn()
+        except Shutdown:
+            pass
+        self.shutdown()
+
+    def shutdown(self):
+        print(f'Stopping {len(self.children)} workers...')
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # Повторный Ctrl+C не ждет, пока процессы завершатся сами
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 1
+        try:
+            while self.children and time.monotonic() < deadline:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    time.sleep(0.1)
+                    continue
+                self.children.pop(pid, None)
+        except Shutdown:
+            pass
+        for pid in self.children:
+            print(f'Worker {pid} did not stop in time, killing')
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+
+
+def start_server(server_port, processes=PROCESSES, mode='threads', backlog=BACKLOG):
+    Master(server_port, processes, mode, backlog).run()
+
+if __name__ == '__main__':
+    import sys
+
+    if not 2 <= len(sys.argv) <= 4 or (len(sys.argv) > 3 and sys.argv[3] not in MODES):
+        print("Usage: python prefork_server.py <server_port> [processes] [threads|event]")
+        sys.exit(1)
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("SO_REUSEPORT is not supported on this platform")
+        sys.exit(1)
+
+    port = int(sys.argv[1])
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else PROCESSES
+    mode = sys.argv[3] if len(sys.argv) > 3 else 'threads'
+    start_server(port, processes, mode)
@@ -1,5 +1,5 @@
 import socket
-import os
+from http_handler import handle_client
 
 def start_server(server_port):
    
@@ -10,35 +10,9 @@ def start_server(server_port):
 
     while True:
         client_connection, client_address = server_socket.accept()
-        request = client_connection.recv(1024).decode()
-        
-        
-        request_lines = request.splitlines()
-        if len(request_lines) > 0:
-            request_line = request_lines[0]
-            print(f'Request: {request_line}')
-            file_name = request_line.split()[1]
-
-            
-            if file_name.startswith('/'):
-                file_name = file_name[1:]
-
-            
-            if os.path.exists(file_name) and os.path.isfile(file_name):
-                with open(file_name, 'rb') as f:
-                    response_body = f.read()
-                response_line = 'HTTP/1.1 200 OK\n'
-            else:
-                response_body = b'<html><body><h1>404 Not Found</h1></body></html>'
-                response_line = 'HTTP/1.1 404 Not Found\n'
-
-            
-            response_headers = 'Content-Length: {}\nContent-Type: text/html\n\n'.format(len(response_body))
-            response = response_line + response_headers
-            client_connection.sendall(response.encode() + response_body)
-        
-        
-        client_connection.close()
+        # Один поток на всех: отвечаем на уже присланные запросы, но не ждем
+        # следующего, пока другие клиенты в очереди
+        handle_client(client_connection, keep_alive=False)
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,345 @@
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bench_stats import latency_summary, make_report, parse_size, wait_for_port, write_report
+
+BENCH_HOST = '127.0.0.1'
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_START_TIMEOUT = 10  # сколько ждать, пока сервер начнет принимать соединения
+SERVER_STOP_TIMEOUT = 15  # prefork дожидается начатых ответов перед выходом
+REQUEST_TIMEOUT = 30
+READ_CHUNK = 256 * 1024
+FILL_BLOCK = 1024 * 1024  # файлы собираются из повторяющегося случайного блока
+
+# server.py, multithread_server.py, event_loop_server.py и prefork_server.py в двух вариантах
+MODES = ('single', 'threads', 'event', 'prefork', 'prefork-event')
+DEFAULT_MODES = 'single,threads,event,prefork'
+DEFAULT_SIZES = '1K,64K,1M'
+
+
+def server_command(mode, port, args):
+    """Командная строка запуска сервера в указанном режиме"""
+    python = sys.executable
+    if mode == 'single':
+        return [python, os.path.join(SERVER_DIR, 'server.py'), str(port)]
+    if mode == 'threads':
+        return [python, os.path.join(SERVER_DIR, 'multithread_server.py'), str(port),
+                str(args.threads), str(args.queue_size)]
+    if mode == 'event':
+        return [python, os.path.join(SERVER_DIR, 'event_loop_server.py'), str(port)]
+    if mode in ('prefork', 'prefork-event'):
+        return [python, os.path.join(SERVER_DIR, 'prefork_server.py'), str(port),
+                str(args.processes), 'event' if mode == 'prefork-event' else 'threads']
+    raise ValueError(mode)
+
+
+def parse_modes(text):
+    modes = [mode.strip() for mode in text.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(
+                f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    return modes
+
+
+def parse_sizes(text):
+    return [(item.strip(), parse_size(item)) for item in text.split(',') if item.strip()]
+
+
+def create_file(directory, label, size):
+    """Создает файл указанного размера и возвращает путь запроса к нему"""
+    name = f'file_{label}.bin'
+    block = os.urandom(min(size, FILL_BLOCK))
+    with open(os.path.join(directory, name), 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            remaining -= f.write(block[:remaining])
+    return '/' + name
+
+
+def process_tree(pid):
+    """pid процесса и всех его потомков (только Linux)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, ()))
+    return tree
+
+
+def read_cpu_seconds(pids):
+    """Процессорное время процессов (user + system) в секундах"""
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+
+def read_peak_rss(pids):
+    """Сумма пиковой резидентной памяти процессов в байтах"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def free_port():
+    """Свободный порт для очередного запуска сервера.
+
+    Серверы lab03 не ставят SO_REUSEADDR, поэтому порт предыдущего
+    запуска, оставшийся в TIME_WAIT, занять нельзя — берем новый.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((BENCH_HOST, 0))
+        return probe.getsockname()[1]
+
+
+class Client:
+    """Клиент нагрузки: запрашивает один файл раз за разом"""
+
+    def __init__(self, port, path, keep_alive, deadline, measure_from):
+        self.port = port
+        self.path = path
+        self.headers = {} if keep_alive else {'Connection': 'close'}
+        self.deadline = deadline
+        self.measure_from = measure_from
+        self.latencies = []
+        self.received = 0
+        self.statuses = {}
+        self.errors = 0
+        self.connection = None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            started = time.monotonic()
+            try:
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(
+                        BENCH_HOST, self.port, timeout=REQUEST_TIMEOUT)
+                self.connection.request('GET', self.path, headers=self.headers)
+                response = self.connection.getresponse()
+                received = 0
+                while True:
+                    chunk = response.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                if response.will_close:
+                    self.connection.close()
+                    self.connection = None
+            except (OSError, http.client.HTTPException):
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                if started >= self.measure_from:
+                    self.errors += 1
+                continue
+            if started >= self.measure_from:
+                self.latencies.append(time.monotonic() - started)
+                self.received += received
+                status = str(response.status)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+        if self.connection is not None:
+            self.connection.close()
+
+
+def merge_counts(counts):
+    """Складывает словари статус -> число ответов"""
+    total = {}
+    for count in counts:
+        for status, number in count.items():
+            total[status] = total.get(status, 0) + number
+    return total
+
+
+def run_clients(port, path, keep_alive, count, deadline, measure_from, results):
+    """Запускает count клиентов в потоках одного процесса и отдает их итоги в results"""
+    clients = [Client(port, path, keep_alive, deadline, measure_from) for _ in range(count)]
+    threads = [threading.Thread(target=client.run, daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({
+        'latencies': [latency for client in clients for latency in client.latencies],
+        'received': sum(client.received for client in clients),
+        'statuses': merge_counts(client.statuses for client in clients),
+        'errors': sum(client.errors for client in clients),
+    })
+
+
+def start_server(mode, port, args):
+    # Сервер отдает файлы из текущего каталога — каталога с тестовыми файлами
+    server = subprocess.Popen(server_command(mode, port, args), cwd=args.workdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(BENCH_HOST, port, SERVER_START_TIMEOUT):
+        server.kill()
+        raise RuntimeError(f"server in mode {mode} did not start")
+    return server
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(SERVER_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_case(mode, size_label, size, path, args):
+    """Нагружает сервер в одном режиме запросами одного файла"""
+    port = free_port()
+    server = start_server(mode, port, args)
+    try:
+        pids = process_tree(server.pid)
+        cpu_before = read_cpu_seconds(pids)
+        measure_from = time.monotonic() + args.warmup
+        deadline = measure_from + args.duration
+
+        # Клиенты на Python упираются в GIL, поэтому нагрузку дают несколько процессов
+        results = multiprocessing.Queue()
+        processes = []
+        for index in range(args.client_processes):
+            count = args.concurrency // args.client_processes \
+                + (index < args.concurrency % args.client_processes)
+            if count == 0:
+                continue
+            process = multiprocessing.Process(
+                target=run_clients,
+                args=(port, path, args.keep_alive, count, deadline, measure_from, results),
+                daemon=True)
+            process.start()
+            processes.append(process)
+        # Запрос, начатый перед самым концом замера, может длиться до REQUEST_TIMEOUT
+        wait_until = deadline + REQUEST_TIMEOUT + SERVER_START_TIMEOUT
+        reports = [results.get(timeout=max(0, wait_until - time.monotonic()))
+                   for _ in processes]
+        for process in processes:
+            process.join()
+        # Скорость считается по окну замера: клиент, застрявший в очереди
+        # однопоточного сервера, не должен растягивать его на таймаут
+        elapsed = deadline - measure_from
+
+        # Потомки могли смениться (prefork перезапускает упавшие процессы)
+        pids = process_tree(server.pid)
+        cpu_seconds = read_cpu_seconds(pids) - cpu_before
+        peak_rss = read_peak_rss(pids)
+    finally:
+        stop_server(server)
+
+    latencies = [latency for report in reports for latency in report['latencies']]
+    received = sum(report['received'] for report in reports)
+    statuses = merge_counts(report['statuses'] for report in reports)
+
+    return {
+        'mode': mode,
+        'size': size_label,
+        'size_bytes': size,
+        'duration_s': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': sum(report['errors'] for report in reports),
+        'statuses': statuses,
+        'requests_per_s': round(len(latencies) / elapsed, 2),
+        'bytes': received,
+        'bytes_per_s': round(received / elapsed, 2),
+        'latency': latency_summary(latencies),
+        'server_processes': len(pids),
+        'server_cpu_s': round(cpu_seconds, 3),
+        'server_cpu_percent': round(cpu_seconds / elapsed * 100, 1),
+        'server_peak_rss_bytes': peak_rss,
+    }
+
+
+def format_table(runs):
+    header = (f"{'mode':<14} {'size':>6} {'req/s':>9} {'MB/s':>9} {'p50 ms':>8} {'p90 ms':>8} "
+              f"{'p99 ms':>8} {'errors':>7} {'non-200':>7} {'CPU %':>6} {'RSS MB':>7}")
+    lines = [header, '-' * len(header)]
+    for run in runs:
+        latency = run['latency']
+        non_ok = sum(number for status, number in run['statuses'].items() if status != '200')
+        lines.append(
+            f"{run['mode']:<14} {run['size']:>6} {run['requests_per_s']:>9.1f} "
+            f"{run['bytes_per_s'] / 1024 ** 2:>9.2f} "
+            f"{latency.get('p50_ms', 0):>8.2f} {latency.get('p90_ms', 0):>8.2f} "
+            f"{latency.get('p99_ms', 0):>8.2f} {run['errors']:>7} {non_ok:>7} "
+            f"{run['server_cpu_percent']:>6.1f} {run['server_peak_rss_bytes'] / 1024 ** 2:>7.1f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lab03 web server modes under load")
+    parser.add_argument('--modes', type=parse_modes, default=parse_modes(DEFAULT_MODES),
+                        help=f"server modes to compare, from {', '.join(MODES)} "
+                             f"(default {DEFAULT_MODES})")
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+                        help=f"sizes of the requested file, e.g. 1K,1M,1G (default {DEFAULT_SIZES})")
+    parser.add_argument('--concurrency', type=int, default=16, help="number of clients")
+    parser.add_argument('--client-processes', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="processes that run the clients")
+    parser.add_argument('--duration', type=float, default=10, help="measurement time, seconds")
+    parser.add_argument('--warmup', type=float, default=1, help="warmup before measuring, seconds")
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help="open a new connection for every request")
+    parser.add_argument('--threads', type=int, default=16,
+                        help="worker threads of multithread_server.py")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="accept queue of multithread_server.py")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="worker processes of prefork_server.py")
+    parser.add_argument('--json', metavar='PATH', help="write the results as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='server-bench-') as workdir:
+        args.workdir = workdir
+        for size_label, size in args.sizes:
+            print(f"Creating {size_label} file...", file=sys.stderr)
+            path = create_file(workdir, size_label, size)
+            for mode in args.modes:
+                print(f"Measuring {mode} with {size_label}...", file=sys.stderr)
+                runs.append(run_case(mode, size_label, size, path, args))
+            os.remove(os.path.join(workdir, path[1:]))
+
+    settings = {
+        'concurrency': args.concurrency,
+        'client_processes': args.client_processes,
+        'duration_s': args.duration,
+        'warmup_s': args.warmup,
+        'keep_alive': args.keep_alive,
+        'threads': args.threads,
+        'queue_size': args.queue_size,
+        'processes': args.processes,
+    }
+    write_report(make_report(settings, runs), format_table(runs), args.json)
+
+
+if __name__ == '__main__':
+    main()
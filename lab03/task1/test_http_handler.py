@@ -0,0 +1,130 @@
+import socket
+import threading
+
+import pytest
+
+from event_loop_server import EventLoopServer
+from http_handler import handle_client
+
+BODY = b'hello world ' * 1000
+
+
+def read_response(sock, buffer):
+    """Читает из сокета один ответ с Content-Length; возвращает (заголовки, тело)"""
+    while b'\r\n\r\n' not in buffer:
+        data = sock.recv(65536)
+        if not data:
+            raise EOFError(bytes(buffer))
+        buffer += data
+    end = buffer.index(b'\r\n\r\n')
+    head = bytes(buffer[:end]).decode('iso-8859-1')
+    del buffer[:end + 4]
+    headers = dict(line.split(': ', 1) for line in head.split('\r\n')[1:])
+    length = 0 if head.startswith('HEAD') else int(headers.get('Content-Length', 0))
+    return head, headers, length
+
+
+def read_body(sock, buffer, length):
+    while len(buffer) < length:
+        data = sock.recv(65536)
+        if not data:
+            raise EOFError(bytes(buffer))
+        buffer += data
+    body = bytes(buffer[:length])
+    del buffer[:length]
+    return body
+
+
+def threaded_server(keep_alive):
+    listener = socket.create_server(('localhost', 0))
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle_client, args=(conn,),
+                             kwargs={'keep_alive': keep_alive}, daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1], listener.close
+
+
+def event_loop_server():
+    server = EventLoopServer(0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.stop(0)
+        thread.join(5)
+
+    return server.server_socket.getsockname()[1], stop
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'page.txt').write_bytes(BODY)
+    (tmp_path / 'big.bin').write_bytes(BODY * 200)
+
+
+@pytest.fixture(params=['threads', 'event'])
+def server_port(request, site):
+    if request.param == 'threads':
+        port, stop = threaded_server(keep_alive=True)
+    else:
+        port, stop = event_loop_server()
+    yield port
+    stop()
+
+
+@pytest.mark.parametrize('path, size', [('/page.txt', len(BODY)), ('/big.bin', len(BODY) * 200)])
+def test_head_then_get_on_keep_alive(server_port, path, size):
+    with socket.create_connection(('localhost', server_port), timeout=5) as sock:
+        buffer = bytearray()
+        for _ in range(2):
+            sock.sendall(f'HEAD {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+            status, headers, _ = read_response(sock, buffer)
+            assert status.startswith('HTTP/1.1 200')
+            assert int(headers['Content-Length']) == size
+
+            sock.sendall(f'GET {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+            status, headers, length = read_response(sock, buffer)
+            assert status.startswith('HTTP/1.1 200')
+            assert length == size
+            assert read_body(sock, buffer, length) == (BODY * (size // len(BODY)))
+
+
+def test_single_thread_server_answers_pipelined_requests(site):
+    port, stop = threaded_server(keep_alive=False)
+    try:
+        with socket.create_connection(('localhost', port), timeout=5) as sock:
+            sock.sendall(b'GET /page.txt HTTP/1.1\r\n\r\n' * 3)
+            buffer = bytearray()
+            for index in range(3):
+                status, headers, length = read_response(sock, buffer)
+                assert status.startswith('HTTP/1.1 200')
+                assert read_body(sock, buffer, length) == BODY
+                assert headers['Connection'] == ('close' if index == 2 else 'keep-alive')
+            assert sock.recv(1) == b''
+    finally:
+        stop()
+
+
+def test_chunked_request_body_is_rejected(server_port):
+    with socket.create_connection(('localhost', server_port), timeout=5) as sock:
+        sock.sendall(b'POST /page.txt HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                     b'1c\r\nGET /big.bin HTTP/1.1\r\n\r\n\r\n0\r\n\r\n')
+        buffer = bytearray()
+        status, headers, length = read_response(sock, buffer)
+        assert status.startswith('HTTP/1.1 411')
+        read_body(sock, buffer, length)
+        # Тело не должно прочитаться как запрос /big.bin
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            buffer += data
+        assert not buffer
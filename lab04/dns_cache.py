@@ -0,0 +1,161 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class DNSEntry:
+    def __init__(self, addresses, error, expires_at, stale_until):
+        self.addresses = addresses
+        # Храним тип и аргументы ошибки, а не сам экземпляр: каждый raise
+        # общего экземпляра дописывает кадры в его __traceback__, и они
+        # держат локальные переменные обработчиков до конца срока записи
+        self.error = None if error is None else (type(error), error.args)
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+
+    def exception(self):
+        """Новый экземпляр сохраненной ошибки"""
+        error_type, args = self.error
+        return error_type(*args)
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def connect_any(addresses, timeout):
+    """Подключается к первому доступному адресу из результата getaddrinfo"""
+    last_error = None
+    for family, sock_type, proto, _, sockaddr in addresses:
+        sock = socket.socket(family, sock_type, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            last_error = e
+            sock.close()
+    raise last_error or OSError("No addresses to connect to")
+
+
+async def open_connection_any(addresses, timeout):
+    """Открывает потоки asyncio к первому доступному адресу из getaddrinfo"""
+    last_error = None
+    for _, _, _, _, sockaddr in addresses:
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(sockaddr[0], sockaddr[1]), timeout)
+        except OSError as e:
+            last_error = e
+    raise last_error or OSError("No addresses to connect to")
+
+
+class DNSCache:
+    """Кеш разрешения имен с ограничением по времени жизни и размеру.
+
+    Имена разрешаются в отдельном пуле потоков, поэтому медленный DNS
+    задерживает только тех клиентов, которые ждут именно это имя.
+    Одновременные запросы одного имени объединяются в один вызов
+    getaddrinfo. Ошибки разрешения тоже кешируются, но на меньший срок.
+    Устаревшая запись еще stale_ttl секунд отдается сразу, а свежая
+    запрашивается в фоне.
+    """
+
+    def __init__(self, ttl, negative_ttl, stale_ttl, max_entries, workers):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+
+    def submit(self, host, port):
+        """Возвращает Future со списком адресов в формате getaddrinfo"""
+        key = (host, port)
+        now = time.monotonic()
+        refresh = None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if now >= entry.expires_at and key not in self.inflight:
+                    refresh = self.inflight[key] = Future()
+                result = Future()
+                if entry.error is not None:
+                    result.set_exception(entry.exception())
+                else:
+                    result.set_result(entry.addresses)
+            elif key in self.inflight:
+                self.merged += 1
+                return self.inflight[key]
+            else:
+                self.misses += 1
+                result = refresh = self.inflight[key] = Future()
+        if refresh is not None:
+            self.executor.submit(self._resolve, key, refresh)
+        return result
+
+    def resolve(self, host, port, timeout=None):
+        """Разрешает имя, дожидаясь результата не дольше timeout секунд"""
+        if is_ip_address(host):
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return self.submit(host, port).result(timeout)
+
+    async def resolve_async(self, host, port):
+        """То же для asyncio: ожидание не блокирует цикл событий"""
+        if is_ip_address(host):
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        # shield: отмена одного ожидающего (например, по тайм-ауту) не должна
+        # отменять общий запрос, который ждут и другие клиенты
+        return await asyncio.shield(asyncio.wrap_future(self.submit(host, port)))
+
+    def connect(self, host, port, timeout):
+        """Создает TCP-соединение, разрешая имя через кеш"""
+        return connect_any(self.resolve(host, port, timeout), timeout)
+
+    def _resolve(self, key, future):
+        host, port = key
+        try:
+            addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            error = None
+            ttl = self.ttl
+        except OSError as e:
+            addresses = None
+            error = e
+            ttl = self.negative_ttl
+
+        now = time.monotonic()
+        with self.lock:
+            old = self.entries.get(key)
+            if error is not None and old is not None and old.error is None \
+                    and now < old.stale_until:
+                # Фоновое обновление не удалось: дослуживает старая запись
+                addresses, error = old.addresses, None
+            else:
+                self.entries[key] = DNSEntry(addresses, error, now + ttl,
+                                             now + ttl + (self.stale_ttl if error is None else 0))
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            del self.inflight[key]
+
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(addresses)
@@ -0,0 +1,316 @@
+# Способы определить конец тела HTTP-сообщения (RFC 9112, 6.3)
+BODY_NONE = 'none'
+BODY_LENGTH = 'length'
+BODY_CHUNKED = 'chunked'
+BODY_UNTIL_CLOSE = 'until-close'
+
+MAX_LINE_SIZE = 4096  # предел длины строки размера фрагмента и трейлера
+HEAD_TERMINATOR = b'\r\n\r\n'
+
+
+class HTTPParseError(ValueError):
+    """Ошибка разбора HTTP-сообщения"""
+
+
+class Headers:
+    """Заголовки HTTP-сообщения без учета регистра имен.
+
+    Хранит исходный порядок и написание имен, повторяющиеся заголовки
+    не склеиваются, а get() объединяет их значения через запятую.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._index = {}
+        for name, value in items:
+            self.add(name, value)
+
+    @classmethod
+    def parse(cls, lines):
+        """Разбирает строки заголовков вида 'Name: value'"""
+        headers = cls()
+        for line in lines:
+            name, sep, value = line.partition(':')
+            name = name.strip()
+            if not sep or not name:
+                raise HTTPParseError(f"Некорректный заголовок: {line!r}")
+            headers.add(name, value.strip())
+        return headers
+
+    def add(self, name, value):
+        self._items.append((name, value))
+        self._index.setdefault(name.lower(), []).append(value)
+
+    def remove(self, *names):
+        """Удаляет все заголовки с указанными именами"""
+        lowered = {name.lower() for name in names}
+        self._items = [(n, v) for n, v in self._items if n.lower() not in lowered]
+        for name in lowered:
+            self._index.pop(name, None)
+
+    def get(self, name, default=None):
+        values = self._index.get(name.lower())
+        if not values:
+            return default
+        return ', '.join(values)
+
+    def get_all(self, name):
+        return list(self._index.get(name.lower(), ()))
+
+    def copy(self):
+        return Headers(self._items)
+
+    def items(self):
+        return list(self._items)
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def to_lines(self):
+        return [f"{name}: {value}" for name, value in self._items]
+
+    def has_token(self, name, token):
+        """Проверяет, есть ли token в списке значений заголовка (Connection и т.п.)"""
+        token = token.lower()
+        return any(part.strip().lower() == token
+                   for value in self._index.get(name.lower(), ())
+                   for part in value.split(','))
+
+
+class RequestHead:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+
+class ResponseHead:
+    def __init__(self, version, status, reason, headers):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+    @property
+    def status_line(self):
+        return f"{self.version} {self.status} {self.reason}".rstrip()
+
+
+def _split_head(head):
+    text = bytes(head).decode('iso-8859-1')
+    lines = text.split('\r\n')
+    return lines[0], Headers.parse(line for line in lines[1:] if line)
+
+
+def parse_request_head(head):
+    """Разбирает строку запроса и заголовки (без завершающего CRLF CRLF)"""
+    start_line, headers = _split_head(head)
+    parts = start_line.split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise HTTPParseError(f"Некорректная строка запроса: {start_line!r}")
+    return RequestHead(parts[0], parts[1], parts[2], headers)
+
+
+def parse_response_head(head):
+    """Разбирает строку статуса и заголовки (без завершающего CRLF CRLF)"""
+    start_line, headers = _split_head(head)
+    parts = start_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+        raise HTTPParseError(f"Некорректная строка статуса: {start_line!r}")
+    return ResponseHead(parts[0], int(parts[1]), parts[2] if len(parts) > 2 else '', headers)
+
+
+class HeadReader:
+    """Накапливает начало сообщения, пока не придут заголовки целиком.
+
+    Конец заголовков ищется только в новых данных (с захватом трех байт
+    на стыке), так что каждый байт просматривается один раз.
+    """
+
+    def __init__(self, max_size, data=b''):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.head_end = -1
+        if data:
+            self.feed(data)
+
+    def feed(self, data):
+        """Добавляет данные; возвращает True, когда заголовки получены"""
+        self.buffer += data
+        if self.head_end != -1:
+            return True
+        end = self.buffer.find(HEAD_TERMINATOR, max(0, self.scanned - 3))
+        if end == -1:
+            self.scanned = len(self.buffer)
+            if self.scanned > self.max_size:
+                raise HTTPParseError("Слишком большие заголовки")
+            return False
+        self.head_end = end
+        return True
+
+    @property
+    def complete(self):
+        return self.head_end != -1
+
+    @property
+    def head(self):
+        return bytes(self.buffer[:self.head_end])
+
+    @property
+    def rest(self):
+        """Байты после заголовков: начало тела и, возможно, следующие запросы"""
+        return bytes(self.buffer[self.head_end + len(HEAD_TERMINATOR):])
+
+
+def _content_length(headers):
+    values = {value.strip() for value in headers.get('content-length', '').split(',')}
+    if len(values) != 1:
+        raise HTTPParseError("Противоречивые значения Content-Length")
+    value = values.pop()
+    if not value.isdigit():
+        raise HTTPParseError("Некорректный Content-Length")
+    return int(value)
+
+
+def request_framing(headers):
+    """Определяет, как найти конец тела запроса (у запроса оно не бывает до закрытия)"""
+    if 'transfer-encoding' in headers:
+        if not headers.has_token('transfer-encoding', 'chunked'):
+            raise HTTPParseError("Неподдерживаемый Transfer-Encoding запроса")
+        return BODY_CHUNKED, None
+    if 'content-length' in headers:
+        length = _content_length(headers)
+        return (BODY_LENGTH, length) if length else (BODY_NONE, 0)
+    return BODY_NONE, 0
+
+
+def is_interim_status(status_code):
+    """Промежуточный ответ 1xx: за ним на тот же запрос придет окончательный.
+
+    101 Switching Protocols окончательный — после него соединение
+    переходит на другой протокол.
+    """
+    return 100 <= status_code < 200 and status_code != 101
+
+
+def response_framing(method, status_code, headers):
+    """Определяет, как найти конец тела ответа.
+
+    Возвращает (способ, длина); длина имеет смысл только для BODY_LENGTH.
+    """
+    if method == 'HEAD' or 100 <= status_code < 200 or status_code in (204, 304):
+        return BODY_NONE, 0
+    if headers.has_token('transfer-encoding', 'chunked'):
+        return BODY_CHUNKED, None
+    if 'content-length' in headers:
+        return BODY_LENGTH, _content_length(headers)
+    return BODY_UNTIL_CLOSE, None
+
+
+class LengthFramer:
+    """Отслеживает конец тела фиксированной длины"""
+
+    def __init__(self, length):
+        self.remaining = length
+
+    @property
+    def done(self):
+        return self.remaining == 0
+
+    def feed(self, data):
+        consumed = min(self.remaining, len(data))
+        self.remaining -= consumed
+        return consumed
+
+    def safe_read_size(self, limit):
+        """Сколько можно прочитать, не захватив байты следующего сообщения"""
+        return min(limit, self.remaining)
+
+
+class ChunkedFramer:
+    """Отслеживает границы тела в chunked-кодировке, не изменяя байты.
+
+    Байты тела пересылаются как есть, а feed() лишь сообщает, сколько из
+    переданных данных относится к текущему сообщению, и выставляет done,
+    когда прочитан последний фрагмент вместе с трейлером.
+    """
+
+    def __init__(self):
+        self.state = 'size'
+        self.line = bytearray()
+        self.remaining = 0
+        self.done = False
+
+    def safe_read_size(self, limit):
+        """Сколько можно прочитать, не захватив байты следующего сообщения.
+
+        Внутри данных фрагмента это его остаток, а для служебных строк
+        размер заранее неизвестен — тогда возвращается None (читать строку).
+        """
+        if self.state == 'data':
+            return min(limit, self.remaining)
+        return None
+
+    def feed(self, data):
+        """Обрабатывает очередную порцию данных, возвращает число байт сообщения"""
+        pos = 0
+        size = len(data)
+        while pos < size and not self.done:
+            if self.state == 'data':
+                step = min(self.remaining, size - pos)
+                self.remaining -= step
+                pos += step
+                if self.remaining == 0:
+                    self.state = 'data-end'
+                continue
+
+            window = bytes(data[pos:pos + MAX_LINE_SIZE])
+            newline = window.find(b'\n')
+            if newline == -1:
+                self.line += window
+                pos += len(window)
+                if len(self.line) > MAX_LINE_SIZE:
+                    raise HTTPParseError("Слишком длинная строка в chunked-теле")
+                continue
+            self.line += window[:newline]
+            pos += newline + 1
+            line = bytes(self.line).rstrip(b'\r')
+            self.line.clear()
+
+            if self.state == 'size':
+                try:
+                    chunk_size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HTTPParseError("Некорректный размер фрагмента")
+                if chunk_size == 0:
+                    self.state = 'trailer'
+                else:
+                    self.remaining = chunk_size
+                    self.state = 'data'
+            elif self.state == 'data-end':
+                if line:
+                    raise HTTPParseError("Нет CRLF после фрагмента")
+                self.state = 'size'
+            elif not line:
+                # Пустая строка завершает трейлер и все сообщение
+                self.done = True
+        return pos
+
+
+def body_framer(framing, length):
+    """Создает счетчик границ тела для BODY_NONE, BODY_LENGTH или BODY_CHUNKED"""
+    if framing == BODY_CHUNKED:
+        return ChunkedFramer()
+    if framing == BODY_LENGTH:
+        return LengthFramer(length)
+    if framing == BODY_NONE:
+        return LengthFramer(0)
+    raise ValueError(f"Тело {framing} нельзя разметить заранее")
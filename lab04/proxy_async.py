@@ -0,0 +1,380 @@
+import asyncio
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from dns_cache import open_connection_any
+from http_parser import BODY_UNTIL_CLOSE, HEAD_TERMINATOR, HTTPParseError, body_framer, \
+    is_interim_status, parse_request_head, parse_response_head, response_framing
+from proxy_pool import AsyncUpstreamPool
+from proxy_tunnel import async_tunnel
+from proxy_server import (
+    BUFFER_SIZE, CLIENT_IDLE_TIMEOUT, CONTINUE_RESPONSE, MAX_HEADER_SIZE, TIMEOUT,
+    TUNNEL_IDLE_TIMEOUT, UPSTREAM_IDLE_TIMEOUT, UPSTREAM_MAX_AGE, UPSTREAM_MAX_IDLE_PER_HOST,
+    ClientRequest, build_client_head, build_interim_head, build_upstream_request, cached_response,
+    error_response, log_request, metrics, resolver, response_cache, wants_keep_alive,
+)
+
+# Пул соединений создается при запуске цикла событий
+upstream_pool = None
+
+
+def raise_open_files_limit():
+    """Поднимает мягкий лимит открытых файлов до жесткого.
+
+    Каждое соединение клиента и сервера — это дескриптор, и стандартных
+    1024 не хватает на десятки тысяч одновременных клиентов.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def read_with_timeout(reader, size, timeout=TIMEOUT):
+    """Читает до size байт; при тайм-ауте возвращает b'' как при закрытии"""
+    try:
+        return await asyncio.wait_for(reader.read(size), timeout)
+    except asyncio.TimeoutError:
+        return b''
+
+
+async def relay(reader, writer, tee=None):
+    """Пересылает данные из reader в writer, пока источник не закроется.
+
+    После каждой записи ждет drain(), поэтому медленный получатель
+    притормаживает чтение у отправителя. Возвращает число байт.
+    """
+    total = 0
+    while True:
+        data = await read_with_timeout(reader, BUFFER_SIZE)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+        if tee is not None:
+            tee(data)
+        total += len(data)
+    return total
+
+
+async def relay_message(reader, writer, framer, tee=None):
+    """Пересылает тело сообщения до его конца, который определяет framer.
+
+    Читает не больше, чем осталось от текущего фрагмента, а служебные
+    строки chunked-кодировки — построчно, поэтому байты следующего
+    сообщения остаются в reader.
+    """
+    while not framer.done:
+        size = framer.safe_read_size(BUFFER_SIZE)
+        if size is None:
+            try:
+                data = await asyncio.wait_for(reader.readline(), TIMEOUT)
+            except (asyncio.TimeoutError, ValueError):
+                break
+        else:
+            data = await read_with_timeout(reader, size)
+        if not data:
+            break
+        consumed = framer.feed(data)
+        writer.write(data[:consumed])
+        await writer.drain()
+        if tee is not None:
+            tee(data[:consumed])
+
+
+async def relay_response_body(upstream_reader, client_writer, framing, length, tee):
+    """Пересылает тело ответа клиенту, соблюдая его границы.
+
+    Возвращает (тело получено полностью, соединение можно переиспользовать).
+    """
+    if framing == BODY_UNTIL_CLOSE:
+        # Длина не указана: тело заканчивается закрытием соединения
+        await relay(upstream_reader, client_writer, tee=tee)
+        return True, False
+
+    framer = body_framer(framing, length)
+    await relay_message(upstream_reader, client_writer, framer, tee)
+    return framer.done, framer.done
+
+
+async def read_head(reader, timeout):
+    """Читает заголовки сообщения вместе с завершающей пустой строкой"""
+    try:
+        return await asyncio.wait_for(reader.readuntil(HEAD_TERMINATOR), timeout)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError:
+        raise HTTPParseError("Слишком большие заголовки")
+
+
+async def read_client_request(reader):
+    """Читает и разбирает заголовки очередного запроса клиента.
+
+    Возвращает ClientRequest или None, если клиент закрыл соединение
+    или замолчал, не начав нового запроса.
+    """
+    try:
+        request_data = await read_head(reader, CLIENT_IDLE_TIMEOUT)
+    except (asyncio.TimeoutError, ConnectionError):
+        return None
+    if not request_data.endswith(HEAD_TERMINATOR):
+        if request_data.strip():
+            raise HTTPParseError("Соединение закрыто посреди заголовков")
+        return None
+    request = ClientRequest(parse_request_head(request_data[:-len(HEAD_TERMINATOR)]))
+    # Время запроса отсчитываем с момента получения заголовков
+    metrics.start_request(len(request_data))
+    return request
+
+
+async def open_tunnel(reader, writer, client_addr, request):
+    """Открывает туннель CONNECT и пересылает байты в обе стороны"""
+    try:
+        started = time.monotonic()
+        addresses = await asyncio.wait_for(
+            resolver.resolve_async(request.target_host, request.target_port), TIMEOUT)
+        async with upstream_pool.connect_slots:
+            server_reader, server_writer = await open_connection_any(addresses, TIMEOUT)
+        metrics.upstream_connected(time.monotonic() - started)
+    except (OSError, asyncio.TimeoutError) as e:
+        error_message = f"Error connecting to {request.url}: {e!r}"
+        writer.write(error_response("502 Bad Gateway", error_message))
+        log_request(client_addr, request.method, request.url, 502)
+        return
+
+    try:
+        writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        sent, received = await async_tunnel(reader, writer, server_reader, server_writer,
+                                            TUNNEL_IDLE_TIMEOUT)
+    finally:
+        server_writer.close()
+    timing = metrics.current_request()
+    if timing is not None:
+        timing.received += sent
+        timing.sent += received
+    log_request(client_addr, request.method, request.url, 200,
+                extra=f"Tunnel: sent={sent} received={received}")
+
+
+async def handle_request(reader, writer, client_addr):
+    """Обрабатывает один запрос клиента; возвращает, продолжать ли соединение"""
+    try:
+        request = await read_client_request(reader)
+    except HTTPParseError as e:
+        writer.write(error_response("400 Bad Request", str(e)))
+        log_request(client_addr, "Unknown", "Unknown", 400)
+        return False
+    if request is None:
+        return False
+    timing = metrics.current_request()
+    method = request.method
+    url = request.url
+
+    # Если хост не найден, нельзя продолжить
+    if not request.target_host:
+        writer.write(error_response("400 Bad Request", "Missing Host information"))
+        log_request(client_addr, method, "Unknown", 400)
+        return False
+
+    if method == 'CONNECT':
+        await open_tunnel(reader, writer, client_addr, request)
+        return False
+
+    # Проверяем кеш: свежая копия отдается без обращения к серверу
+    cache_entry = None
+    cache_status = None
+    if method == 'GET':
+        cache_entry, fresh = response_cache.lookup(url, request.headers)
+        if fresh:
+            response_cache.record('HIT')
+            status_code, response = cached_response(cache_entry, request)
+            timing.count_sent(response)
+            writer.write(response)
+            await writer.drain()
+            log_request(client_addr, method, url, status_code, 'HIT')
+            return request.keep_alive
+        cache_status = 'MISS'
+
+    new_request, revalidating = build_upstream_request(request, cache_entry)
+    target_host, target_port = request.target_host, request.target_port
+
+    upstream = None
+    response_started = False
+    status_code = "Unknown"
+    try:
+        # Сервер мог закрыть простаивавшее соединение из пула; тогда
+        # повторяем запрос на новом, если тело еще не начали читать
+        body_in_memory = request.framer.done
+        for attempt in range(2):
+            connect_started = time.monotonic()
+            upstream, reused = await upstream_pool.acquire(target_host, target_port)
+            if not reused:
+                metrics.upstream_connected(time.monotonic() - connect_started)
+            retry = reused and body_in_memory
+            try:
+                upstream.writer.write(new_request)
+                if not request.framer.done:
+                    if request.answer_continue:
+                        timing.count_sent(CONTINUE_RESPONSE)
+                        writer.write(CONTINUE_RESPONSE)
+                    await relay_message(reader, upstream.writer, request.framer,
+                                        timing.count_received)
+                    if not request.framer.done:
+                        raise ConnectionError("Клиент не передал тело запроса целиком")
+                await upstream.writer.drain()
+                response_data = await read_head(upstream.reader, TIMEOUT)
+            except ConnectionError:
+                if not retry:
+                    raise
+                response_data = b''
+            if response_data or not retry:
+                break
+            upstream.close()
+            upstream = None
+
+        response_head = None
+        while response_data.endswith(HEAD_TERMINATOR):
+            response_head = parse_response_head(response_data[:-len(HEAD_TERMINATOR)])
+            if not is_interim_status(response_head.status):
+                break
+            # Промежуточный ответ 1xx пересылаем клиенту и ждем окончательный
+            if request.accepts_interim:
+                interim_head = build_interim_head(response_head)
+                timing.count_sent(interim_head)
+                writer.write(interim_head)
+                await writer.drain()
+            response_head = None
+            response_data = await read_head(upstream.reader, TIMEOUT)
+        if response_head is None:
+            # Сервер не прислал корректных заголовков: отдаем что есть
+            timing.count_sent(response_data)
+            writer.write(response_data)
+            log_request(client_addr, method, url, status_code)
+            return False
+
+        status_code = str(response_head.status)
+        framing, length = response_framing(method, response_head.status, response_head.headers)
+        upstream_keep_alive = wants_keep_alive(response_head.version, response_head.headers)
+
+        if revalidating and response_head.status == 304:
+            # Копия в кеше не изменилась: обновляем ее срок и отдаем клиенту
+            if upstream_keep_alive:
+                upstream_pool.release(upstream)
+                upstream = None
+            cache_entry = response_cache.revalidated(url, cache_entry, response_head.headers)
+            response_cache.record('REVALIDATED')
+            response = cache_entry.to_response(request.keep_alive)
+            timing.count_sent(response)
+            writer.write(response)
+            await writer.drain()
+            log_request(client_addr, method, url, cache_entry.status_code, 'REVALIDATED')
+            return request.keep_alive
+
+        # Копим тело для кеша, пока оно укладывается в предел записи
+        cache_body = bytearray() if cache_status else None
+
+        def tee(data):
+            nonlocal cache_body
+            timing.count_sent(data)
+            if cache_body is not None:
+                if len(cache_body) + len(data) > response_cache.max_entry_size:
+                    cache_body = None
+                else:
+                    cache_body += data
+
+        # Клиенту можно сохранить соединение, только если известна длина ответа
+        keep_alive = request.keep_alive and framing != BODY_UNTIL_CLOSE
+
+        response_started = True
+        client_head = build_client_head(response_head, keep_alive)
+        timing.count_sent(client_head)
+        writer.write(client_head)
+        complete, reusable = await relay_response_body(
+            upstream.reader, writer, framing, length, tee)
+
+        if reusable and upstream_keep_alive:
+            upstream_pool.release(upstream)
+            upstream = None
+
+        if complete and cache_body is not None:
+            response_cache.store(url, request.headers, response_head.status,
+                                 response_head.status_line, response_head.headers,
+                                 bytes(cache_body))
+        if cache_status:
+            response_cache.record(cache_status)
+
+        log_request(client_addr, method, url, status_code, cache_status)
+        return keep_alive and complete
+
+    except (OSError, asyncio.TimeoutError, HTTPParseError) as e:
+        if response_started:
+            # Часть ответа уже ушла клиенту, сообщить об ошибке нельзя
+            log_request(client_addr, method, url, f"{status_code} (aborted: {e!r})")
+            return False
+
+        error_message = f"Error connecting to {target_host}:{target_port}: {e!r}"
+        writer.write(error_response("502 Bad Gateway", error_message))
+        log_request(client_addr, method, url, 502)
+        return False
+
+    finally:
+        if upstream is not None:
+            upstream.close()
+
+
+async def handle_connection(reader, writer):
+    """Обслуживает соединение клиента, пока оно остается keep-alive"""
+    peer = writer.get_extra_info('peername') or ('unknown', 0)
+    client_addr = f"{peer[0]}:{peer[1]}"
+    metrics.connection_opened()
+    try:
+        keep_alive = True
+        while keep_alive:
+            keep_alive = await handle_request(reader, writer, client_addr)
+        await writer.drain()
+    except Exception as e:
+        # Обработка любых других ошибок
+        try:
+            writer.write(error_response("500 Internal Server Error", f"Proxy error: {str(e)}"))
+            log_request(client_addr, "Unknown", "Unknown", 500)
+        except Exception:
+            pass
+    finally:
+        writer.close()
+        metrics.connection_closed()
+
+
+async def serve(host, port, backlog, max_upstream_connects):
+    global upstream_pool
+    upstream_pool = AsyncUpstreamPool(UPSTREAM_MAX_IDLE_PER_HOST, UPSTREAM_IDLE_TIMEOUT,
+                                      UPSTREAM_MAX_AGE, TIMEOUT, max_upstream_connects,
+                                      resolver)
+    server = await asyncio.start_server(
+        handle_connection, host, port,
+        backlog=backlog, limit=MAX_HEADER_SIZE, reuse_address=True,
+    )
+    print(f"Прокси-сервер (asyncio) запущен на {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_proxy(host, port, backlog=4096, max_upstream_connects=256):
+    """Запускает прокси-сервер на одном цикле событий asyncio.
+
+    Вместо потока на каждое соединение все клиенты обслуживаются
+    корутинами, поэтому десятки тысяч соединений не требуют ни памяти
+    под стеки потоков, ни переключений контекста.
+    """
+    raise_open_files_limit()
+    try:
+        asyncio.run(serve(host, port, backlog, max_upstream_connects))
+    except KeyboardInterrupt:
+        print("\nЗавершение работы прокси-сервера...")
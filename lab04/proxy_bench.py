@@ -0,0 +1,469 @@
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_HOST = '127.0.0.1'
+ORIGIN_PORT = 9180  # порт тестового сервера-источника
+PROXY_PORT = 9181  # порт запускаемого прокси
+PROXY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'proxy_server.py')
+PROXY_START_TIMEOUT = 10  # сколько ждать, пока прокси начнет принимать соединения
+REQUEST_TIMEOUT = 30
+READ_CHUNK = 64 * 1024
+
+# Виды запросов к источнику
+KINDS = ('fixed', 'cached', 'large', 'slow')
+DEFAULT_MIX = 'fixed=60,cached=20,large=10,slow=10'
+DEFAULT_CONFIGS = 'threads,asyncio'
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """Сервер-источник для нагрузочного теста.
+
+    /fixed/<n>       — n байт, кешировать нельзя
+    /cached/<n>      — n байт, кешировать можно на минуту
+    /large/<n>       — n байт, отдаются потоком по частям
+    /slow/<мс>/<n>   — n байт после задержки в указанное число миллисекунд
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными write: без TCP_NODELAY алгоритм Нейгла
+    # вместе с отложенным ACK клиента добавляет ~40 мс к каждому ответу keep-alive
+    disable_nagle_algorithm = True
+    payload = b'x' * READ_CHUNK
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        try:
+            kind = parts[0]
+            size = int(parts[-1])
+            if kind == 'slow':
+                time.sleep(int(parts[1]) / 1000)
+        except (IndexError, ValueError):
+            self.send_error(404)
+            return
+        if kind not in KINDS:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        if kind == 'cached':
+            self.send_header('Cache-Control', 'max-age=60')
+        else:
+            self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+
+        remaining = size
+        while remaining > 0:
+            chunk = self.payload[:min(remaining, READ_CHUNK)]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_origin(host, port, ready):
+    """Запускает сервер-источник; выполняется в отдельном процессе"""
+    server = ThreadingHTTPServer((host, port), OriginHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    ready.set()
+    server.serve_forever()
+
+
+def parse_mix(text):
+    """Разбирает смесь запросов вида 'fixed=60,large=10' в список (вид, вес)"""
+    mix = []
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"неизвестный вид запроса: {kind!r}")
+        try:
+            mix.append((kind, float(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"некорректный вес: {item!r}")
+    return mix
+
+
+def parse_size(text):
+    """Разбирает размер вида 512, 64K, 10M или 1G"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper()
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"некорректный размер: {text!r}")
+
+
+def parse_config(text):
+    """Разбирает конфигурацию прокси вида 'threads+no-cache+no-pool'"""
+    mode, *flags = text.strip().split('+')
+    if mode not in ('threads', 'asyncio'):
+        raise argparse.ArgumentTypeError(f"неизвестный режим прокси: {mode!r}")
+    for flag in flags:
+        if flag not in ('no-cache', 'no-pool'):
+            raise argparse.ArgumentTypeError(f"неизвестный флаг конфигурации: {flag!r}")
+    return {'name': text.strip(), 'mode': mode, 'flags': flags}
+
+
+def request_path(kind, args):
+    if kind == 'fixed':
+        return f"/fixed/{args.fixed_size}"
+    if kind == 'cached':
+        return f"/cached/{args.fixed_size}"
+    if kind == 'large':
+        return f"/large/{args.large_size}"
+    return f"/slow/{args.slow_delay}/{args.fixed_size}"
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    """Сводка задержек в миллисекундах"""
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def read_peak_rss(pid):
+    """Пиковый размер резидентной памяти процесса в байтах (только Linux)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_cpu_seconds(pid):
+    """Процессорное время процесса (user + system) в секундах (только Linux)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(PROXY_SCRIPT),
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Worker:
+    """Клиент нагрузки: шлет запросы через прокси одно за другим"""
+
+    def __init__(self, index, args, deadline, measure_from):
+        self.args = args
+        self.random = random.Random(args.seed + index)
+        self.kinds = [kind for kind, _ in args.mix]
+        self.weights = [weight for _, weight in args.mix]
+        self.deadline = deadline
+        self.measure_from = measure_from
+        self.results = []  # (вид, задержка, время до первого байта, байт, статус)
+        self.errors = 0
+        self.connection = None
+
+    def connect(self):
+        self.connection = http.client.HTTPConnection(
+            BENCH_HOST, self.args.proxy_port, timeout=REQUEST_TIMEOUT)
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            url = f"http://{BENCH_HOST}:{self.args.origin_port}{request_path(kind, self.args)}"
+            headers = {} if self.args.keep_alive else {'Connection': 'close'}
+            started = time.monotonic()
+            try:
+                if self.connection is None:
+                    self.connect()
+                self.connection.request('GET', url, headers=headers)
+                response = self.connection.getresponse()
+                first_byte = time.monotonic() - started
+                received = 0
+                while True:
+                    chunk = response.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                status = response.status
+                if response.will_close:
+                    self.connection.close()
+                    self.connection = None
+            except (OSError, http.client.HTTPException):
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                if started >= self.measure_from:
+                    self.errors += 1
+                continue
+            if started >= self.measure_from:
+                self.results.append((kind, time.monotonic() - started, first_byte,
+                                     received, status))
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_workers(args, first_index, count, deadline, measure_from, results):
+    """Запускает count клиентов в потоках одного процесса и отдает их итоги в results"""
+    workers = [Worker(first_index + index, args, deadline, measure_from)
+               for index in range(count)]
+    threads = [threading.Thread(target=worker.run, daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({
+        'results': [result for worker in workers for result in worker.results],
+        'errors': sum(worker.errors for worker in workers),
+    })
+
+
+def start_origin(args):
+    """Запускает сервер-источник в отдельном процессе и ждет, пока он начнет принимать"""
+    ready = multiprocessing.Event()
+    origin = multiprocessing.Process(target=run_origin,
+                                     args=(BENCH_HOST, args.origin_port, ready), daemon=True)
+    origin.start()
+    # Без источника прокси отвечал бы одними 502 — такой замер ничего не значит
+    if not ready.wait(PROXY_START_TIMEOUT) \
+            or not wait_for_port(BENCH_HOST, args.origin_port, PROXY_START_TIMEOUT):
+        origin.terminate()
+        origin.join()
+        raise RuntimeError(f"сервер-источник на порту {args.origin_port} не запустился")
+    return origin
+
+
+def start_proxy(config, args):
+    command = [sys.executable, PROXY_SCRIPT, '--host', BENCH_HOST,
+               '--port', str(args.proxy_port), '--mode', config['mode'], '--quiet']
+    command += [f"--{flag}" for flag in config['flags']]
+    # Журнал прокси пишется во временный каталог, а не рядом со скриптом
+    proxy = subprocess.Popen(command, cwd=args.workdir,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(BENCH_HOST, args.proxy_port, PROXY_START_TIMEOUT):
+        proxy.kill()
+        raise RuntimeError(f"прокси в режиме {config['name']} не запустился")
+    return proxy
+
+
+def run_config(config, args):
+    """Прогоняет нагрузку через прокси в одной конфигурации"""
+    proxy = start_proxy(config, args)
+    try:
+        cpu_before = read_cpu_seconds(proxy.pid)
+        measure_from = time.monotonic() + args.warmup
+        deadline = measure_from + args.duration
+
+        # Клиенты на Python упираются в GIL, поэтому нагрузку дают несколько процессов
+        results = multiprocessing.Queue()
+        processes = []
+        first_index = 0
+        for index in range(args.client_processes):
+            count = args.concurrency // args.client_processes \
+                + (index < args.concurrency % args.client_processes)
+            if count == 0:
+                continue
+            process = multiprocessing.Process(
+                target=run_workers,
+                args=(args, first_index, count, deadline, measure_from, results),
+                daemon=True)
+            process.start()
+            processes.append(process)
+            first_index += count
+        # Запрос, начатый перед самым концом замера, может длиться до REQUEST_TIMEOUT
+        wait_until = deadline + REQUEST_TIMEOUT + PROXY_START_TIMEOUT
+        reports = [results.get(timeout=max(0, wait_until - time.monotonic()))
+                   for _ in processes]
+        for process in processes:
+            process.join()
+        # Скорость считается по окну замера: запросы, которые клиенты
+        # дожидаются после его конца, не должны растягивать время
+        elapsed = deadline - measure_from
+        cpu_after = read_cpu_seconds(proxy.pid)
+        peak_rss = read_peak_rss(proxy.pid)
+    finally:
+        proxy.terminate()
+        try:
+            proxy.wait(5)
+        except subprocess.TimeoutExpired:
+            proxy.kill()
+            proxy.wait()
+
+    results = [result for report in reports for result in report['results']]
+    errors = sum(report['errors'] for report in reports)
+    total_bytes = sum(result[3] for result in results)
+    statuses = {}
+    for result in results:
+        statuses[str(result[4])] = statuses.get(str(result[4]), 0) + 1
+
+    by_kind = {}
+    for kind, _ in args.mix:
+        kind_results = [result for result in results if result[0] == kind]
+        by_kind[kind] = {
+            'latency': latency_summary([result[1] for result in kind_results]),
+            'ttfb': latency_summary([result[2] for result in kind_results]),
+        }
+
+    cpu_seconds = None
+    if cpu_before is not None and cpu_after is not None:
+        cpu_seconds = round(cpu_after - cpu_before, 3)
+
+    return {
+        'config': config['name'],
+        'mode': config['mode'],
+        'flags': config['flags'],
+        'duration_s': round(elapsed, 3),
+        'requests': len(results),
+        'errors': errors,
+        'statuses': statuses,
+        'requests_per_s': round(len(results) / elapsed, 2),
+        'bytes': total_bytes,
+        'bytes_per_s': round(total_bytes / elapsed, 2),
+        'latency': latency_summary([result[1] for result in results]),
+        'ttfb': latency_summary([result[2] for result in results]),
+        'by_kind': by_kind,
+        'proxy_peak_rss_bytes': peak_rss,
+        'proxy_cpu_s': cpu_seconds,
+    }
+
+
+def format_table(runs):
+    header = (f"{'config':<26} {'req/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'errors':>7} {'RSS MB':>7}")
+    lines = [header, '-' * len(header)]
+    for run in runs:
+        latency = run['latency']
+        rss = run['proxy_peak_rss_bytes']
+        lines.append(
+            f"{run['config']:<26} {run['requests_per_s']:>9.1f} "
+            f"{run['bytes_per_s'] / 1024 ** 2:>8.2f} "
+            f"{latency.get('p50_ms', 0):>8.2f} {latency.get('p95_ms', 0):>8.2f} "
+            f"{latency.get('p99_ms', 0):>8.2f} {run['errors']:>7} "
+            f"{(rss / 1024 ** 2 if rss else 0):>7.1f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест прокси-сервера")
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS,
+                        help="конфигурации прокси через запятую, например "
+                             "threads,asyncio,threads+no-cache,threads+no-pool")
+    parser.add_argument('--concurrency', type=int, default=32, help="число клиентов")
+    parser.add_argument('--client-processes', type=int,
+                        default=max(1, (os.cpu_count() or 2) // 2),
+                        help="число процессов, в которых работают клиенты")
+    parser.add_argument('--duration', type=float, default=10, help="длительность замера, с")
+    parser.add_argument('--warmup', type=float, default=1, help="прогрев перед замером, с")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"смесь запросов (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument('--fixed-size', type=parse_size, default=1024,
+                        help="размер ответов fixed, cached и slow")
+    parser.add_argument('--large-size', type=parse_size, default=parse_size('8M'),
+                        help="размер ответов large")
+    parser.add_argument('--slow-delay', type=int, default=200,
+                        help="задержка ответов slow, мс")
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help="новое соединение с прокси на каждый запрос")
+    parser.add_argument('--seed', type=int, default=1, help="зерно выбора запросов")
+    parser.add_argument('--origin-port', type=int, default=ORIGIN_PORT)
+    parser.add_argument('--proxy-port', type=int, default=PROXY_PORT)
+    parser.add_argument('--json', metavar='PATH',
+                        help="записать результаты в JSON ('-' — в stdout)")
+    args = parser.parse_args()
+    configs = [parse_config(name) for name in args.configs.split(',') if name.strip()]
+
+    origin = start_origin(args)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='proxy-bench-') as workdir:
+        args.workdir = workdir
+        try:
+            for config in configs:
+                print(f"Замер {config['name']}...", file=sys.stderr)
+                runs.append(run_config(config, args))
+        finally:
+            origin.terminate()
+            origin.join()
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'concurrency': args.concurrency,
+            'client_processes': args.client_processes,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'mix': dict(args.mix),
+            'fixed_size': args.fixed_size,
+            'large_size': args.large_size,
+            'slow_delay_ms': args.slow_delay,
+            'keep_alive': args.keep_alive,
+            'seed': args.seed,
+        },
+        'runs': runs,
+    }
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_table(runs))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
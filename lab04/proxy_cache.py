@@ -0,0 +1,290 @@
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from http_parser import Headers
+
+# Коды ответов, которые можно кешировать (RFC 9111, 4.2.2)
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+# Заголовки, относящиеся только к одному соединению, не хранятся в кеше
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate',
+    'proxy-authorization', 'te', 'trailer', 'upgrade',
+}
+
+# Заголовки полного ответа, которые повторяются в ответе 304 (RFC 9110, 15.4.5)
+NOT_MODIFIED_HEADERS = {
+    'cache-control', 'content-location', 'date', 'etag', 'expires', 'last-modified', 'vary',
+}
+
+# Доля от возраста Last-Modified для эвристической свежести и ее предел
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX = 24 * 60 * 60
+
+
+def parse_cache_control(value):
+    """Разбирает Cache-Control в словарь директив"""
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' in part:
+            name, arg = part.split('=', 1)
+            directives[name.strip().lower()] = arg.strip().strip('"')
+        else:
+            directives[part.lower()] = None
+    return directives
+
+
+def parse_http_date(value):
+    """Преобразует HTTP-дату в unix-время, None если дата некорректна"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def parse_seconds(value):
+    """Преобразует значение вида max-age в целое число секунд"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class CacheEntry:
+    def __init__(self, status_code, status_line, headers, body, vary):
+        self.status_code = status_code
+        self.status_line = status_line
+        self.body = body
+        self.vary = vary
+        self.size = len(body) + sum(len(name) + len(value) + 4 for name, value in headers)
+        self.update_freshness(headers)
+
+    def update_freshness(self, headers):
+        """Пересчитывает срок свежести по заголовкам ответа"""
+        self.headers = headers
+        self.stored_at = time.time()
+        self.etag = self.headers.get('etag')
+        self.last_modified = self.headers.get('last-modified')
+        self.initial_age = parse_seconds(self.headers.get('age')) or 0
+        self.lifetime = freshness_lifetime(self.status_code, self.headers)
+
+    def age(self):
+        return self.initial_age + max(0, time.time() - self.stored_at)
+
+    def is_fresh(self):
+        return self.age() < self.lifetime
+
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    def matches_conditional(self, request_headers):
+        """Проверяет If-None-Match или, если его нет, If-Modified-Since клиента.
+
+        True — копия не изменилась с версии клиента и можно ответить 304.
+        """
+        if self.status_code != 200:
+            return False
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            if not self.etag:
+                return False
+            # Для GET сравнение слабое: префикс W/ не учитывается
+            etag = self.etag.strip().removeprefix('W/')
+            return any(tag.strip().removeprefix('W/') == etag
+                       for tag in if_none_match.split(','))
+        since = parse_http_date(request_headers.get('if-modified-since'))
+        modified = parse_http_date(self.last_modified)
+        return since is not None and modified is not None and modified <= since
+
+    def merge_not_modified(self, updated):
+        """Новая запись с заголовками из ответа 304 Not Modified.
+
+        Саму запись не меняем: ее в это время могут отдавать другие потоки.
+        """
+        skip = HOP_BY_HOP_HEADERS | {'content-length', 'transfer-encoding'}
+        merged = Headers()
+        for name, value in self.headers:
+            if name.lower() in updated and name.lower() not in skip:
+                continue
+            merged.add(name, value)
+        for name, value in updated:
+            if name.lower() not in skip:
+                merged.add(name, value)
+        return CacheEntry(self.status_code, self.status_line, merged, self.body, self.vary)
+
+    def to_not_modified_response(self, keep_alive=False):
+        """Собирает ответ 304 без тела для клиента, у которого копия уже есть"""
+        lines = [f"{self.status_line.split(' ', 1)[0]} 304 Not Modified"]
+        for name, value in self.headers:
+            if name.lower() in NOT_MODIFIED_HEADERS:
+                lines.append(f"{name}: {value}")
+        lines.append(f"Age: {int(self.age())}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return '\r\n'.join(lines).encode('iso-8859-1') + b'\r\n\r\n'
+
+    def to_response(self, keep_alive=False):
+        """Собирает ответ клиенту из кешированной копии"""
+        lines = [self.status_line]
+        for name, value in self.headers:
+            if name.lower() in HOP_BY_HOP_HEADERS or name.lower() == 'age':
+                continue
+            lines.append(f"{name}: {value}")
+        if 'content-length' not in self.headers and \
+                not self.headers.has_token('transfer-encoding', 'chunked'):
+            # Длина копии известна, поэтому соединение можно не закрывать
+            lines.append(f"Content-Length: {len(self.body)}")
+        lines.append(f"Age: {int(self.age())}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return '\r\n'.join(lines).encode('iso-8859-1') + b'\r\n\r\n' + self.body
+
+
+def freshness_lifetime(status_code, headers):
+    """Вычисляет время свежести ответа в секундах (RFC 9111, 4.2.1)"""
+    cache_control = parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in cache_control:
+        return 0
+    for directive in ('s-maxage', 'max-age'):
+        if directive in cache_control:
+            seconds = parse_seconds(cache_control[directive])
+            if seconds is not None:
+                return seconds
+    if 'expires' in headers:
+        expires = parse_http_date(headers.get('expires'))
+        if expires is None:
+            return 0
+        date = parse_http_date(headers.get('date')) or time.time()
+        return max(0, expires - date)
+    last_modified = parse_http_date(headers.get('last-modified'))
+    if status_code == 200 and last_modified is not None:
+        date = parse_http_date(headers.get('date')) or time.time()
+        return min(HEURISTIC_MAX, max(0, (date - last_modified) * HEURISTIC_FRACTION))
+    return 0
+
+
+def is_complete_body(headers, body):
+    """Проверяет, что тело ответа получено полностью"""
+    if 'content-length' in headers:
+        return parse_seconds(headers.get('content-length')) == len(body)
+    if headers.has_token('transfer-encoding', 'chunked'):
+        return body.endswith(b'\r\n\r\n')
+    return True
+
+
+class ResponseCache:
+    """Общий для всех потоков кеш ответов в памяти с вытеснением LRU"""
+
+    def __init__(self, max_bytes, max_entry_size):
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def lookup(self, key, request_headers):
+        """Ищет запись для запроса; возвращает (entry, fresh)"""
+        request_cc = parse_cache_control(request_headers.get('cache-control'))
+        if 'no-store' in request_cc:
+            return None, False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            for name, value in entry.vary.items():
+                if request_headers.get(name) != value:
+                    return None, False
+            self.entries.move_to_end(key)
+        force_revalidate = (
+            'no-cache' in request_cc
+            or request_cc.get('max-age') == '0'
+            or 'no-cache' in request_headers.get('pragma', '').lower()
+        )
+        return entry, entry.is_fresh() and not force_revalidate
+
+    def store(self, key, request_headers, status_code, status_line, headers, body):
+        """Сохраняет ответ, если он кешируемый; возвращает True при сохранении"""
+        if status_code not in CACHEABLE_STATUSES:
+            return False
+        request_cc = parse_cache_control(request_headers.get('cache-control'))
+        response_cc = parse_cache_control(headers.get('cache-control'))
+        if 'no-store' in request_cc or 'no-store' in response_cc or 'private' in response_cc:
+            return False
+        if 'authorization' in request_headers and 'public' not in response_cc \
+                and 's-maxage' not in response_cc:
+            return False
+        if 'set-cookie' in headers or not is_complete_body(headers, body):
+            return False
+
+        vary = {}
+        for name in headers.get('vary', '').split(','):
+            name = name.strip().lower()
+            if not name:
+                continue
+            if name == '*':
+                return False
+            vary[name] = request_headers.get(name)
+
+        entry = CacheEntry(status_code, status_line, headers, body, vary)
+        if entry.size > self.max_entry_size:
+            return False
+        if entry.lifetime <= 0 and not entry.has_validators():
+            return False
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.size
+            self.entries[key] = entry
+            self.total_bytes += entry.size
+            self._evict()
+        return True
+
+    def revalidated(self, key, entry, headers):
+        """Заменяет запись обновленной по ответу 304; возвращает новую запись"""
+        updated = entry.merge_not_modified(headers)
+        with self.lock:
+            # Если запись успели заменить или вытеснить, новую не сохраняем
+            if self.entries.get(key) is entry:
+                self.entries[key] = updated
+                self.total_bytes += updated.size - entry.size
+                self._evict()
+        return updated
+
+    def _evict(self):
+        """Вытесняет старые записи сверх max_bytes; вызывается под self.lock"""
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def record(self, outcome):
+        """Учитывает исход обращения к кешу: HIT, MISS или REVALIDATED"""
+        with self.lock:
+            if outcome == 'HIT':
+                self.hits += 1
+            elif outcome == 'REVALIDATED':
+                self.hits += 1
+                self.revalidations += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Строка со счетчиками кеша для журнала"""
+        with self.lock:
+            return (f"hits={self.hits} misses={self.misses} "
+                    f"revalidated={self.revalidations} evictions={self.evictions} "
+                    f"entries={len(self.entries)} bytes={self.total_bytes}")
@@ -0,0 +1,120 @@
+import atexit
+import datetime
+import os
+import queue
+import sys
+import threading
+
+# Что делать с записью, если очередь журнала заполнена
+POLICY_DROP = 'drop'  # отбросить запись и учесть это в счетчике
+POLICY_BLOCK = 'block'  # подождать, пока фоновый поток разгребет очередь
+
+_STOP = object()
+
+
+class AccessLog:
+    """Журнал запросов с фоновой записью пачками.
+
+    Рабочие потоки только кладут готовую строку в очередь, а единственный
+    фоновый поток забирает все накопившиеся записи, пишет их одним вызовом
+    в заранее открытый буферизованный файл и при необходимости дублирует
+    в консоль. Файл ротируется при достижении max_bytes.
+    """
+
+    def __init__(self, path, max_bytes, backup_count, queue_size, batch_size,
+                 policy=POLICY_DROP, echo=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.policy = policy
+        self.echo = echo
+        self.queue = queue.Queue(queue_size)
+        self.file = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.dropped = 0
+        self.reported_dropped = 0
+
+    def start(self):
+        """Запускает фоновый поток записи, если он еще не запущен"""
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.file = open(self.path, 'a', buffering=64 * 1024, encoding='utf-8')
+            self.thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def write(self, line):
+        """Ставит строку журнала в очередь на запись"""
+        if self.thread is None:
+            self.start()
+        if self.policy == POLICY_BLOCK:
+            self.queue.put(line)
+            return
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            # Счетчик неточен при гонках, зато не требует блокировки
+            self.dropped += 1
+
+    def close(self):
+        """Дописывает очередь на диск и останавливает фоновый поток"""
+        with self.start_lock:
+            thread = self.thread
+            self.thread = None
+        if thread is None:
+            return
+        self.queue.put(_STOP)
+        thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                batch = [line for line in batch if line is not _STOP]
+                running = False
+
+            if self.dropped != self.reported_dropped:
+                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                batch.append(f"[{timestamp}] access log queue full, "
+                             f"{self.dropped - self.reported_dropped} records dropped")
+                self.reported_dropped = self.dropped
+
+            if batch:
+                self._write_batch(batch)
+        self.file.close()
+
+    def _write_batch(self, batch):
+        text = '\n'.join(batch) + '\n'
+        try:
+            self.file.write(text)
+            self.file.flush()
+            if self.echo:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            if self.max_bytes and self.file.tell() >= self.max_bytes:
+                self._rotate()
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"access log write failed: {e}\n")
+
+    def _rotate(self):
+        """Переименовывает proxy.log в proxy.log.1, proxy.log.1 в proxy.log.2 и т.д."""
+        self.file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            mode = 'a'
+        else:
+            mode = 'w'
+        self.file = open(self.path, mode, buffering=64 * 1024, encoding='utf-8')
@@ -0,0 +1,262 @@
+import bisect
+import contextvars
+import sys
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Запрос, который обслуживается в текущем потоке или задаче asyncio
+_current_request = contextvars.ContextVar('proxy_request', default=None)
+
+
+class RequestTiming:
+    """Время и объем трафика одного запроса клиента"""
+
+    __slots__ = ('started', 'first_byte_at', 'received', 'sent')
+
+    def __init__(self, received):
+        self.started = time.monotonic()
+        self.first_byte_at = None
+        self.received = received
+        self.sent = 0
+
+    def count_received(self, data):
+        """Учитывает часть тела запроса; подходит как tee для relay_message"""
+        self.received += len(data)
+
+    def count_sent(self, data):
+        """Учитывает данные, отправленные клиенту; первый вызов отмечает TTFB"""
+        if self.first_byte_at is None:
+            self.first_byte_at = time.monotonic()
+        self.sent += len(data)
+
+
+def new_histogram():
+    # Счетчики по корзинам (последняя — +Inf) и сумма наблюдений
+    return [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+
+
+def observe(histogram, value):
+    histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+class MetricsShard:
+    """Счетчики одного потока.
+
+    Их обновляет только поток-владелец, поэтому блокировки не нужны;
+    при чтении метрик счетчики всех потоков складываются.
+    """
+
+    def __init__(self):
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.received = 0
+        self.sent = 0
+        self.requests = {}  # код состояния -> число запросов
+        self.ttfb = {}  # код состояния -> гистограмма
+        self.duration = {}
+        self.upstream_connect = new_histogram()
+
+    def merge(self, other):
+        self.connections_opened += other.connections_opened
+        self.connections_closed += other.connections_closed
+        self.received += other.received
+        self.sent += other.sent
+        for status, count in list(other.requests.items()):
+            self.requests[status] = self.requests.get(status, 0) + count
+        for mine, theirs in ((self.ttfb, other.ttfb), (self.duration, other.duration)):
+            for status, histogram in list(theirs.items()):
+                merged = mine.setdefault(status, new_histogram())
+                for index, value in enumerate(histogram):
+                    merged[index] += value
+        for index, value in enumerate(other.upstream_connect):
+            self.upstream_connect[index] += value
+
+
+class _ShardHandle:
+    """Ссылка на счетчики из локального хранилища потока.
+
+    Когда поток завершается, ручка удаляется, и его счетчики переносятся
+    в общий итог завершенных потоков.
+    """
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class ProxyMetrics:
+    """Метрики прокси-сервера в формате Prometheus.
+
+    На горячем пути выполняется лишь несколько прибавлений к счетчикам
+    своего потока, без блокировок. Блокировка нужна только при создании
+    и завершении потока и при чтении метрик.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.live = weakref.WeakSet()
+        self.retired = MetricsShard()
+
+    def shard(self):
+        try:
+            return self.local.handle.shard
+        except AttributeError:
+            shard = MetricsShard()
+            handle = _ShardHandle(shard)
+            self.local.handle = handle
+            weakref.finalize(handle, self._retire, shard)
+            with self.lock:
+                self.live.add(handle)
+            return shard
+
+    def _retire(self, shard):
+        with self.lock:
+            self.retired.merge(shard)
+
+    def connection_opened(self):
+        self.shard().connections_opened += 1
+
+    def connection_closed(self):
+        self.shard().connections_closed += 1
+
+    def upstream_connected(self, seconds):
+        """Учитывает время установки нового соединения с сервером"""
+        observe(self.shard().upstream_connect, seconds)
+
+    def start_request(self, received):
+        """Начинает отсчет времени запроса, заголовки которого уже получены"""
+        timing = RequestTiming(received)
+        _current_request.set(timing)
+        return timing
+
+    def current_request(self):
+        return _current_request.get()
+
+    def finish_request(self, method, status_code):
+        """Учитывает завершенный запрос; вызывается при записи в журнал"""
+        timing = _current_request.get()
+        _current_request.set(None)
+        shard = self.shard()
+        status = str(status_code).split()[0]
+        shard.requests[status] = shard.requests.get(status, 0) + 1
+        if timing is None:
+            return
+        shard.received += timing.received
+        shard.sent += timing.sent
+        # Туннель живет сколько угодно долго, в гистограммы задержек он не попадает
+        if method == 'CONNECT':
+            return
+        now = time.monotonic()
+        duration = shard.duration.get(status)
+        if duration is None:
+            duration = shard.duration[status] = new_histogram()
+        observe(duration, now - timing.started)
+        if timing.first_byte_at is not None:
+            ttfb = shard.ttfb.get(status)
+            if ttfb is None:
+                ttfb = shard.ttfb[status] = new_histogram()
+            observe(ttfb, timing.first_byte_at - timing.started)
+
+    def snapshot(self):
+        """Складывает счетчики всех потоков"""
+        total = MetricsShard()
+        with self.lock:
+            total.merge(self.retired)
+            handles = list(self.live)
+        for handle in handles:
+            total.merge(handle.shard)
+        return total
+
+    def render(self):
+        """Формирует текст метрик в формате Prometheus"""
+        # Скорость запросов здесь не считаем: чтение метрик не должно менять
+        # их значения. Ее дает rate(proxy_requests_total[...]) в Prometheus
+        total = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric('proxy_active_connections', 'gauge', "Открытые соединения клиентов",
+               [('', total.connections_opened - total.connections_closed)])
+        metric('proxy_connections_total', 'counter', "Принятые соединения клиентов",
+               [('', total.connections_opened)])
+        metric('proxy_requests_total', 'counter', "Обработанные запросы по коду состояния",
+               [(f'{{status="{status}"}}', count)
+                for status, count in sorted(total.requests.items())])
+        metric('proxy_received_bytes_total', 'counter', "Байт получено от клиентов",
+               [('', total.received)])
+        metric('proxy_sent_bytes_total', 'counter', "Байт отправлено клиентам",
+               [('', total.sent)])
+        render_histogram(lines, 'proxy_upstream_connect_seconds',
+                         "Время установки соединения с сервером",
+                         {'': total.upstream_connect})
+        render_histogram(lines, 'proxy_ttfb_seconds',
+                         "Время до первого байта ответа клиенту по коду состояния",
+                         total.ttfb)
+        render_histogram(lines, 'proxy_request_duration_seconds',
+                         "Полное время обработки запроса по коду состояния",
+                         total.duration)
+        return '\n'.join(lines) + '\n'
+
+
+def render_histogram(lines, name, help_text, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for status, histogram in sorted(histograms.items()):
+        label = f'status="{status}",' if status else ''
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label}le="{bound}"}} {cumulative}')
+        suffix = f'{{{label.rstrip(",")}}}' if label else ''
+        lines.append(f"{name}_sum{suffix} {histogram[-1]:.6f}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики по адресу /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_admin_server(metrics, host, port):
+    """Запускает служебный HTTP-сервер метрик в фоновом потоке.
+
+    Возвращает сервер или None, если порт занят: без метрик прокси
+    продолжает работать.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Сервер метрик не запущен на {host}:{port}: {e}", file=sys.stderr)
+        return None
+    server.daemon_threads = True
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    print(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
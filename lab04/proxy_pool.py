@@ -0,0 +1,190 @@
+import asyncio
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from dns_cache import open_connection_any
+
+
+class UpstreamConnection:
+    def __init__(self, sock, host, port):
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def is_connection_alive(sock):
+    """Проверяет простаивающее соединение перед повторным использованием.
+
+    Сервер не должен ничего присылать между ответами, поэтому готовность
+    сокета к чтению означает либо закрытие соединения, либо мусор в нем.
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class UpstreamPool:
+    """Пул простаивающих keep-alive соединений с серверами по (host, port)"""
+
+    def __init__(self, max_idle_per_host, idle_timeout, max_age, connect_timeout, resolver):
+        self.resolver = resolver
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.connect_timeout = connect_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.created = 0
+        self.discarded = 0
+
+    def acquire(self, host, port):
+        """Возвращает (соединение, было_ли_оно_в_пуле).
+
+        Из пула берутся самые свежие соединения; просроченные и закрытые
+        сервером отбрасываются, если подходящих нет — открывается новое.
+        """
+        key = (host, port)
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                conn = connections.pop() if connections else None
+            if conn is None:
+                break
+            now = time.monotonic()
+            if (now - conn.last_used > self.idle_timeout
+                    or now - conn.created_at > self.max_age
+                    or not is_connection_alive(conn.sock)):
+                self._discard(conn)
+                continue
+            with self.lock:
+                self.reused += 1
+            return conn, True
+
+        sock = self.resolver.connect(host, port, self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.created += 1
+        return UpstreamConnection(sock, host, port), False
+
+    def release(self, conn):
+        """Возвращает соединение в пул после полностью прочитанного ответа"""
+        conn.requests += 1
+        conn.last_used = time.monotonic()
+        if conn.last_used - conn.created_at > self.max_age:
+            self._discard(conn)
+            return
+        key = (conn.host, conn.port)
+        evicted = None
+        with self.lock:
+            connections = self.idle.setdefault(key, deque())
+            connections.append(conn)
+            if len(connections) > self.max_idle_per_host:
+                evicted = connections.popleft()
+        if evicted is not None:
+            self._discard(evicted)
+
+    def _discard(self, conn):
+        with self.lock:
+            self.discarded += 1
+        conn.close()
+
+    def close_all(self):
+        with self.lock:
+            connections = [conn for queue in self.idle.values() for conn in queue]
+            self.idle.clear()
+        for conn in connections:
+            conn.close()
+
+
+class AsyncUpstreamConnection:
+    def __init__(self, reader, writer, host, port):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+        self.port = port
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0
+
+    def is_alive(self):
+        return not (self.reader.at_eof() or self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncUpstreamPool:
+    """Пул keep-alive соединений для asyncio-режима.
+
+    Работает внутри одного цикла событий, поэтому блокировки не нужны.
+    Число одновременных подключений к серверам ограничено семафором,
+    чтобы всплеск клиентов не превращался в шторм SYN к серверам.
+    """
+
+    def __init__(self, max_idle_per_host, idle_timeout, max_age, connect_timeout,
+                 max_concurrent_connects, resolver):
+        self.resolver = resolver
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.connect_timeout = connect_timeout
+        self.connect_slots = asyncio.Semaphore(max_concurrent_connects)
+        self.idle = {}
+        self.reused = 0
+        self.created = 0
+        self.discarded = 0
+
+    async def acquire(self, host, port):
+        """Возвращает (соединение, было_ли_оно_в_пуле)"""
+        connections = self.idle.get((host, port))
+        while connections:
+            conn = connections.pop()
+            now = time.monotonic()
+            if (now - conn.last_used > self.idle_timeout
+                    or now - conn.created_at > self.max_age
+                    or not conn.is_alive()):
+                self.discarded += 1
+                conn.close()
+                continue
+            self.reused += 1
+            return conn, True
+
+        # Имя разрешаем до захвата слота, чтобы ожидание DNS не занимало его
+        addresses = await asyncio.wait_for(
+            self.resolver.resolve_async(host, port), self.connect_timeout)
+        async with self.connect_slots:
+            reader, writer = await open_connection_any(addresses, self.connect_timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.created += 1
+        return AsyncUpstreamConnection(reader, writer, host, port), False
+
+    def release(self, conn):
+        """Возвращает соединение в пул после полностью прочитанного ответа"""
+        conn.requests += 1
+        conn.last_used = time.monotonic()
+        if conn.last_used - conn.created_at > self.max_age or not conn.is_alive():
+            self.discarded += 1
+            conn.close()
+            return
+        connections = self.idle.setdefault((conn.host, conn.port), deque())
+        connections.append(conn)
+        if len(connections) > self.max_idle_per_host:
+            self.discarded += 1
+            connections.popleft().close()
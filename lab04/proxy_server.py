@@ -1,32 +1,131 @@
+import argparse
 import socket
+import sys
 import threading
-import re
+import time
 import datetime
+from dns_cache import DNSCache
+from http_parser import BODY_UNTIL_CLOSE, HTTPParseError, HeadReader, body_framer, \
+    is_interim_status, parse_request_head, parse_response_head, request_framing, \
+    response_framing
+from proxy_cache import ResponseCache
+from proxy_log import POLICY_BLOCK, POLICY_DROP, AccessLog
+from proxy_metrics import ProxyMetrics, start_admin_server
+from proxy_pool import UpstreamPool
+from proxy_tunnel import splice_tunnel
 
 # Конфигурация
 PROXY_HOST = '127.0.0.1'
 PROXY_PORT = 8080
+ADMIN_PORT = 9090  # порт служебного сервера метрик Prometheus (/metrics)
 LOG_FILE = 'proxy.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # размер, после которого журнал ротируется
+LOG_BACKUP_COUNT = 5  # сколько старых журналов хранить
+LOG_QUEUE_SIZE = 10000  # записей в очереди до срабатывания LOG_POLICY
+LOG_BATCH_SIZE = 512  # сколько записей фоновый поток пишет за раз
+LOG_POLICY = POLICY_DROP  # при переполнении очереди: drop или block
 BUFFER_SIZE = 8192
 TIMEOUT = 5  # секунды
+MAX_HEADER_SIZE = 64 * 1024  # предел размера заголовков запроса и ответа
+MAX_POOLED_BUFFERS = 256  # сколько буферов пересылки держать про запас
+TUNNEL_IDLE_TIMEOUT = 60  # туннель CONNECT без трафика закрывается
+CLIENT_IDLE_TIMEOUT = 15  # сколько ждать следующего запроса keep-alive клиента
+UPSTREAM_MAX_IDLE_PER_HOST = 8  # простаивающих соединений на один сервер
+UPSTREAM_IDLE_TIMEOUT = 30  # сколько соединение может простаивать в пуле
+UPSTREAM_MAX_AGE = 300  # предельный возраст соединения с сервером
+DNS_TTL = 60  # сколько помнить разрешенное имя
+DNS_NEGATIVE_TTL = 10  # сколько помнить ошибку разрешения имени
+DNS_STALE_TTL = 300  # сколько отдавать устаревший адрес, пока идет обновление
+DNS_MAX_ENTRIES = 4096  # имен в кеше DNS
+DNS_WORKERS = 8  # потоков для getaddrinfo
+CACHE_MAX_BYTES = 64 * 1024 * 1024  # общий размер кеша ответов
+CACHE_MAX_ENTRY_SIZE = 8 * 1024 * 1024  # ответы больше этого не кешируются
+CONTINUE_RESPONSE = b"HTTP/1.1 100 Continue\r\n\r\n"
 
-def log_request(client_addr, method, url, status_code):
+access_log = AccessLog(LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+                       LOG_BATCH_SIZE, LOG_POLICY)
+response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_MAX_ENTRY_SIZE)
+resolver = DNSCache(DNS_TTL, DNS_NEGATIVE_TTL, DNS_STALE_TTL, DNS_MAX_ENTRIES, DNS_WORKERS)
+upstream_pool = UpstreamPool(UPSTREAM_MAX_IDLE_PER_HOST, UPSTREAM_IDLE_TIMEOUT,
+                             UPSTREAM_MAX_AGE, TIMEOUT, resolver)
+relay_buffers = []  # свободные заранее выделенные буферы пересылки
+metrics = ProxyMetrics()
+
+def log_request(client_addr, method, url, status_code, cache_status=None, extra=None):
     """Записывает запрос в журнал"""
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] {client_addr} - {method} {url} - Status: {status_code}\n"
-    
-    print(log_entry.strip())  # Вывод в консоль
-    
-    with open(LOG_FILE, 'a') as f:
-        f.write(log_entry)
-
-def extract_host_and_path(request_line):
-    """Извлекает хост и путь из строки запроса"""
-    parts = request_line.split()
-    if len(parts) < 3:
-        return None, None
+    log_entry = f"[{timestamp}] {client_addr} - {method} {url} - Status: {status_code}"
+    if cache_status:
+        log_entry += f" - Cache: {cache_status} ({response_cache.stats()})"
+    if extra:
+        log_entry += f" - {extra}"
     
-    method, url, version = parts
+    # Запись в файл и вывод в консоль выполняет фоновый поток журнала
+    access_log.write(log_entry)
+    metrics.finish_request(method, status_code)
+
+def acquire_buffer():
+    """Берет свободный буфер пересылки или выделяет новый"""
+    try:
+        return relay_buffers.pop()
+    except IndexError:
+        return memoryview(bytearray(BUFFER_SIZE))
+
+def release_buffer(buffer):
+    """Возвращает буфер в пул для повторного использования"""
+    if len(relay_buffers) < MAX_POOLED_BUFFERS:
+        relay_buffers.append(buffer)
+
+def relay(src_socket, dst_socket, buffer, tee=None):
+    """Пересылает данные из src_socket в dst_socket, пока источник не закроется.
+
+    Читает в переданный буфер через recv_into и сразу отправляет прочитанное,
+    поэтому в памяти никогда не лежит больше одного буфера. Пока получатель
+    не принял данные, новые не читаются — так медленная сторона притормаживает
+    быструю через окно TCP. Копию данных дописывает в tee. Возвращает число байт.
+    """
+    total = 0
+    while True:
+        try:
+            received = src_socket.recv_into(buffer)
+        except socket.timeout:
+            break
+        if not received:
+            break
+        dst_socket.sendall(buffer[:received])
+        if tee is not None:
+            tee(buffer[:received])
+        total += received
+    return total
+
+def relay_message(src_socket, dst_socket, buffer, framer, tee=None):
+    """Пересылает тело сообщения до его конца, который определяет framer.
+
+    Работает так же, как relay(), но не пропускает дальше байты после конца
+    сообщения. Их (обычно это начало следующего запроса клиента) функция
+    возвращает; пустой результат значит, что лишнего не пришло.
+    """
+    while not framer.done:
+        size = framer.safe_read_size(len(buffer)) or len(buffer)
+        try:
+            received = src_socket.recv_into(buffer, size)
+        except socket.timeout:
+            break
+        if not received:
+            break
+        consumed = framer.feed(buffer[:received])
+        dst_socket.sendall(buffer[:consumed])
+        if tee is not None:
+            tee(buffer[:consumed])
+        if consumed < received:
+            return bytes(buffer[consumed:received])
+    return b''
+
+def extract_host_and_path(method, url):
+    """Извлекает хост и путь из цели запроса"""
+    # CONNECT указывает только host:port сервера, к которому нужен туннель
+    if method == 'CONNECT':
+        return url, ''
     
     # Если URL содержит полный адрес
     if url.startswith('http://'):
@@ -46,170 +145,445 @@ def extract_host_and_path(request_line):
     
     return host, path
 
-def forward_request(client_socket, client_addr):
-    """Обрабатывает запрос клиента и пересылает его на целевой сервер"""
-    try:
-        # Получаем данные от клиента
-        request_data = b''
-        while True:
-            chunk = client_socket.recv(BUFFER_SIZE)
-            if not chunk:
-                break
-            request_data += chunk
-            
-            # Проверяем, получили ли мы полный HTTP-запрос
-            if b'\r\n\r\n' in request_data:
-                # Если это POST запрос, нужно проверить Content-Length
-                headers_end = request_data.find(b'\r\n\r\n')
-                headers = request_data[:headers_end].decode('utf-8', errors='ignore')
-                
-                # Проверяем, это POST запрос?
-                if re.search(r'^POST', headers, re.MULTILINE):
-                    # Ищем Content-Length
-                    match = re.search(r'Content-Length: (\d+)', headers, re.MULTILINE)
-                    if match:
-                        content_length = int(match.group(1))
-                        # Проверяем, получили ли мы все тело запроса
-                        body_received = len(request_data) - headers_end - 4  # -4 для \r\n\r\n
-                        if body_received >= content_length:
-                            break
-                else:
-                    # Для GET запросов достаточно заголовков
-                    break
-        
-        if not request_data:
-            client_socket.close()
-            return
-        
-        # Разбираем заголовки запроса
-        headers_raw = request_data.split(b'\r\n\r\n')[0].decode('utf-8', errors='ignore')
-        headers_lines = headers_raw.split('\r\n')
-        
-        # Извлекаем метод, URL и версию HTTP
-        request_line = headers_lines[0]
-        method = request_line.split()[0]
+def wants_keep_alive(version, headers):
+    """Определяет, хочет ли сторона сохранить соединение после ответа"""
+    field = 'connection' if 'connection' in headers else 'proxy-connection'
+    if version == 'HTTP/1.1':
+        return not headers.has_token(field, 'close')
+    return headers.has_token(field, 'keep-alive')
+
+class ClientRequest:
+    """Разобранный запрос клиента к прокси.
+
+    rest — байты, пришедшие после заголовков. Относящаяся к телу часть
+    попадает в body, а все, что после конца тела, — в leftover: это
+    следующие запросы клиента на том же соединении.
+    """
+
+    def __init__(self, head, rest=b''):
+        self.method = head.method
+        self.version = head.version
+        self.headers = head.headers
+        self.keep_alive = wants_keep_alive(self.version, self.headers)
+        # Промежуточные ответы 1xx понимают только клиенты HTTP/1.1
+        self.accepts_interim = self.version != 'HTTP/1.0'
         
-        # Находим Host в заголовках
-        host_header = None
-        for line in headers_lines[1:]:
-            if line.lower().startswith('host:'):
-                host_header = line.split(':', 1)[1].strip()
-                break
+        # Конец тела определяем по Content-Length или chunked для любого метода;
+        # недополученную часть тела перешлем на сервер потоком
+        self.framer = body_framer(*request_framing(self.headers))
+        consumed = self.framer.feed(rest)
+        self.body = rest[:consumed]
+        self.leftover = rest[consumed:]
+        # Клиент ждет 100 Continue, прежде чем слать тело; его отвечает сам
+        # прокси, потому что дочитывает тело до того, как ждать ответа сервера
+        self.answer_continue = (self.accepts_interim and not self.framer.done
+                                and self.headers.has_token('expect', '100-continue'))
         
         # Извлекаем хост и путь из строки запроса
-        url_host, path = extract_host_and_path(request_line)
+        url_host, self.path = extract_host_and_path(self.method, head.target)
         
         # Используем хост из заголовка, если не найден в URL
-        target_host = url_host or host_header
-        
-        # Если хост все еще не найден, нельзя продолжить
+        target_host = url_host or self.headers.get('host')
+        self.target_host = target_host
+        # HTTP по умолчанию, для туннеля CONNECT — HTTPS
+        self.target_port = 443 if self.method == 'CONNECT' else 80
+        self.url = "Unknown"
         if not target_host:
-            response = b"HTTP/1.1 400 Bad Request\r\nContent-Length: 23\r\n\r\nMissing Host information"
-            client_socket.sendall(response)
-            log_request(client_addr, method, "Unknown", 400)
-            client_socket.close()
             return
         
         # Проверяем, есть ли указание порта
         if ':' in target_host:
-            target_host, target_port = target_host.split(':', 1)
-            target_port = int(target_port)
-        else:
-            target_port = 80  # HTTP по умолчанию
+            target_host, target_port = target_host.rsplit(':', 1)
+            self.target_host = target_host
+            try:
+                self.target_port = int(target_port)
+            except ValueError:
+                raise HTTPParseError(f"Некорректный порт: {target_port!r}")
         
-        # Формируем новую строку запроса с абсолютным путем
-        new_request_line = f"{method} {path} HTTP/1.1"
+        if self.method == 'CONNECT':
+            self.url = f"{self.target_host}:{self.target_port}"
+        elif self.target_port == 80:
+            self.url = f"http://{self.target_host}{self.path}"
+        else:
+            self.url = f"http://{self.target_host}:{self.target_port}{self.path}"
+
+def build_upstream_request(request, cache_entry):
+    """Формирует запрос к целевому серверу.
+
+    Возвращает (байты запроса вместе с полученной частью тела,
+    проверяется ли устаревшая копия из кеша).
+    """
+    # Убираем заголовки прокси и соединения, а также перечисленные в Connection
+    headers = request.headers.copy()
+    hop_by_hop = ['proxy-connection', 'connection', 'keep-alive']
+    if request.answer_continue:
+        # Тело пойдет на сервер сразу, ждать его 100 Continue незачем
+        hop_by_hop.append('expect')
+    for value in request.headers.get_all('connection'):
+        hop_by_hop.extend(token.strip() for token in value.split(',') if token.strip())
+    headers.remove(*hop_by_hop)
+    
+    # Устаревшую копию проверяем условным запросом, если клиент
+    # не прислал собственных валидаторов
+    revalidating = False
+    if cache_entry is not None and cache_entry.has_validators() and not (
+            'if-none-match' in request.headers or 'if-modified-since' in request.headers):
+        if cache_entry.etag:
+            headers.add('If-None-Match', cache_entry.etag)
+        if cache_entry.last_modified:
+            headers.add('If-Modified-Since', cache_entry.last_modified)
+        revalidating = True
+    
+    # Соединение с сервером держим открытым для следующих запросов
+    headers.add('Connection', 'keep-alive')
+    
+    # Формируем новую строку запроса с абсолютным путем
+    lines = [f"{request.method} {request.path} HTTP/1.1"] + headers.to_lines()
+    return '\r\n'.join(lines).encode('iso-8859-1') + b'\r\n\r\n' + request.body, revalidating
+
+def cached_response(cache_entry, request):
+    """Ответ из свежей копии кеша: 304, если копия у клиента совпадает с ней.
+
+    Возвращает (код ответа, байты ответа).
+    """
+    if cache_entry.matches_conditional(request.headers):
+        return 304, cache_entry.to_not_modified_response(request.keep_alive)
+    return cache_entry.status_code, cache_entry.to_response(request.keep_alive)
+
+def build_client_head(response_head, keep_alive):
+    """Собирает заголовки ответа клиенту, заменяя заголовки соединения"""
+    headers = response_head.headers.copy()
+    headers.remove('connection', 'keep-alive', 'proxy-connection')
+    headers.add('Connection', 'keep-alive' if keep_alive else 'close')
+    lines = [response_head.status_line] + headers.to_lines()
+    return '\r\n'.join(lines).encode('iso-8859-1') + b'\r\n\r\n'
+
+def build_interim_head(response_head):
+    """Собирает промежуточный ответ 1xx для клиента без заголовков соединения"""
+    headers = response_head.headers.copy()
+    headers.remove('connection', 'keep-alive', 'proxy-connection')
+    lines = [response_head.status_line] + headers.to_lines()
+    return '\r\n'.join(lines).encode('iso-8859-1') + b'\r\n\r\n'
+
+def error_response(status, message):
+    """Формирует ответ прокси с сообщением об ошибке"""
+    body = message.encode('utf-8')
+    return (f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n").encode('utf-8') + body
+
+def read_response_head(server_socket, buffer, data=b''):
+    """Читает ответ сервера, пока не будут получены все заголовки.
+
+    data — уже полученные байты ответа. Возвращает (полученные байты,
+    разобранные заголовки или None, начало тела, пришедшее вместе
+    с заголовками).
+    """
+    head_reader = HeadReader(MAX_HEADER_SIZE, data)
+    try:
+        while not head_reader.complete:
+            try:
+                received = server_socket.recv_into(buffer)
+            except socket.timeout:
+                break
+            if not received:
+                break
+            head_reader.feed(buffer[:received])
+        if head_reader.complete:
+            return (bytes(head_reader.buffer), parse_response_head(head_reader.head),
+                    head_reader.rest)
+    except HTTPParseError:
+        pass
+    return bytes(head_reader.buffer), None, b''
+
+def relay_response_body(server_socket, client_socket, buffer, framing, length, initial, tee):
+    """Пересылает тело ответа клиенту, соблюдая его границы.
+
+    initial — часть тела, пришедшая вместе с заголовками. Возвращает пару
+    (тело получено полностью, соединение с сервером можно переиспользовать).
+    """
+    if framing == BODY_UNTIL_CLOSE:
+        # Длина не указана: тело заканчивается закрытием соединения
+        client_socket.sendall(initial)
+        tee(initial)
+        relay(server_socket, client_socket, buffer, tee=tee)
+        return True, False
+    
+    framer = body_framer(framing, length)
+    consumed = framer.feed(initial)
+    client_socket.sendall(initial[:consumed])
+    tee(initial[:consumed])
+    extra = initial[consumed:]
+    if not framer.done:
+        extra = relay_message(server_socket, client_socket, buffer, framer, tee)
+    return framer.done, framer.done and not extra
+
+def open_tunnel(client_socket, client_addr, request):
+    """Открывает туннель CONNECT и пересылает байты в обе стороны"""
+    try:
+        started = time.monotonic()
+        server_socket = resolver.connect(request.target_host, request.target_port, TIMEOUT)
+        metrics.upstream_connected(time.monotonic() - started)
+    except socket.error as e:
+        error_message = f"Error connecting to {request.url}: {str(e)}"
+        client_socket.sendall(error_response("502 Bad Gateway", error_message))
+        log_request(client_addr, request.method, request.url, 502)
+        return
+    
+    try:
+        client_socket.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        # Клиент мог не дожидаться ответа и сразу прислать начало TLS
+        if request.leftover:
+            server_socket.sendall(request.leftover)
+        sent, received = splice_tunnel(client_socket, server_socket, TUNNEL_IDLE_TIMEOUT)
+        sent += len(request.leftover)
+    finally:
+        server_socket.close()
+    timing = metrics.current_request()
+    if timing is not None:
+        timing.received += sent
+        timing.sent += received
+    log_request(client_addr, request.method, request.url, 200,
+                extra=f"Tunnel: sent={sent} received={received}")
+
+def forward_request(client_socket, client_addr):
+    """Обслуживает соединение клиента, пока оно остается keep-alive"""
+    metrics.connection_opened()
+    client_socket.settimeout(CLIENT_IDLE_TIMEOUT)
+    buffer = acquire_buffer()
+    pending = b''
+    try:
+        keep_alive = True
+        while keep_alive:
+            pending, keep_alive = handle_request(client_socket, client_addr, buffer, pending)
+    finally:
+        # Закрываем соединение с клиентом
+        release_buffer(buffer)
+        client_socket.close()
+        metrics.connection_closed()
+
+def read_client_request(client_socket, buffer, request_data):
+    """Читает заголовки очередного запроса клиента и разбирает их.
+
+    Возвращает ClientRequest или None, если клиент закрыл соединение
+    или замолчал, не начав нового запроса.
+    """
+    head_reader = HeadReader(MAX_HEADER_SIZE, request_data)
+    while not head_reader.complete:
+        try:
+            received = client_socket.recv_into(buffer)
+        except socket.timeout:
+            # Клиент молчит дольше таймаута простоя
+            received = 0
+        if not received:
+            if head_reader.buffer.strip():
+                raise HTTPParseError("Соединение закрыто посреди заголовков")
+            return None
+        head_reader.feed(buffer[:received])
+    request = ClientRequest(parse_request_head(head_reader.head), head_reader.rest)
+    # Время запроса отсчитываем с момента получения заголовков
+    metrics.start_request(len(head_reader.buffer) - len(request.leftover))
+    return request
+
+def handle_request(client_socket, client_addr, buffer, request_data):
+    """Обрабатывает запрос клиента и пересылает его на целевой сервер.
+
+    request_data — байты, оставшиеся от предыдущего запроса на этом
+    соединении. Возвращает (остаток данных, продолжать ли соединение).
+    """
+    try:
+        # Получаем заголовки запроса от клиента
+        try:
+            request = read_client_request(client_socket, buffer, request_data)
+        except HTTPParseError as e:
+            client_socket.sendall(error_response("400 Bad Request", str(e)))
+            log_request(client_addr, "Unknown", "Unknown", 400)
+            return b'', False
+        if request is None:
+            return b'', False
+        timing = metrics.current_request()
+        method = request.method
+        url = request.url
         
-        # Собираем новые заголовки, убирая заголовки прокси
-        new_headers = [new_request_line]
-        for line in headers_lines[1:]:
-            if not line.lower().startswith(('proxy-connection:', 'connection:')):
-                new_headers.append(line)
+        # Если хост не найден, нельзя продолжить
+        if not request.target_host:
+            client_socket.sendall(error_response("400 Bad Request", "Missing Host information"))
+            log_request(client_addr, method, "Unknown", 400)
+            return b'', False
         
-        # Добавляем заголовок Connection: close
-        new_headers.append("Connection: close")
+        if method == 'CONNECT':
+            open_tunnel(client_socket, client_addr, request)
+            return b'', False
         
-        # Собираем новый запрос
-        if b'\r\n\r\n' in request_data:
-            request_body = request_data.split(b'\r\n\r\n', 1)[1]
-            new_request = '\r\n'.join(new_headers).encode('utf-8') + b'\r\n\r\n' + request_body
-        else:
-            new_request = '\r\n'.join(new_headers).encode('utf-8') + b'\r\n\r\n'
+        # Проверяем кеш: свежая копия отдается без обращения к серверу
+        cache_entry = None
+        cache_status = None
+        if method == 'GET':
+            cache_entry, fresh = response_cache.lookup(url, request.headers)
+            if fresh:
+                response_cache.record('HIT')
+                status_code, response = cached_response(cache_entry, request)
+                timing.count_sent(response)
+                client_socket.sendall(response)
+                log_request(client_addr, method, url, status_code, 'HIT')
+                return request.leftover, request.keep_alive
+            cache_status = 'MISS'
         
-        # Создаем сокет для связи с целевым сервером
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.settimeout(TIMEOUT)
+        new_request, revalidating = build_upstream_request(request, cache_entry)
+        target_host, target_port = request.target_host, request.target_port
         
+        upstream = None
+        response_started = False
+        status_code = "Unknown"
         try:
-            # Подключаемся к целевому серверу
-            server_socket.connect((target_host, target_port))
-            
-            # Отправляем запрос на сервер
-            server_socket.sendall(new_request)
-            
-            # Получаем ответ от сервера
-            response_data = b''
-            while True:
+            # Берем соединение из пула или подключаемся к целевому серверу.
+            # Сервер мог закрыть простаивавшее соединение, не дождавшись
+            # запроса; тогда повторяем запрос на новом соединении, если тело
+            # запроса целиком у нас и его не придется перечитывать у клиента
+            body_in_memory = request.framer.done
+            for attempt in range(2):
+                connect_started = time.monotonic()
+                upstream, reused = upstream_pool.acquire(target_host, target_port)
+                if not reused:
+                    metrics.upstream_connected(time.monotonic() - connect_started)
+                retry = reused and body_in_memory
                 try:
-                    chunk = server_socket.recv(BUFFER_SIZE)
-                    if not chunk:
-                        break
-                    response_data += chunk
-                except socket.timeout:
+                    # Отправляем запрос на сервер, остаток тела — потоком от клиента
+                    upstream.sock.sendall(new_request)
+                    if not request.framer.done:
+                        if request.answer_continue:
+                            timing.count_sent(CONTINUE_RESPONSE)
+                            client_socket.sendall(CONTINUE_RESPONSE)
+                        request.leftover = relay_message(
+                            client_socket, upstream.sock, buffer, request.framer,
+                            timing.count_received)
+                        if not request.framer.done:
+                            raise ConnectionError("Клиент не передал тело запроса целиком")
+                    
+                    # Получаем первый фрагмент ответа и дочитываем заголовки
+                    response_data, response_head, initial_body = read_response_head(
+                        upstream.sock, buffer)
+                except socket.error:
+                    if not retry:
+                        raise
+                    response_data, response_head, initial_body = b'', None, b''
+                if response_data or not retry:
                     break
+                upstream.close()
+                upstream = None
+            
+            # Промежуточные ответы 1xx пересылаем клиенту по мере прихода
+            # и ждем окончательный; тело и кеш относятся только к нему
+            while response_head is not None and is_interim_status(response_head.status):
+                if request.accepts_interim:
+                    interim_head = build_interim_head(response_head)
+                    timing.count_sent(interim_head)
+                    client_socket.sendall(interim_head)
+                response_data, response_head, initial_body = read_response_head(
+                    upstream.sock, buffer, initial_body)
+            
+            if response_head is None:
+                # Сервер не прислал корректных заголовков: отдаем что есть
+                timing.count_sent(response_data)
+                client_socket.sendall(response_data)
+                log_request(client_addr, method, url, status_code)
+                return b'', False
+            
+            # Код состояния для журнала берем из первого фрагмента ответа
+            status_code = str(response_head.status)
+            framing, length = response_framing(method, response_head.status, response_head.headers)
+            upstream_keep_alive = wants_keep_alive(response_head.version, response_head.headers)
+            
+            if revalidating and response_head.status == 304:
+                # Копия в кеше не изменилась: обновляем ее срок и отдаем клиенту
+                if upstream_keep_alive and not initial_body:
+                    upstream_pool.release(upstream)
+                    upstream = None
+                cache_entry = response_cache.revalidated(url, cache_entry, response_head.headers)
+                response_cache.record('REVALIDATED')
+                response = cache_entry.to_response(request.keep_alive)
+                timing.count_sent(response)
+                client_socket.sendall(response)
+                log_request(client_addr, method, url, cache_entry.status_code, 'REVALIDATED')
+                return request.leftover, request.keep_alive
+            
+            # Копим тело для кеша, пока оно укладывается в предел записи
+            cache_body = bytearray() if cache_status else None
+            
+            def tee(data):
+                nonlocal cache_body
+                timing.count_sent(data)
+                if cache_body is not None:
+                    if len(cache_body) + len(data) > response_cache.max_entry_size:
+                        cache_body = None
+                    else:
+                        cache_body += data
+            
+            # Клиенту можно сохранить соединение, только если известна длина ответа
+            keep_alive = request.keep_alive and framing != BODY_UNTIL_CLOSE
+            
+            # Отправляем клиенту заголовки и пересылаем тело потоком
+            response_started = True
+            client_head = build_client_head(response_head, keep_alive)
+            timing.count_sent(client_head)
+            client_socket.sendall(client_head)
+            complete, reusable = relay_response_body(
+                upstream.sock, client_socket, buffer, framing, length, initial_body, tee)
             
-            # Извлекаем код состояния для журнала
-            status_code = "Unknown"
-            status_match = re.search(rb'HTTP/\d\.\d (\d+)', response_data)
-            if status_match:
-                status_code = status_match.group(1).decode('utf-8')
+            if reusable and upstream_keep_alive:
+                upstream_pool.release(upstream)
+                upstream = None
             
-            # Отправляем клиенту ответ от сервера
-            client_socket.sendall(response_data)
+            if complete and cache_body is not None:
+                response_cache.store(url, request.headers, response_head.status,
+                                     response_head.status_line, response_head.headers,
+                                     bytes(cache_body))
+            if cache_status:
+                response_cache.record(cache_status)
             
             # Логируем запрос
-            url = f"http://{target_host}{path}"
-            log_request(client_addr, method, url, status_code)
+            log_request(client_addr, method, url, status_code, cache_status)
+            return request.leftover, keep_alive and complete
+            
+        except (socket.error, HTTPParseError) as e:
+            if response_started:
+                # Часть ответа уже ушла клиенту, сообщить об ошибке нельзя
+                log_request(client_addr, method, url, f"{status_code} (aborted: {e})")
+                return b'', False
             
-        except socket.error as e:
             # Обработка ошибок сетевого соединения
             error_message = f"Error connecting to {target_host}:{target_port}: {str(e)}"
-            response = f"HTTP/1.1 502 Bad Gateway\r\nContent-Length: {len(error_message)}\r\n\r\n{error_message}"
-            client_socket.sendall(response.encode('utf-8'))
+            client_socket.sendall(error_response("502 Bad Gateway", error_message))
             
             # Логируем ошибку
-            url = f"http://{target_host}{path}"
             log_request(client_addr, method, url, 502)
+            return b'', False
         
         finally:
-            server_socket.close()
+            if upstream is not None:
+                upstream.close()
             
     except Exception as e:
         # Обработка любых других ошибок
         error_message = f"Proxy error: {str(e)}"
         try:
-            response = f"HTTP/1.1 500 Internal Server Error\r\nContent-Length: {len(error_message)}\r\n\r\n{error_message}"
-            client_socket.sendall(response.encode('utf-8'))
+            client_socket.sendall(error_response("500 Internal Server Error", error_message))
             log_request(client_addr, "Unknown", "Unknown", 500)
         except:
             pass
-    
-    finally:
-        # Закрываем соединение с клиентом
-        client_socket.close()
+        return b'', False
 
-def start_proxy():
-    """Запускает прокси-сервер"""
+def start_proxy(host=PROXY_HOST, port=PROXY_PORT):
+    """Запускает прокси-сервер с отдельным потоком на каждое соединение"""
     # Создаем TCP сокет
     proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
     try:
         # Привязываем сокет к адресу и порту
-        proxy_socket.bind((PROXY_HOST, PROXY_PORT))
+        proxy_socket.bind((host, port))
         proxy_socket.listen(100)  # максимальное количество ожидающих соединений
         
-        print(f"Прокси-сервер запущен на {PROXY_HOST}:{PROXY_PORT}")
+        print(f"Прокси-сервер запущен на {host}:{port}")
         
         # Главный цикл обработки соединений
         while True:
@@ -238,9 +612,52 @@ def start_proxy():
         proxy_socket.close()
 
 if __name__ == "__main__":
+    # Регистрируем скрипт под именем модуля, чтобы proxy_async работал
+    # с теми же журналом, кешем и настройками, а не с их второй копией
+    sys.modules.setdefault('proxy_server', sys.modules[__name__])
+    
+    parser = argparse.ArgumentParser(description="Кеширующий HTTP прокси-сервер")
+    parser.add_argument('--host', default=PROXY_HOST, help="адрес для входящих соединений")
+    parser.add_argument('--port', type=int, default=PROXY_PORT, help="порт прокси-сервера")
+    parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads',
+                        help="поток на соединение или один цикл событий asyncio")
+    parser.add_argument('--backlog', type=int, default=4096,
+                        help="очередь ожидающих соединений (asyncio)")
+    parser.add_argument('--max-upstream-connects', type=int, default=256,
+                        help="одновременных подключений к серверам (asyncio)")
+    parser.add_argument('--log-policy', choices=[POLICY_DROP, POLICY_BLOCK], default=LOG_POLICY,
+                        help="что делать при переполнении очереди журнала (asyncio всегда drop)")
+    parser.add_argument('--quiet', action='store_true', help="не дублировать журнал в консоль")
+    parser.add_argument('--no-cache', action='store_true', help="не кешировать ответы")
+    parser.add_argument('--no-pool', action='store_true',
+                        help="не переиспользовать соединения с серверами")
+    parser.add_argument('--admin-port', type=int, default=ADMIN_PORT,
+                        help="порт метрик Prometheus на 127.0.0.1 (0 — не запускать)")
+    args = parser.parse_args()
+    
     # Создаем пустой файл журнала (или очищаем существующий)
     with open(LOG_FILE, 'w') as f:
         f.write("")
+    access_log.echo = not args.quiet
+    access_log.policy = args.log_policy
+    if args.no_cache:
+        # Запись любого размера превышает предел и не сохраняется
+        response_cache.max_bytes = response_cache.max_entry_size = 0
+    if args.no_pool:
+        UPSTREAM_MAX_IDLE_PER_HOST = 0
+        upstream_pool.max_idle_per_host = 0
+    
+    if args.admin_port:
+        start_admin_server(metrics, '127.0.0.1', args.admin_port)
     
     # Запускаем сервер
-    start_proxy()
+    try:
+        if args.mode == 'asyncio':
+            # Блокироваться на очереди журнала внутри цикла событий нельзя
+            access_log.policy = POLICY_DROP
+            from proxy_async import start_async_proxy
+            start_async_proxy(args.host, args.port, args.backlog, args.max_upstream_connects)
+        else:
+            start_proxy(args.host, args.port)
+    finally:
+        access_log.close()
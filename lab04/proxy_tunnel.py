@@ -0,0 +1,177 @@
+import asyncio
+import os
+import selectors
+import socket
+import time
+
+# os.splice переносит данные между сокетами через канал внутри ядра,
+# минуя память процесса (Linux, Python 3.10+)
+HAS_SPLICE = hasattr(os, 'splice')
+PIPE_SIZE = 64 * 1024
+BUFFER_SIZE = 64 * 1024
+
+
+class TunnelDirection:
+    """Одно направление туннеля: из сокета src в сокет dst"""
+
+    def __init__(self, src, dst, use_splice):
+        self.src = src
+        self.dst = dst
+        self.use_splice = use_splice
+        self.pending = 0  # прочитано, но еще не отправлено
+        self.eof = False
+        self.closed = False  # dst уже получил FIN
+        self.total = 0
+        if use_splice:
+            self.pipe_r, self.pipe_w = os.pipe()
+        else:
+            self.buffer = memoryview(bytearray(BUFFER_SIZE))
+            self.offset = 0
+
+    def fill(self):
+        """Читает из src столько, сколько есть; False, если данных пока нет"""
+        try:
+            if self.use_splice:
+                received = os.splice(self.src.fileno(), self.pipe_w, PIPE_SIZE,
+                                     flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            else:
+                received = self.src.recv_into(self.buffer)
+                self.offset = 0
+        except (BlockingIOError, InterruptedError):
+            return False
+        if received == 0:
+            self.eof = True
+        self.pending = received
+        self.total += received
+        return True
+
+    def flush(self):
+        """Отправляет в dst накопленное; остаток ждет готовности dst к записи"""
+        while self.pending:
+            try:
+                if self.use_splice:
+                    sent = os.splice(self.pipe_r, self.dst.fileno(), self.pending,
+                                     flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                else:
+                    sent = self.dst.send(self.buffer[self.offset:self.offset + self.pending])
+                    self.offset += sent
+            except (BlockingIOError, InterruptedError):
+                return
+            self.pending -= sent
+        if self.eof and not self.closed:
+            # Передаем полузакрытие дальше: вторая сторона может еще отвечать
+            self.closed = True
+            try:
+                self.dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    @property
+    def done(self):
+        return self.closed
+
+    def close(self):
+        if self.use_splice:
+            os.close(self.pipe_r)
+            os.close(self.pipe_w)
+
+
+def splice_tunnel(client_socket, server_socket, idle_timeout):
+    """Пересылает байты в обе стороны, пока обе стороны не закроют соединение.
+
+    Работает в одном потоке на неблокирующих сокетах: направление читает
+    из источника, только когда его предыдущая порция целиком ушла
+    получателю, так что память на туннель ограничена одним каналом или
+    буфером на направление. Туннель закрывается, если idle_timeout секунд
+    не было никакой активности. Возвращает (байт к серверу, байт к клиенту).
+    """
+    use_splice = HAS_SPLICE
+    upstream = TunnelDirection(client_socket, server_socket, use_splice)
+    downstream = TunnelDirection(server_socket, client_socket, use_splice)
+    directions = (upstream, downstream)
+    client_socket.setblocking(False)
+    server_socket.setblocking(False)
+
+    selector = selectors.DefaultSelector()
+    registered = {}
+    try:
+        while not (upstream.done and downstream.done):
+            # Источник читаем, только когда канал направления пуст,
+            # иначе ждем, пока получатель будет готов принять остаток
+            interest = {client_socket: 0, server_socket: 0}
+            for direction in directions:
+                if direction.pending:
+                    interest[direction.dst] |= selectors.EVENT_WRITE
+                elif not direction.eof:
+                    interest[direction.src] |= selectors.EVENT_READ
+            for sock, events in interest.items():
+                current = registered.get(sock, 0)
+                if current == events:
+                    continue
+                if not events:
+                    selector.unregister(sock)
+                    del registered[sock]
+                    continue
+                if current:
+                    selector.modify(sock, events)
+                else:
+                    selector.register(sock, events)
+                registered[sock] = events
+
+            if not registered:
+                break
+            ready = selector.select(idle_timeout)
+            if not ready:
+                break  # туннель простаивает слишком долго
+
+            for key, mask in ready:
+                for direction in directions:
+                    if mask & selectors.EVENT_READ and key.fileobj is direction.src \
+                            and not direction.pending and not direction.eof:
+                        if direction.fill():
+                            direction.flush()
+                    if mask & selectors.EVENT_WRITE and key.fileobj is direction.dst:
+                        direction.flush()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        selector.close()
+        for direction in directions:
+            direction.close()
+    return upstream.total, downstream.total
+
+
+async def pump(reader, writer, activity, idle_timeout):
+    """Пересылает данные одного направления туннеля в asyncio-режиме"""
+    total = 0
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(BUFFER_SIZE), idle_timeout)
+            except asyncio.TimeoutError:
+                # Молчит только это направление — туннель еще жив,
+                # если в обратную сторону недавно шли данные
+                if time.monotonic() - activity[0] >= idle_timeout:
+                    break
+                continue
+            if not data:
+                break
+            activity[0] = time.monotonic()
+            total += len(data)
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        pass
+    return total
+
+
+async def async_tunnel(client_reader, client_writer, server_reader, server_writer,
+                       idle_timeout):
+    """Двунаправленный туннель на потоках asyncio; возвращает (к серверу, к клиенту)"""
+    activity = [time.monotonic()]
+    return await asyncio.gather(
+        pump(client_reader, server_writer, activity, idle_timeout),
+        pump(server_reader, client_writer, activity, idle_timeout),
+    )
@@ -0,0 +1,185 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+import proxy_async
+import proxy_server
+from proxy_pool import AsyncUpstreamPool
+
+HOST = '127.0.0.1'
+
+
+def read_until(sock, marker):
+    data = b''
+    while marker not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_response(sock, data=b''):
+    """Читает ответ с Content-Length; возвращает (заголовки, тело)"""
+    while b'\r\n\r\n' not in data:
+        data += sock.recv(4096)
+    head, body = data.split(b'\r\n\r\n', 1)
+    length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+    while len(body) < length:
+        body += sock.recv(4096)
+    return head, body
+
+
+def start_listener(serve):
+    """Слушающий сокет, каждое соединение которого обслуживает serve в потоке"""
+    listener = socket.create_server((HOST, 0))
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener
+
+
+def serve_continue(conn):
+    """Сервер-источник: 100 Continue сразу после заголовков, 200 после тела"""
+    with conn:
+        data = read_until(conn, b'\r\n\r\n')
+        head, body = data.split(b'\r\n\r\n', 1)
+        conn.sendall(b'HTTP/1.1 100 Continue\r\n\r\n')
+        length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+        while len(body) < length:
+            body += conn.recv(4096)
+        reply = b'got ' + body
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(reply), reply))
+        read_until(conn, b'\r\n\r\n')
+
+
+CACHED_HEADERS = (b'ETag: "v1"\r\nLast-Modified: Mon, 05 Oct 2026 10:00:00 GMT\r\n'
+                  b'Cache-Control: max-age=60\r\n')
+origin_requests = []
+
+
+def serve_cacheable(conn):
+    """Сервер-источник: кешируемые ответы keep-alive с ETag и Last-Modified"""
+    with conn:
+        buffer = b''
+        while True:
+            while b'\r\n\r\n' not in buffer:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buffer += data
+            head, buffer = buffer.split(b'\r\n\r\n', 1)
+            origin_requests.append(head.split(b' ')[1])
+            conn.sendall(b'HTTP/1.1 200 OK\r\n' + CACHED_HEADERS + b'Content-Length: 2\r\n\r\nok')
+
+
+@pytest.fixture(autouse=True)
+def quiet_log(tmp_path):
+    proxy_server.access_log.echo = False
+    if proxy_server.access_log.thread is None:
+        proxy_server.access_log.path = str(tmp_path / 'proxy.log')
+
+
+@pytest.fixture
+def origin():
+    listener = start_listener(serve_continue)
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.fixture
+def cacheable_origin():
+    listener = start_listener(serve_cacheable)
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.fixture
+def threaded_proxy():
+    listener = start_listener(lambda conn: proxy_server.forward_request(conn, 'test'))
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+@pytest.fixture
+def async_proxy():
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def serve():
+        proxy_async.upstream_pool = AsyncUpstreamPool(0, 1, 1, 5, 16, proxy_server.resolver)
+        state['server'] = await asyncio.start_server(proxy_async.handle_connection, HOST, 0)
+        started.set()
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(serve(), loop)
+    started.wait(5)
+    yield state['server'].sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(state['server'].close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def post_with_continue(proxy_port, origin_port):
+    with socket.create_connection((HOST, proxy_port), timeout=5) as client:
+        client.sendall(b'POST http://%s:%d/upload HTTP/1.1\r\nHost: %s:%d\r\n'
+                       b'Content-Length: 5\r\nExpect: 100-continue\r\n\r\n'
+                       % (HOST.encode(), origin_port, HOST.encode(), origin_port))
+        interim = read_until(client, b'\r\n\r\n')
+        assert interim.startswith(b'HTTP/1.1 100 ')
+        client.sendall(b'hello')
+        rest = interim.split(b'\r\n\r\n', 1)[1]
+        # Клиенту могли прийти 100 и от прокси, и от сервера
+        while rest.startswith(b'HTTP/1.1 100 ') or not rest:
+            if b'\r\n\r\n' in rest:
+                rest = rest.split(b'\r\n\r\n', 1)[1]
+            else:
+                rest += client.recv(4096)
+        return read_response(client, rest)
+
+
+@pytest.mark.parametrize('proxy', ['threaded_proxy', 'async_proxy'])
+def test_interim_response_is_followed_by_final(request, proxy, origin):
+    head, body = post_with_continue(request.getfixturevalue(proxy), origin)
+    assert head.startswith(b'HTTP/1.1 200 ')
+    assert body == b'got hello'
+
+
+@pytest.mark.parametrize('proxy', ['threaded_proxy', 'async_proxy'])
+@pytest.mark.parametrize('condition, status', [
+    ('If-None-Match: "v1"', b'304'),
+    ('If-None-Match: W/"v0", W/"v1"', b'304'),
+    ('If-None-Match: "v2"', b'200'),
+    ('If-Modified-Since: Mon, 05 Oct 2026 10:00:00 GMT', b'304'),
+    ('If-Modified-Since: Sun, 04 Oct 2026 10:00:00 GMT', b'200'),
+])
+def test_cache_hit_answers_conditional_request(request, proxy, cacheable_origin,
+                                               condition, status):
+    port = request.getfixturevalue(proxy)
+    path = f'/{proxy}/{len(origin_requests)}'
+    url = f'http://{HOST}:{cacheable_origin}{path}'.encode()
+    with socket.create_connection((HOST, port), timeout=5) as client:
+        client.sendall(b'GET %s HTTP/1.1\r\nHost: x\r\n\r\n' % url)
+        head, body = read_response(client)
+        assert head.startswith(b'HTTP/1.1 200') and body == b'ok'
+
+        client.sendall(b'GET %s HTTP/1.1\r\nHost: x\r\n%s\r\n\r\n' % (url, condition.encode()))
+        data = read_until(client, b'\r\n\r\n')
+        assert data.startswith(b'HTTP/1.1 ' + status)
+        if status == b'304':
+            assert b'ETag: "v1"' in data and b'Content-Length' not in data
+        else:
+            assert read_response(client, data)[1] == b'ok'
+    # Оба ответа — из одного запроса к источнику
+    assert origin_requests.count(path.encode()) == 1